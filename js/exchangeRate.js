@@ -1,10 +1,11 @@
-import { CONFIG } from './config.js';
+import { CONFIG, getApiConfig } from './config.js';
 import { Utils } from './utils.js';
 
 // 汇率管理模块
 export class ExchangeRateManager {
   constructor() {
     this.cache = new Map();
+    this.pending = new Map(); // 同一币种进行中的请求，三个表单共用
     this.cacheTimeout = 5 * 60 * 1000; // 5分钟缓存
     this.retryAttempts = 3; // 重试次数
     this.retryDelay = 1000; // 重试延迟（毫秒）
@@ -18,8 +19,7 @@ export class ExchangeRateManager {
   
   // 获取汇率（通用方法）
   async fetchExchangeRate(currency, formType = 'new') {
-    const cacheKey = `${currency}_${formType}`;
-    const cached = this.cache.get(cacheKey);
+    const cached = this.cache.get(currency);
     
     if (cached && (Date.now() - cached.timestamp) < this.cacheTimeout) {
       this.updateUI(currency, cached.rate, formType);
@@ -27,8 +27,8 @@ export class ExchangeRateManager {
     }
     
     try {
-      const rate = await this.fetchFromAPIWithRetry(currency);
-      this.cache.set(cacheKey, { rate, timestamp: Date.now() });
+      const rate = await this.fetchShared(currency);
+      this.cache.set(currency, { rate, timestamp: Date.now() });
       this.updateUI(currency, rate, formType);
       return rate;
     } catch (error) {
@@ -40,6 +40,15 @@ export class ExchangeRateManager {
     }
   }
   
+  // 同一币种只发一次请求，各表单共用结果
+  fetchShared(currency) {
+    if (!this.pending.has(currency)) {
+      const request = this.fetchFromAPIWithRetry(currency).finally(() => this.pending.delete(currency));
+      this.pending.set(currency, request);
+    }
+    return this.pending.get(currency);
+  }
+  
   // 带重试机制的API获取
   async fetchFromAPIWithRetry(currency) {
     let lastError;
@@ -65,8 +74,14 @@ export class ExchangeRateManager {
     return new Promise(resolve => setTimeout(resolve, ms));
   }
   
-  // 从API获取汇率
+  // 从后端汇率服务获取（所有用户共用后端缓存），后端不可用时直接请求汇率API
   async fetchFromAPI(currency) {
+    try {
+      return await this.fetchFromBackend(currency);
+    } catch (error) {
+      console.warn('后端汇率服务不可用，直接请求汇率API:', error.message);
+    }
+    
     const { BASE_URL, MAIN_APP_ID, BACKUP_APP_ID } = CONFIG.API.EXCHANGE_RATE;
     
     try {
@@ -98,6 +113,22 @@ export class ExchangeRateManager {
     }
   }
   
+  // 后端汇率服务
+  async fetchFromBackend(currency) {
+    const response = await fetch(`${getApiConfig().BASE_URL}/api/exchange-rate?currency=${encodeURIComponent(currency)}`);
+    if (!response.ok) {
+      throw new Error(`${response.status}`);
+    }
+    const data = await response.json();
+    
+    // 后端也只有降级汇率时改为直接请求汇率API
+    if (!data || data.source === 'fallback' || !(data.rate > 0)) {
+      throw new Error('no rate');
+    }
+    
+    return data.rate;
+  }
+  
   // 计算汇率
   calculateRate(rates, currency) {
     let rate = 0;
@@ -247,6 +278,7 @@ export class ExchangeRateManager {
   // 清除缓存
   clearCache() {
     this.cache.clear();
+    this.pending.clear();
   }
   
   // 获取缓存状态
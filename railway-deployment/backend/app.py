@@ -2,29 +2,210 @@
 """
 Railway入口文件 - 直接包含Flask应用
 """
+import time
+# 启动计时起点，用于统计启动到就绪、启动到首份合同的耗时
+BOOT_STARTED = time.perf_counter()
+
 import sys
 import os
 import io
 
-# 导入必要的模块
-from flask import Flask, request, jsonify, send_file
+# 导入必要的模块（openpyxl、numpy、pypinyin等较慢的导入推迟到预热阶段或首次使用时）
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
-import openpyxl
-from openpyxl import load_workbook
 from datetime import datetime
 import logging
-import tempfile
 import json
+import threading
+import multiprocessing
+from concurrent.futures import wait as wait_futures
+
+from render_cache import RenderCache, plan_cache_key
+from catalog import CarCatalog, parse_version_token
+from catalog_facets import CATEGORY_FACETS, RANGE_FACETS
+from catalog_similar import SIMILAR_FILTER_FACETS
+from catalog_payloads import BrandPayloads
+from price_history import PriceHistory, parse_time
+from template_registry import TemplateRegistry, UnknownTemplateError
+from exchange_rates import ExchangeRateService, OpenExchangeRatesFetcher, CircuitBreaker, DEFAULT_API_URL, DEFAULT_APP_IDS
+from log_pipeline import LogPipeline, ContractLogger, DEFAULT_REDACT_FIELDS
+from metrics import MetricsRegistry, collect_stages, stage
+from boot import BootSequence, WARMUP_MODES
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# 日志由后台线程格式化和写出，队列满时丢弃
+log_pipeline = LogPipeline(int(os.environ.get('LOG_QUEUE_SIZE', 10000))).start()
+boot = BootSequence(BOOT_STARTED)
+boot.mark('import', boot.since_start_ms())
 
 app = Flask(__name__)
 CORS(app, origins=['*'], methods=['GET', 'POST', 'OPTIONS'], allow_headers=['Content-Type', 'Authorization'])
 
 # 配置
 TEMPLATE_PATH = 'api/template.xlsx'
+# 合同模板注册表（模板ID -> 模板文件和字段布局），文件不存在时只使用TEMPLATE_PATH一个默认模板
+TEMPLATE_REGISTRY = os.environ.get('TEMPLATE_REGISTRY', 'api/templates.json')
+
+# 合同生成引擎：openpyxl（默认）或 fast（预编译模板直接拼接XML）
+CONTRACT_ENGINE = os.environ.get('CONTRACT_ENGINE', 'openpyxl')
+
+# 批量生成单次最多合同数
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 100))
+
+# 渲染进程池：进程数为0时在请求线程内渲染（开发服务器默认），gunicorn配置默认按CPU核数启动
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 0))
+# 排队+执行中的最大合同数，超过后单个请求返回429
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', max(RENDER_WORKERS, 1) * 4))
+# 单份合同等待渲染结果的超时时间（秒）
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 60))
+
+# 渲染结果缓存：字节预算（0为禁用）、最大条目数、过期时间（秒）
+RENDER_CACHE_MAX_BYTES = int(os.environ.get('RENDER_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RENDER_CACHE_MAX_ENTRIES = int(os.environ.get('RENDER_CACHE_MAX_ENTRIES', 1000))
+RENDER_CACHE_TTL = float(os.environ.get('RENDER_CACHE_TTL', 600))
+
+# 车型数据目录（brands.json和各品牌文件），默认使用仓库根目录下的data
+CATALOG_DATA_DIR = os.environ.get(
+    'CATALOG_DATA_DIR',
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data'))
+)
+# 车型数据变化检查间隔（秒），0为不检查
+CATALOG_WATCH_INTERVAL = float(os.environ.get('CATALOG_WATCH_INTERVAL', 5))
+# 车型目录变更日志保留的版本数，更早的版本需要全量同步
+CATALOG_CHANGELOG_SIZE = int(os.environ.get('CATALOG_CHANGELOG_SIZE', 100))
+# 启动时打包目录不存在或已过期则在后台重新生成（1/0），数据目录需要可写
+CATALOG_BUILD_PACK = int(os.environ.get('CATALOG_BUILD_PACK', 1))
+# 数据文件预压缩的brotli质量（0-11）
+CATALOG_BROTLI_QUALITY = int(os.environ.get('CATALOG_BROTLI_QUALITY', 9))
+# 配置价格历史目录，由采集后的 price_history.py ingest 写入
+PRICE_HISTORY_DIR = os.environ.get('PRICE_HISTORY_DIR', os.path.join(CATALOG_DATA_DIR, 'price-history'))
+# 车型搜索每页最多结果数
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 100))
+# 相似配置查询最多返回的配置数
+SIMILAR_MAX_K = int(os.environ.get('SIMILAR_MAX_K', 50))
+# 批量报价单次最多计算的配置数
+QUOTE_MAX_ROWS = int(os.environ.get('QUOTE_MAX_ROWS', 20000))
+# 汇率上游接口和app_id（逗号分隔，依次尝试），可指向本地模拟服务测试
+EXCHANGE_RATE_API_URL = os.environ.get('EXCHANGE_RATE_API_URL', DEFAULT_API_URL)
+EXCHANGE_RATE_APP_IDS = [app_id.strip() for app_id in os.environ.get(
+    'EXCHANGE_RATE_APP_IDS', ','.join(DEFAULT_APP_IDS)).split(',') if app_id.strip()]
+# 汇率缓存时间（秒），过期后stale_ttl秒内先返回旧汇率并在后台刷新
+EXCHANGE_RATE_TTL = float(os.environ.get('EXCHANGE_RATE_TTL', 300))
+EXCHANGE_RATE_STALE_TTL = float(os.environ.get('EXCHANGE_RATE_STALE_TTL', 86400))
+EXCHANGE_RATE_TIMEOUT = float(os.environ.get('EXCHANGE_RATE_TIMEOUT', 5))
+# 上游连续失败次数达到阈值后熔断，冷却期（秒）内不请求上游
+EXCHANGE_RATE_BREAKER_FAILURES = int(os.environ.get('EXCHANGE_RATE_BREAKER_FAILURES', 3))
+EXCHANGE_RATE_BREAKER_COOLDOWN = float(os.environ.get('EXCHANGE_RATE_BREAKER_COOLDOWN', 60))
+
+# 合同数据日志：每个请求记录合同号和商品行数，完整数据按采样率记录，并脱敏、截断
+contract_logger = ContractLogger(
+    logger,
+    sample_rate=float(os.environ.get('CONTRACT_LOG_SAMPLE_RATE', 0.1)),
+    redact_fields=[field.strip() for field in os.environ.get(
+        'CONTRACT_LOG_REDACT_FIELDS', ','.join(DEFAULT_REDACT_FIELDS)).split(',') if field.strip()],
+    max_goods_rows=int(os.environ.get('CONTRACT_LOG_MAX_GOODS_ROWS', 3)),
+    max_chars=int(os.environ.get('CONTRACT_LOG_MAX_CHARS', 2000))
+)
+
+# 预热方式：background（后台线程）、blocking（导入时同步完成）、lazy（首次使用时加载）
+WARMUP_MODE = os.environ.get('WARMUP_MODE', 'background')
+if WARMUP_MODE not in WARMUP_MODES:
+    logger.warning(f"未知的预热方式 {WARMUP_MODE}，使用background")
+    WARMUP_MODE = 'background'
+
+# 注册表只是JSON，启动时读取；各模板的缓存在预热阶段解析一次，之后每个请求使用独立副本
+template_registry = TemplateRegistry.load(TEMPLATE_REGISTRY, TEMPLATE_PATH)
+# 渲染器和进程池在预热阶段或首次使用时创建（需要导入openpyxl）
+renderer = None
+render_pool = None
+# 推迟的导入统一在这个锁内进行：openpyxl内部有循环导入，预热线程和请求线程同时首次导入会报错
+_import_lock = threading.RLock()
+
+def contract_services():
+    """导入渲染模块并创建渲染器和进程池（只执行一次），返回 (renderer, render_pool)"""
+    global renderer, render_pool
+    if render_pool is None:
+        with _import_lock:
+            if render_pool is None:
+                from contract_renderer import ContractRenderer
+                from render_pool import RenderPool
+                renderer = ContractRenderer(template_registry, CONTRACT_ENGINE)
+                render_pool = RenderPool(template_registry, CONTRACT_ENGINE, RENDER_WORKERS,
+                                         max_pending=RENDER_QUEUE_SIZE, inline_renderer=renderer)
+    return renderer, render_pool
+
+render_cache = RenderCache(RENDER_CACHE_MAX_BYTES, RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_TTL)
+# 车型目录：加载一次并建立搜索索引，品牌文件变化时增量更新
+car_catalog = CarCatalog(CATALOG_DATA_DIR, CATALOG_WATCH_INTERVAL, CATALOG_CHANGELOG_SIZE)
+# 车型数据文件：内容哈希ETag + 预压缩的gzip/brotli版本
+brand_payloads = BrandPayloads(CATALOG_DATA_DIR, brotli_quality=CATALOG_BROTLI_QUALITY)
+# 配置价格历史：只读，段文件变化时重新加载
+price_history = PriceHistory(PRICE_HISTORY_DIR)
+# 汇率：所有用户共用缓存，同一币种的并发请求只请求一次上游
+exchange_rates = ExchangeRateService(
+    OpenExchangeRatesFetcher(EXCHANGE_RATE_API_URL, EXCHANGE_RATE_APP_IDS, EXCHANGE_RATE_TIMEOUT),
+    ttl=EXCHANGE_RATE_TTL,
+    stale_ttl=EXCHANGE_RATE_STALE_TTL,
+    breaker=CircuitBreaker(EXCHANGE_RATE_BREAKER_FAILURES, EXCHANGE_RATE_BREAKER_COOLDOWN)
+)
+
+# 合同生成各阶段耗时、进行中的请求数和错误计数，由 /metrics 导出
+metrics_registry = MetricsRegistry()
+contract_request_seconds = metrics_registry.histogram(
+    'contract_request_seconds', '合同生成请求总耗时', ('status', 'cache'))
+contract_stage_seconds = metrics_registry.histogram(
+    'contract_stage_seconds', '合同生成各阶段耗时', ('stage',))
+contract_in_flight = metrics_registry.gauge('contract_requests_in_flight', '正在处理的合同生成请求数')
+contract_errors = metrics_registry.counter('contract_errors_total', '合同生成失败次数', ('status',))
+metrics_registry.gauge('render_pool_pending', '渲染进程池排队+执行中的合同数', callback=lambda: render_pool.pending if render_pool else 0)
+metrics_registry.gauge('render_cache_bytes', '渲染结果缓存占用字节数', callback=lambda: render_cache.total_bytes)
+metrics_registry.gauge('log_records_dropped', '日志队列已满时丢弃的日志条数',
+                       callback=lambda: log_pipeline.handler.dropped)
+metrics_registry.gauge('catalog_version', '车型目录索引版本', callback=lambda: car_catalog.version)
+
+def catalog_files():
+    """brands.json中列出的品牌文件名"""
+    return {brand.get('file') for brand in car_catalog.index().brands}
+
+def warm_template():
+    if template_registry.any_exists():
+        contract_services()[0].warm()
+
+def warm_render_pool():
+    """启动渲染进程并等待各进程完成模板预热"""
+    if template_registry.any_exists():
+        wait_futures(contract_services()[1].prestart())
+
+def warm_catalog():
+    if car_catalog.available():
+        car_catalog.index()
+        car_catalog.start_watcher()
+        # 打包目录不随数据提交，在部署后首次启动时生成，之后的启动和其他工作进程直接使用
+        if CATALOG_BUILD_PACK and not car_catalog.packed:
+            threading.Thread(target=car_catalog.build_pack, name='catalog-pack', daemon=True).start()
+        # 数据文件预压缩较慢，不影响就绪状态
+        threading.Thread(target=brand_payloads.prebuild, args=(catalog_files(),),
+                         name='catalog-prebuild', daemon=True).start()
+
+def warm_quote_engine():
+    with _import_lock:
+        import quote_engine
+
+# (名称, 预热函数, 是否必需)：只有合同渲染器和模板是就绪的前提，
+# 渲染进程池预热失败时在首次渲染时重建，车型目录和报价引擎失败只影响对应接口
+BOOT_PHASES = [
+    ('renderer', contract_services, True),
+    ('template', warm_template, True),
+    ('render_pool', warm_render_pool, False),
+    ('catalog', warm_catalog, False),
+    ('quote_engine', warm_quote_engine, False),
+]
+
+# 渲染子进程（spawn）会重新导入本模块，只在主进程中预热
+if multiprocessing.parent_process() is None:
+    boot.start(BOOT_PHASES, WARMUP_MODE)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -36,6 +217,12 @@ def health_check():
         'platform': 'Railway'
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """就绪检查：预热完成且合同渲染器和模板可用时返回200，否则返回503；可选阶段失败列在degraded中"""
+    status = boot.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 @app.route('/api/generate-contract', methods=['GET', 'POST', 'OPTIONS'])
 def generate_contract():
     """生成合同Excel文件"""
@@ -52,235 +239,444 @@ def generate_contract():
             'platform': 'Railway'
         })
     
-    # 处理POST请求
+    # 处理POST请求，记录各阶段耗时并附加Server-Timing响应头
+    with contract_in_flight.track(), collect_stages() as timings:
+        response = app.make_response(render_contract_response())
+    cache_status = response.headers.get('X-Render-Cache', 'none')
+    response.headers['Server-Timing'] = timings.server_timing({'render_cache': cache_status})
+    for name, seconds in timings.stages.items():
+        contract_stage_seconds.observe(seconds, name)
+    contract_request_seconds.observe(timings.elapsed(), str(response.status_code), cache_status)
+    if response.status_code >= 400:
+        contract_errors.inc(str(response.status_code))
+    elif response.status_code == 200:
+        boot.first_contract()
+    return response
+
+def render_contract_response():
+    """生成单份合同的响应，各阶段耗时计入当前请求"""
+    # 预热尚未完成时在这里等待渲染模块导入和渲染器创建
+    contract_services()
+    from contract_renderer import validate_contract_data
+    from render_pool import PoolSaturatedError, RenderTimeoutError
     try:
         # 获取请求数据
-        data = request.get_json()
-        logger.info(f"收到合同数据: {data}")
-        
-        if not data:
-            return jsonify({'error': '未收到数据'}), 400
+        with stage('parse'):
+            data = request.get_json()
+        with stage('log'):
+            contract_logger.log_request(data)
         
         # 验证必要字段
-        if not data.get('buyerName') or not data.get('contractNumber'):
-            return jsonify({'error': 'Missing required fields: buyerName, contractNumber'}), 400
+        error = validate_contract_data(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # 加载模板文件
-        if not os.path.exists(TEMPLATE_PATH):
+        # 按templateId选择模板，未指定时使用默认模板
+        try:
+            engines = renderer.template(data.get('templateId'))
+        except UnknownTemplateError as e:
+            return jsonify({'error': str(e)}), 400
+        if not engines.spec.exists():
             return jsonify({'error': '模板文件不存在'}), 404
         
-        # 使用openpyxl加载工作簿
-        workbook = load_workbook(TEMPLATE_PATH)
-        
-        # 获取两个sheet
-        sc_sheet = workbook['SC']  # SC sheet
-        pi_sheet = workbook['PI']  # PI sheet
-        
-        # 填充基础信息
-        buyer_name = data.get('buyerName', '')
-        buyer_phone = data.get('buyerPhone', '')
-        buyer_address = data.get('buyerAddress', '')
-        seller_name = data.get('sellerName', '')
-        seller_phone = data.get('sellerPhone', '')
-        seller_address = data.get('sellerAddress', '')
-        contract_number = data.get('contractNumber', '')
-        contract_date_raw = data.get('contractDate', '')
-        contract_location = data.get('contractLocation', '')
-        bank_info = data.get('bankInfo', '')
-        
-        # 处理日期格式
-        if contract_date_raw:
-            try:
-                date_obj = datetime.strptime(contract_date_raw, '%Y-%m-%d')
-                contract_date = date_obj.strftime('%Y.%m.%d')
-            except:
-                contract_date = contract_date_raw
-        else:
-            contract_date = datetime.now().strftime('%Y.%m.%d')
-        
-        # 安全填充单元格的函数
-        def safe_set_cell_value(sheet, cell_address, value):
-            """安全地设置单元格值，处理合并单元格，并确保字体不加粗"""
+        # 把请求数据按模板布局转换为填充计划，两种生成引擎共用
+        with stage('plan'):
+            plan = renderer.plan(data)
+            output_filename = plan['filename']
+            # 相同的规范化数据得到相同的内容哈希，作为缓存键和ETag
+            cache_key = plan_cache_key(plan, engines.template_cache.fingerprint(), CONTRACT_ENGINE)
+        if request.if_none_match.contains(cache_key):
+            response = app.response_class(status=304)
+            response.set_etag(cache_key)
+            return response
+
+        with stage('cache'):
+            file_content = render_cache.get(cache_key)
+        cache_status = 'hit'
+        if file_content is None:
+            cache_status = 'miss'
             try:
-                # 检查是否是合并单元格
-                for merged_range in sheet.merged_cells.ranges:
-                    if cell_address in merged_range:
-                        # 如果是合并单元格，设置主单元格的值
-                        cell = sheet[merged_range.start_cell.coordinate]
-                        cell.value = value
-                        # 确保字体不加粗（使用copy避免不可变对象错误）
-                        if cell.font:
-                            from copy import copy
-                            new_font = copy(cell.font)
-                            new_font.bold = False
-                            cell.font = new_font
-                        return
-                
-                # 如果不是合并单元格，直接设置
-                cell = sheet[cell_address]
-                cell.value = value
-                # 确保字体不加粗（使用copy避免不可变对象错误）
-                if cell.font:
-                    from copy import copy
-                    new_font = copy(cell.font)
-                    new_font.bold = False
-                    cell.font = new_font
-            except Exception as e:
-                logger.warning(f"设置单元格 {cell_address} 失败: {str(e)}")
-                # 尝试直接设置值
-                try:
-                    cell = sheet[cell_address]
-                    cell.value = value
-                    if cell.font:
-                        from copy import copy
-                        new_font = copy(cell.font)
-                        new_font.bold = False
-                        cell.font = new_font
-                except Exception as e2:
-                    logger.error(f"直接设置单元格 {cell_address} 也失败: {str(e2)}")
-        
-        # 填充Excel单元格到SC sheet（不填充PI sheet）
-        try:
-            safe_set_cell_value(sc_sheet, 'C3', buyer_name)
-            safe_set_cell_value(sc_sheet, 'C4', buyer_address)
-            safe_set_cell_value(sc_sheet, 'C5', buyer_phone)
-            safe_set_cell_value(sc_sheet, 'C6', seller_name)
-            safe_set_cell_value(sc_sheet, 'C7', seller_address)
-            safe_set_cell_value(sc_sheet, 'C8', seller_phone)
-            safe_set_cell_value(sc_sheet, 'G3', contract_number)
-            safe_set_cell_value(sc_sheet, 'G4', contract_date)
-            safe_set_cell_value(sc_sheet, 'G5', contract_location)
-            safe_set_cell_value(sc_sheet, 'E7', bank_info)
-        except Exception as e:
-            logger.error(f"设置基础信息失败: {e}")
-        
-        # 处理货物信息
-        goods_data = data.get('goodsData', [])
-        if goods_data:
-            for i, goods in enumerate(goods_data[:10]):  # 最多10行
-                current_row = 11 + i
-                try:
-                    safe_set_cell_value(sc_sheet, f'B{current_row}', goods.get('model', ''))
-                    safe_set_cell_value(sc_sheet, f'C{current_row}', goods.get('description', ''))
-                    safe_set_cell_value(sc_sheet, f'D{current_row}', goods.get('color', ''))
-                    safe_set_cell_value(sc_sheet, f'E{current_row}', goods.get('quantity', 0))
-                    safe_set_cell_value(sc_sheet, f'F{current_row}', goods.get('unitPrice', 0))
-                    safe_set_cell_value(sc_sheet, f'G{current_row}', goods.get('totalAmount', 0))
-                except Exception as e:
-                    logger.error(f"设置货物信息失败: {e}")
-            
-            # 隐藏没有填写的商品栏
-            # 如果有1个商品，显示第11行，隐藏第12-20行
-            # 如果有2个商品，显示第11-12行，隐藏第13-20行
-            # 以此类推
-            start_hide_row = 11 + len(goods_data)  # 从第一个未使用的商品行开始隐藏
-            for i in range(start_hide_row, 21):  # 隐藏从start_hide_row到第20行
-                sc_sheet.row_dimensions[i].hidden = True
-                pi_sheet.row_dimensions[i].hidden = True
-        else:
-            # 如果没有货物数据，隐藏所有商品行（第11-20行）
-            for row in range(11, 21):
-                sc_sheet.row_dimensions[row].hidden = True
-                pi_sheet.row_dimensions[row].hidden = True
-        
-        # 填充其他字段
-        try:
-            if data.get('f22Value'):
-                safe_set_cell_value(sc_sheet, 'F22', data['f22Value'])
-            if data.get('paymentTerms'):
-                safe_set_cell_value(sc_sheet, 'D24', data['paymentTerms'])
-            if data.get('totalAmount'):
-                safe_set_cell_value(sc_sheet, 'G21', data['totalAmount'])
-            if data.get('amountInWords'):
-                safe_set_cell_value(sc_sheet, 'B23', data['amountInWords'])
-            if data.get('portOfLoading'):
-                safe_set_cell_value(sc_sheet, 'D21', data['portOfLoading'])
-            if data.get('finalDestination'):
-                safe_set_cell_value(sc_sheet, 'D22', data['finalDestination'])
-            if data.get('transportRoute'):
-                # 处理运输路线，避免重复
-                transport_route = data['transportRoute']
-                if transport_route:
-                    # 更智能的去重处理
-                    # 先按空格分割
-                    parts = transport_route.split()
-                    
-                    # 重建路线，每个词只出现一次，保持顺序
-                    clean_parts = []
-                    seen_words = set()
-                    for part in parts:
-                        if part not in seen_words:
-                            clean_parts.append(part)
-                            seen_words.add(part)
-                    
-                    # 进一步处理：如果结果包含多个"交车"或"Delivery"，只保留第一个
-                    final_parts = []
-                    has_jiaoche = False
-                    has_delivery = False
-                    
-                    for part in clean_parts:
-                        if part == '交车' and not has_jiaoche:
-                            final_parts.append(part)
-                            has_jiaoche = True
-                        elif part == 'Delivery' and not has_delivery:
-                            final_parts.append(part)
-                            has_delivery = True
-                        elif part not in ['交车', 'Delivery']:
-                            final_parts.append(part)
-                    
-                    clean_route = ' '.join(final_parts)
-                    safe_set_cell_value(sc_sheet, 'D25', clean_route)
-            if data.get('modeOfShipment'):
-                # 处理运输方式，显示中文+英文
-                mode = data['modeOfShipment']
-                if mode == 'Land':
-                    mode = '陆运 Land'
-                elif mode == 'Sea':
-                    mode = '海运 Sea'
-                elif mode == 'Air':
-                    mode = '空运 Air'
-                safe_set_cell_value(sc_sheet, 'D26', mode)
-        except Exception as e:
-            logger.error(f"设置其他字段失败: {e}")
-        
-        # 生成输出文件名
-        if contract_number:
-            safe_contract_number = "".join(c for c in contract_number if c.isalnum() or c in ('-', '_'))
-            output_filename = f'{safe_contract_number}_Contract.xlsx'
-        else:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            output_filename = f'contract_{timestamp}.xlsx'
-        
-        # 创建临时文件并返回
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-            output_path = tmp_file.name
-            workbook.save(output_path)
-            
-            with open(output_path, 'rb') as f:
-                file_content = f.read()
-            
-            os.unlink(output_path)
-            
-            return send_file(
-                io.BytesIO(file_content),
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                as_attachment=True,
-                download_name=output_filename
-            )
+                file_content = render_pool.render(plan, timeout=RENDER_TIMEOUT)
+            except PoolSaturatedError as e:
+                response = jsonify({'error': str(e)})
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response, 429
+            except RenderTimeoutError as e:
+                return jsonify({'error': str(e)}), 504
+            with stage('cache'):
+                render_cache.put(cache_key, file_content)
+
+        response = send_file(
+            io.BytesIO(file_content),
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=output_filename
+        )
+        response.set_etag(cache_key)
+        response.headers['X-Render-Cache'] = cache_status
+        return response
         
     except Exception as e:
         logger.error(f"生成合同时出错: {str(e)}")
         return jsonify({'error': f'生成合同失败: {str(e)}'}), 500
 
+@app.route('/api/generate-contracts/batch', methods=['POST', 'OPTIONS'])
+def generate_contracts_batch():
+    """批量生成合同，返回包含所有合同和batch_report.json的ZIP"""
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    data = request.get_json(silent=True)
+    # 支持直接提交数组，或 {"contracts": [...]}
+    payloads = data.get('contracts') if isinstance(data, dict) else data
+    if not isinstance(payloads, list) or not payloads:
+        return jsonify({'error': '请提交合同数据数组'}), 400
+    if len(payloads) > BATCH_MAX_SIZE:
+        return jsonify({'error': f'单次最多生成 {BATCH_MAX_SIZE} 份合同'}), 400
+    if not template_registry.any_exists():
+        return jsonify({'error': '模板文件不存在'}), 404
+
+    contract_services()
+    from render_pool import iter_batch_zip, batch_filenames
+    logger.info(f"收到批量合同请求: {len(payloads)} 份")
+    # 文件名在渲染前按输入顺序确定，ZIP内容不受各合同完成先后影响
+    names = batch_filenames(payloads)
+    results = render_pool.render_many(payloads)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return Response(
+        stream_with_context(iter_batch_zip(results, names)),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename=contracts_{timestamp}.zip',
+            'X-Batch-Size': str(len(payloads))
+        }
+    )
+
+@app.route('/api/cars/search', methods=['GET'])
+def search_cars():
+    """按品牌/车型/配置名搜索车型，返回按相关度排序的分页结果"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '请输入搜索关键词'}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 20)), 1), SEARCH_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': '分页参数格式错误'}), 400
+    if not car_catalog.available():
+        return jsonify({'error': '车型数据不可用'}), 503
+
+    try:
+        version, total, results = car_catalog.search(query, page, page_size)
+    except Exception as e:
+        logger.error(f"搜索车型时出错: {str(e)}")
+        return jsonify({'error': f'搜索失败: {str(e)}'}), 500
+
+    return jsonify({
+        'query': query,
+        'version': version,
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'results': results
+    })
+
+@app.route('/api/cars/filter', methods=['GET'])
+def filter_cars():
+    """
+    按分面筛选配置，如 ?fuelType=纯电动&class=SUV&priceMin=10&priceMax=20
+    同一分面可重复传参（或），不同分面同时满足（且）；价格单位为万元，功率为马力，尺寸为毫米
+    """
+    categories = {facet: [value.strip() for value in request.args.getlist(facet) if value.strip()]
+                  for facet in CATEGORY_FACETS}
+    categories = {facet: values for facet, values in categories.items() if values}
+    ranges = {}
+    for field in RANGE_FACETS:
+        bounds = []
+        for suffix in ('Min', 'Max'):
+            value = request.args.get(f'{field}{suffix}', '').strip()
+            try:
+                bounds.append(float(value) if value else None)
+            except ValueError:
+                return jsonify({'error': f'筛选参数格式错误: {field}{suffix}'}), 400
+        if bounds != [None, None]:
+            ranges[field] = tuple(bounds)
+    sort = request.args.get('sort', '').strip() or None
+    if sort is not None and sort.lstrip('-') not in RANGE_FACETS:
+        return jsonify({'error': f'不支持的排序字段: {sort}，可选: {", ".join(RANGE_FACETS)}'}), 400
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 20)), 1), SEARCH_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': '分页参数格式错误'}), 400
+    if not car_catalog.available():
+        return jsonify({'error': '车型数据不可用'}), 503
+
+    started = time.perf_counter()
+    try:
+        version, total, facets, results = car_catalog.filter(categories, ranges, sort, page, page_size)
+    except Exception as e:
+        logger.error(f"筛选车型时出错: {str(e)}")
+        return jsonify({'error': f'筛选失败: {str(e)}'}), 500
+
+    return jsonify({
+        'filters': {**categories, **{field: {'min': low, 'max': high} for field, (low, high) in ranges.items()}},
+        'sort': sort,
+        'version': version,
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'facets': facets,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+        'results': results
+    })
+
+@app.route('/api/cars/<int:config_id>/similar', methods=['GET'])
+def similar_cars(config_id):
+    """
+    与配置最接近的k个配置（价格、功率、长宽高的加权距离），如 ?k=10&fuelType=纯电动
+    fuelType、class可重复传参（或），取值匹配规则与分面筛选相同
+    """
+    try:
+        k = min(max(int(request.args.get('k', 10)), 1), SIMILAR_MAX_K)
+    except ValueError:
+        return jsonify({'error': 'k参数格式错误'}), 400
+    categories = {facet: [value.strip() for value in request.args.getlist(facet) if value.strip()]
+                  for facet in SIMILAR_FILTER_FACETS}
+    categories = {facet: values for facet, values in categories.items() if values}
+    if not car_catalog.available():
+        return jsonify({'error': '车型数据不可用'}), 503
+
+    started = time.perf_counter()
+    try:
+        version, source, results = car_catalog.similar(config_id, k, categories)
+    except Exception as e:
+        logger.error(f"查询相似配置时出错: {str(e)}")
+        return jsonify({'error': f'查询相似配置失败: {str(e)}'}), 500
+    if source is None:
+        return jsonify({'error': f'配置不存在: {config_id}'}), 404
+    if results is None:
+        return jsonify({'error': f'配置 {config_id} 没有报价，无法比较'}), 404
+
+    return jsonify({
+        'configId': str(config_id),
+        'source': source,
+        'filters': categories,
+        'k': k,
+        'version': version,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+        'results': results
+    })
+
+@app.route('/api/catalog/data/<path:file_name>', methods=['GET'])
+def catalog_data(file_name):
+    """返回brands.json或品牌文件，内容未变化（If-None-Match命中）时返回304"""
+    if not car_catalog.available():
+        return jsonify({'error': '车型数据不可用'}), 503
+    try:
+        payload = brand_payloads.get(file_name, catalog_files())
+    except Exception as e:
+        logger.error(f"读取数据文件 {file_name} 时出错: {str(e)}")
+        return jsonify({'error': f'读取数据文件失败: {str(e)}'}), 500
+    if payload is None:
+        return jsonify({'error': f'数据文件不存在: {file_name}'}), 404
+
+    if request.if_none_match.contains_weak(payload.digest[:32]):
+        response = Response(status=304)
+    else:
+        encoding = next((name for name in ('br', 'gzip')
+                         if name in payload.variants and request.accept_encodings[name]), 'identity')
+        response = Response(payload.variants[encoding], mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = payload.etag
+    response.headers['Vary'] = 'Accept-Encoding'
+    # 允许缓存，但每次使用前都要带ETag向服务器确认
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Catalog-Version'] = car_catalog.version_token()
+    return response
+
+@app.route('/api/catalog/changes', methods=['GET'])
+def catalog_changes():
+    """
+    返回指定版本之后新增、删除、调价的品牌和配置
+    since为之前响应中的version（"<加载标识>:<版本>"），来自重启前或其他工作进程时complete为false
+    """
+    since = request.args.get('since', '').strip()
+    if not since:
+        return jsonify({'error': '请指定版本号'}), 400
+    try:
+        parse_version_token(since)
+    except ValueError:
+        return jsonify({'error': '版本号格式错误'}), 400
+    if not car_catalog.available():
+        return jsonify({'error': '车型数据不可用'}), 503
+
+    try:
+        version, complete, changes = car_catalog.changes(since)
+    except Exception as e:
+        logger.error(f"查询车型变更时出错: {str(e)}")
+        return jsonify({'error': f'查询变更失败: {str(e)}'}), 500
+
+    return jsonify({
+        'since': since,
+        'version': version,
+        'complete': complete,
+        'changes': changes
+    })
+
+@app.route('/api/cars/<int:config_id>/price-history', methods=['GET'])
+def config_price_history(config_id):
+    """返回配置每次价格或在售状态变化的记录"""
+    if not price_history.available():
+        return jsonify({'error': '价格历史不可用'}), 503
+    try:
+        history = price_history.history(config_id)
+    except Exception as e:
+        logger.error(f"查询价格历史时出错: {str(e)}")
+        return jsonify({'error': f'查询价格历史失败: {str(e)}'}), 500
+    if history is None:
+        return jsonify({'error': f'没有配置 {config_id} 的价格记录'}), 404
+    return jsonify({
+        'configId': str(config_id),
+        'history': history
+    })
+
+@app.route('/api/catalog/repriced', methods=['GET'])
+def catalog_repriced():
+    """返回指定日期之后调价的配置及调价前后的价格"""
+    since = request.args.get('since', '').strip()
+    if not since:
+        return jsonify({'error': '请指定日期'}), 400
+    try:
+        since_ts = parse_time(since)
+    except ValueError:
+        return jsonify({'error': '日期格式错误，应为 YYYY-MM-DD 或 ISO 时间'}), 400
+    if not price_history.available():
+        return jsonify({'error': '价格历史不可用'}), 503
+
+    try:
+        repriced = price_history.repriced_since(since_ts)
+    except Exception as e:
+        logger.error(f"查询调价配置时出错: {str(e)}")
+        return jsonify({'error': f'查询调价配置失败: {str(e)}'}), 500
+
+    return jsonify({
+        'since': since,
+        'total': len(repriced),
+        'results': repriced
+    })
+
+@app.route('/api/exchange-rate', methods=['GET'])
+def exchange_rate():
+    """返回 CNY/币种 汇率；source为live、stale（上游暂不可用或正在刷新）或fallback（降级汇率）"""
+    currency = request.args.get('currency', 'USD').strip().upper()
+    if currency not in exchange_rates.currencies:
+        return jsonify({'error': f'不支持的币种: {currency}，可选: {", ".join(exchange_rates.currencies)}'}), 400
+    result = exchange_rates.get(currency)
+    response = jsonify(result)
+    # 浏览器和CDN在汇率剩余有效期内复用响应
+    response.headers['Cache-Control'] = f"public, max-age={result['maxAge']}"
+    return response
+
+@app.route('/api/quotes/bulk', methods=['POST', 'OPTIONS'])
+def bulk_quotes():
+    """按品牌/车型/配置（或直接提交指导价列表）批量计算报价，公式与前端计算引擎一致"""
+    if request.method == 'OPTIONS':
+        return '', 200
+    with _import_lock:
+        from quote_engine import FORM_TYPES, normalize_params, parse_guide_price, quote_rows, backend_name
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请提交报价参数'}), 400
+    form_type = data.get('formType', 'new')
+    if form_type not in FORM_TYPES:
+        return jsonify({'error': f'不支持的报价类型: {form_type}'}), 400
+    params, error = normalize_params(data.get('params'))
+    if error:
+        return jsonify({'error': error}), 400
+
+    guide_prices = data.get('guidePrices')
+    if guide_prices is not None:
+        if not isinstance(guide_prices, list):
+            return jsonify({'error': 'guidePrices 必须是数组'}), 400
+        if len(guide_prices) > QUOTE_MAX_ROWS:
+            return jsonify({'error': f'单次最多计算 {QUOTE_MAX_ROWS} 个配置'}), 400
+        items = [{'index': i} for i in range(len(guide_prices))]
+        try:
+            prices = [parse_guide_price(price) for price in guide_prices]
+        except OverflowError:
+            return jsonify({'error': 'guidePrices 中的数值超出范围'}), 400
+    else:
+        brand, car_id, config_ids = data.get('brand'), data.get('carId'), data.get('configIds')
+        if not brand and car_id is None and config_ids is None:
+            return jsonify({'error': '请指定品牌、车型或配置'}), 400
+        if config_ids is not None and not isinstance(config_ids, list):
+            return jsonify({'error': 'configIds 必须是数组'}), 400
+        if not car_catalog.available():
+            return jsonify({'error': '车型数据不可用'}), 503
+        items = []
+        prices = []
+        for car, config in car_catalog.select_configs(brand, car_id, config_ids):
+            items.append({
+                'brand': car.get('brand'),
+                'carId': car.get('carId'),
+                'carName': car.get('carName'),
+                'configId': config.get('configId'),
+                'configName': config.get('configName'),
+                'price': config.get('price')
+            })
+            prices.append(parse_guide_price(config.get('price')))
+
+    if len(prices) > QUOTE_MAX_ROWS:
+        return jsonify({'error': f'单次最多计算 {QUOTE_MAX_ROWS} 个配置'}), 400
+
+    started = time.perf_counter()
+    rows = quote_rows(form_type, prices, params)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    return jsonify({
+        'formType': form_type,
+        'count': len(rows),
+        'backend': backend_name(),
+        'elapsed_ms': round(elapsed_ms, 2),
+        'rows': [dict(item, **row) for item, row in zip(items, rows)]
+    })
+
 @app.route('/api/template-info', methods=['GET'])
 def get_template_info():
     """获取模板信息"""
+    contract_services()
+    default = renderer.template()
     return jsonify({
-        'template_path': TEMPLATE_PATH,
-        'exists': os.path.exists(TEMPLATE_PATH),
+        'template_path': default.spec.path,
+        'exists': default.spec.exists(),
+        'cache': default.template_cache.stats(),
+        'templates': {template_id: dict(engines.spec.describe(), cache=engines.template_cache.stats())
+                      for template_id, engines in renderer.templates.items()},
+        'engine': CONTRACT_ENGINE,
+        'fill': default.openpyxl_writer.stats(),
+        'render_pool': render_pool.stats(),
+        'render_cache': render_cache.stats(),
+        'catalog': car_catalog.stats(),
+        'catalog_payloads': brand_payloads.stats(),
+        'price_history': price_history.stats(),
+        'exchange_rates': exchange_rates.stats(),
+        'logging': dict(log_pipeline.stats(), contract=contract_logger.stats()),
+        'boot': boot.status(),
         'platform': 'Railway'
     })
 
+@app.route('/api/templates', methods=['GET'])
+def list_templates():
+    """可用的合同模板，生成合同时通过templateId选择"""
+    return jsonify(template_registry.describe())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus指标（每个gunicorn工作进程各自统计）"""
+    return Response(metrics_registry.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/', methods=['GET'])
 def root():
     """根路径"""
@@ -290,8 +686,21 @@ def root():
         'timestamp': datetime.now().isoformat(),
         'endpoints': {
             'health': '/health',
+            'ready': '/ready',
             'generate_contract': '/api/generate-contract',
-            'template_info': '/api/template-info'
+            'generate_contracts_batch': '/api/generate-contracts/batch',
+            'search_cars': '/api/cars/search',
+            'filter_cars': '/api/cars/filter',
+            'similar_cars': '/api/cars/<configId>/similar',
+            'catalog_data': '/api/catalog/data/<file>',
+            'catalog_changes': '/api/catalog/changes',
+            'price_history': '/api/cars/<configId>/price-history',
+            'catalog_repriced': '/api/catalog/repriced',
+            'exchange_rate': '/api/exchange-rate',
+            'bulk_quotes': '/api/quotes/bulk',
+            'templates': '/api/templates',
+            'template_info': '/api/template-info',
+            'metrics': '/metrics'
         }
     })
 
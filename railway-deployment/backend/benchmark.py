@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+合同接口性能基准 - 通过Flask测试客户端（或HTTP）调用 /api/generate-contract，
+统计各场景的延迟分位数、吞吐量和峰值内存，结果保存为JSON基线，compare模式与基线对比
+
+用法:
+  python benchmark.py run [-o bench_results.json]           运行全部场景并保存结果
+  python benchmark.py compare 基线.json [-o 新结果.json]     运行并与基线对比，有退化时返回1
+  python benchmark.py compare 基线.json --current 结果.json  只对比两个已有的结果文件
+  加 --url http://127.0.0.1:5000 时向已启动的服务发送HTTP请求（不统计服务端内存）
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import platform
+import argparse
+import resource
+import threading
+import urllib.request
+import urllib.error
+from datetime import datetime
+
+CONTRACT_PATH = '/api/generate-contract'
+
+# 延迟越大越差、吞吐量越小越差
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+DEFAULT_THRESHOLD = 0.2
+
+
+def contract_payload(goods_rows=1, route_words=0, unique=True):
+    """
+    基准请求数据，unique时合同号不同，绕过渲染结果缓存，测量实际渲染耗时
+    route_words>0时生成带大量重复词的长运输路线
+    """
+    goods = [{'model': f'M{i}', 'description': f'车型 {i}', 'color': '白色', 'quantity': i + 1,
+              'unitPrice': 19999.5, 'totalAmount': (i + 1) * 19999.5} for i in range(goods_rows)]
+    route = 'Shanghai Moscow 交车 Delivery'
+    if route_words:
+        cities = ['Shanghai', 'Urumqi', 'Khorgos', 'Almaty', 'Tashkent', 'Moscow', '交车', 'Delivery']
+        route = ' '.join(f'{cities[i % len(cities)]}{i % 97}' if i % 3 else cities[i % len(cities)]
+                         for i in range(route_words))
+    return {
+        'buyerName': 'Buyer & Co', 'buyerPhone': '+7 900 000', 'buyerAddress': '莫斯科',
+        'sellerName': 'SMAI', 'sellerPhone': '+86 21 0000', 'sellerAddress': '上海',
+        'contractNumber': f'SC/BENCH-{uuid.uuid4().hex[:12]}' if unique else 'SC/BENCH-CACHED',
+        'contractDate': '2024-03-05', 'contractLocation': 'Shanghai',
+        'bankInfo': 'Bank\nSWIFT: XXX', 'f22Value': 'FOB', 'paymentTerms': '30% T/T',
+        'totalAmount': sum(row['totalAmount'] for row in goods), 'amountInWords': 'SAY US DOLLARS',
+        'portOfLoading': 'Shanghai', 'finalDestination': 'Moscow',
+        'transportRoute': route, 'modeOfShipment': 'Land',
+        'goodsData': goods
+    }
+
+
+# 场景: 名称 -> (请求数据参数, 并发客户端数)
+SCENARIOS = {
+    'goods_0': ({'goods_rows': 0}, 1),
+    'goods_1': ({'goods_rows': 1}, 1),
+    'goods_5': ({'goods_rows': 5}, 1),
+    'goods_10': ({'goods_rows': 10}, 1),
+    'long_route': ({'goods_rows': 5, 'route_words': 2000}, 1),
+    'cached': ({'goods_rows': 5, 'unique': False}, 1),
+    'burst_8': ({'goods_rows': 5}, 8),
+}
+
+
+def percentile(sorted_values, fraction):
+    """最近秩法分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def peak_rss_kb():
+    """本进程和已结束子进程的峰值内存（KB），渲染进程池的子进程退出后才计入"""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # macOS返回字节，Linux返回KB
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return {'self': usage // scale, 'children': children // scale}
+
+
+def _test_client_sender():
+    """进程内调用：每个客户端线程使用独立的测试客户端"""
+    from app import app
+    client = app.test_client()
+
+    def send(payload):
+        response = client.post(CONTRACT_PATH, json=payload)
+        response.get_data()
+        return response.status_code
+
+    return send
+
+
+def _http_sender(base_url):
+    url = base_url.rstrip('/') + CONTRACT_PATH
+
+    def send(payload):
+        request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError:
+            return 0
+
+    return send
+
+
+def run_scenario(make_sender, payload_options, clients, requests_per_client, warmup=2):
+    """多个客户端线程同时发送请求，返回延迟分位数、吞吐量和错误数"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    # 预热在各线程内完成，所有客户端就绪时才开始计时
+    start_times = []
+    start_barrier = threading.Barrier(clients, action=lambda: start_times.append(time.perf_counter()))
+
+    def client_loop():
+        send = make_sender()
+        for _ in range(warmup):
+            send(contract_payload(**payload_options))
+        payloads = [contract_payload(**payload_options) for _ in range(requests_per_client)]
+        local_latencies = []
+        local_errors = 0
+        start_barrier.wait()
+        for payload in payloads:
+            started = time.perf_counter()
+            status = send(payload)
+            local_latencies.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [threading.Thread(target=client_loop, name=f'bench-client-{i}') for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_times[0] if start_times else 0.0
+
+    latencies.sort()
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0
+    }
+
+
+def run_benchmark(url=None, requests_per_client=50, scenarios=None):
+    if url:
+        make_sender = lambda: _http_sender(url)
+        target = url
+    else:
+        # app使用相对路径的模板，需要在后端目录下导入；结果文件路径已在main中转换为绝对路径
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        sys.path.insert(0, os.getcwd())
+        import app
+        # 逐个请求的INFO日志会淹没结果输出
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+        # 等待启动预热和后台预压缩完成，避免占用CPU影响前几个场景
+        app.boot.wait()
+        for thread in threading.enumerate():
+            if thread.name == 'catalog-prebuild':
+                thread.join()
+        make_sender = _test_client_sender
+        target = f'test_client engine={app.CONTRACT_ENGINE} render_workers={app.RENDER_WORKERS}'
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'target': target,
+        'python': platform.python_version(),
+        'machine': f'{platform.system()} {platform.machine()} cpus={os.cpu_count()}',
+        'requests_per_client': requests_per_client,
+        'scenarios': {}
+    }
+    for name, (payload_options, clients) in SCENARIOS.items():
+        if scenarios and name not in scenarios:
+            continue
+        result = run_scenario(make_sender, payload_options, clients, requests_per_client)
+        if not url:
+            result['peak_rss_kb'] = peak_rss_kb()
+        results['scenarios'][name] = result
+        print(f"{name:12s} {result['requests']:5d} 次 错误 {result['errors']:3d}  "
+              f"p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  p99 {result['p99_ms']:8.2f}ms  "
+              f"{result['throughput']:8.1f} 次/秒")
+    return results
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """返回退化列表 (场景, 指标, 基线值, 当前值, 变化比例)：延迟增加或吞吐量下降超过threshold"""
+    regressions = []
+    for name, base in baseline['scenarios'].items():
+        result = current['scenarios'].get(name)
+        if result is None:
+            continue
+        for metric in LATENCY_METRICS:
+            if base[metric] > 0 and result[metric] > base[metric] * (1 + threshold):
+                regressions.append((name, metric, base[metric], result[metric], result[metric] / base[metric] - 1))
+        if base['throughput'] > 0 and result['throughput'] < base['throughput'] * (1 - threshold):
+            regressions.append((name, 'throughput', base['throughput'], result['throughput'],
+                                result['throughput'] / base['throughput'] - 1))
+        if result['errors'] > base['errors']:
+            regressions.append((name, 'errors', base['errors'], result['errors'], None))
+    return regressions
+
+
+def print_comparison(baseline, current):
+    print(f"{'场景':12s} {'指标':10s} {'基线':>10s} {'当前':>10s} {'变化':>8s}")
+    for name, base in baseline['scenarios'].items():
+        result = current['scenarios'].get(name)
+        if result is None:
+            print(f'{name:12s} 当前结果中没有该场景')
+            continue
+        for metric in LATENCY_METRICS + ('throughput',):
+            change = f'{result[metric] / base[metric] - 1:+.1%}' if base[metric] else '-'
+            print(f'{name:12s} {metric:10s} {base[metric]:10.2f} {result[metric]:10.2f} {change:>8s}')
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'结果已保存: {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合同接口性能基准')
+    parser.add_argument('command', choices=('run', 'compare'))
+    parser.add_argument('baseline', nargs='?', help='compare模式的基线文件')
+    parser.add_argument('-o', '--output', help='结果文件，run模式默认 bench_results.json')
+    parser.add_argument('--current', help='compare模式直接使用已有的结果文件，不重新运行')
+    parser.add_argument('--url', help='向已启动的服务发送HTTP请求，如 http://127.0.0.1:5000')
+    parser.add_argument('-n', '--requests', type=int, default=50, help='每个客户端的请求数')
+    parser.add_argument('--scenario', action='append', choices=tuple(SCENARIOS), help='只运行指定场景，可重复')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='判定退化的变化比例')
+    args = parser.parse_args()
+    # 测试客户端模式会切换到后端目录，相对路径按运行命令时的目录解析
+    for name in ('baseline', 'output', 'current'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    if args.command == 'run':
+        results = run_benchmark(args.url, args.requests, args.scenario)
+        save_results(results, args.output or os.path.abspath('bench_results.json'))
+        return 0
+
+    if not args.baseline:
+        parser.error('compare模式需要指定基线文件')
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if args.current:
+        with open(args.current, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+    else:
+        current = run_benchmark(args.url, baseline.get('requests_per_client', args.requests),
+                                args.scenario or list(baseline['scenarios']))
+        if args.output:
+            save_results(current, args.output)
+
+    print_comparison(baseline, current)
+    regressions = compare_results(baseline, current, args.threshold)
+    for name, metric, base, value, change in regressions:
+        detail = f' ({change:+.1%})' if change is not None else ''
+        print(f'退化: {name} {metric} {base} -> {value}{detail}')
+    print('OK' if not regressions else f'{len(regressions)} 项指标退化超过 {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+启动预热 - 按顺序执行各预热阶段并记录耗时，全部完成后才视为就绪
+后台模式下 /health 在导入flask后即可响应，openpyxl等较慢的导入和模板解析在后台线程进行
+只有必需阶段失败时才视为未就绪，可选阶段（如车型目录）失败只记录在状态中
+"""
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# background: 后台线程预热（默认）；blocking: 导入app时同步预热；lazy: 不预热，首次使用时加载
+WARMUP_MODES = ('background', 'blocking', 'lazy')
+
+
+class BootSequence:
+    """记录各启动阶段的耗时、失败的阶段（区分必需和可选），以及启动到首份合同完成的时间"""
+
+    def __init__(self, started):
+        # started为app模块开始导入时的time.perf_counter()
+        self.started = started
+        self.mode = None
+        self.phases = []
+        self.errors = {}
+        self.required = set()
+        self.ready_ms = None
+        self.first_contract_ms = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def since_start_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def mark(self, name, elapsed_ms):
+        """记录在预热阶段之外完成的启动步骤（如模块导入）"""
+        with self._lock:
+            self.phases.append({'name': name, 'ms': round(elapsed_ms, 2)})
+        logger.info(f"启动阶段 {name}: {elapsed_ms:.0f}ms")
+
+    def _run_phase(self, name, fn):
+        started = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            with self._lock:
+                self.errors[name] = str(e)
+            logger.error(f"启动阶段 {name} 失败: {e}")
+        self.mark(name, (time.perf_counter() - started) * 1000)
+
+    def _run(self, phases):
+        for name, fn, _ in phases:
+            self._run_phase(name, fn)
+        self.ready_ms = self.since_start_ms()
+        self._ready.set()
+        logger.info(f"预热完成，启动到就绪耗时 {self.ready_ms:.0f}ms"
+                    + (f"，失败的阶段: {', '.join(self.errors)}" if self.errors else ''))
+
+    def start(self, phases, mode='background'):
+        """按mode执行预热阶段，phases为 [(名称, 无参函数, 是否必需), ...]"""
+        self.mode = mode
+        self.required = {name for name, _, required in phases if required}
+        if mode == 'lazy':
+            self.ready_ms = self.since_start_ms()
+            self._ready.set()
+        elif mode == 'blocking':
+            self._run(phases)
+        else:
+            self._thread = threading.Thread(target=self._run, args=(phases,), name='boot-warmup', daemon=True)
+            self._thread.start()
+
+    @property
+    def finished(self):
+        return self._ready.is_set()
+
+    def failed(self, required):
+        """失败的必需阶段或可选阶段"""
+        with self._lock:
+            return {name: error for name, error in self.errors.items() if (name in self.required) == required}
+
+    @property
+    def ready(self):
+        """预热完成且没有失败的必需阶段"""
+        return self._ready.is_set() and not self.failed(required=True)
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def first_contract(self):
+        """首份合同生成完成时调用，只记录一次"""
+        if self.first_contract_ms is not None:
+            return
+        with self._lock:
+            if self.first_contract_ms is not None:
+                return
+            self.first_contract_ms = self.since_start_ms()
+        logger.info(f"启动后首份合同完成: {self.first_contract_ms:.0f}ms")
+
+    def status(self):
+        ready = self.ready
+        degraded = self.failed(required=False)
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'ready': ready,
+                # 可选阶段失败：仍然就绪，但对应功能不可用或在首次使用时再加载
+                'degraded': sorted(degraded),
+                'finished': self.finished,
+                'uptime_ms': round(self.since_start_ms(), 2),
+                'ready_ms': round(self.ready_ms, 2) if self.ready_ms is not None else None,
+                'first_contract_ms': round(self.first_contract_ms, 2) if self.first_contract_ms is not None else None,
+                'phases': list(self.phases),
+                'required': sorted(self.required),
+                'errors': dict(self.errors)
+            }
@@ -0,0 +1,807 @@
+#!/usr/bin/env python3
+"""
+车型目录 - 启动时加载一次 data/brands.json 和各品牌文件，构建倒排索引供搜索接口使用
+打分规则与前端 js/carSearch.js 的 searchWithIndex 保持一致，但只对索引召回的候选车型打分
+
+品牌文件变化时只重新解析变化的品牌，在新的索引快照中替换该品牌的倒排项，
+然后整体切换快照；正在进行的搜索继续使用旧快照，不会看到构建到一半的索引
+
+对外的版本号为 "<加载标识>:<版本>"：每次完整加载（进程启动）生成新的加载标识，
+各gunicorn工作进程、重启前后的版本号不会混淆
+
+搜索打分与前端逐个车型扫描的对比、数据更新和重启后的版本号检查见 tests/test_catalog.py
+"""
+import os
+import re
+import json
+import time
+import bisect
+import itertools
+import threading
+import logging
+import secrets
+from collections import deque
+
+from catalog_pack import PackedCatalog, PACKED_CATALOG_NAME, build_packed_catalog, source_stat
+from catalog_facets import FacetIndex
+from catalog_similar import SimilarityIndex
+
+logger = logging.getLogger(__name__)
+
+# pypinyin导入需要约0.3秒，建立索引时才导入；未安装时为False，不生成拼音索引项
+_pypinyin = None
+
+# 搜索结果中返回的配置字段，图片列表较大，需要时由前端按品牌文件获取
+CONFIG_SUMMARY_FIELDS = ('configId', 'configName', 'price', 'manufacturer', 'class', 'fuelType', 'power', 'size')
+# 索引和搜索结果用到的车型字段，从打包目录加载时只读取这些字段和配置摘要字段
+INDEX_CAR_FIELDS = ('carId', 'carName')
+
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+
+def parse_version_token(token):
+    """
+    解析 "<加载标识>:<版本>"，返回 (加载标识, 版本)；旧格式的纯数字版本号返回 (None, 版本)
+    格式错误时抛出ValueError
+    """
+    epoch, separator, number = token.strip().rpartition(':')
+    if separator and not epoch:
+        raise ValueError(f'版本号格式错误: {token}')
+    return (epoch if separator else None), int(number)
+
+
+def flatten_car(car, brand, brand_data):
+    """按前端loadAllCars的方式展开车型，附加中英文品牌名和品牌图标"""
+    item = {key: value for key, value in car.items() if key != 'seriesName'}
+    # 优先使用brands.json内的中文名称，同时保留中英文两个字段以便搜索
+    item['brand'] = brand.get('name') or brand_data.get('brand')
+    item['brandCn'] = brand.get('name') or ''
+    item['brandEn'] = brand_data.get('brand') or ''
+    item['brandImage'] = brand_data.get('brandImage') or brand.get('brandImage')
+    return item
+
+
+def read_brands(data_dir):
+    """读取brands.json，返回 (品牌列表, 文件状态)"""
+    path = os.path.join(data_dir, 'brands.json')
+    stat = source_stat(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        brands = json.load(f)
+    if not isinstance(brands, list) or not brands:
+        raise ValueError('brands.json 为空或格式错误')
+    return brands, stat
+
+
+def read_brand_file(data_dir, file_name):
+    """
+    读取单个品牌文件，返回 (品牌数据, 文件状态)
+    先取状态再读内容，读取期间文件被改写时下一次检查仍会发现变化
+    """
+    path = os.path.join(data_dir, file_name)
+    stat = source_stat(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        brand_data = json.load(f)
+    if not isinstance(brand_data, dict):
+        raise ValueError(f'品牌文件格式错误: {file_name}')
+    return brand_data, stat
+
+
+def load_packed_brands(data_dir):
+    """
+    从打包目录按列读取各品牌中索引需要的字段，返回 {文件名: (品牌数据, 文件状态)}
+    打包文件不存在或源文件内容已变化时返回None
+    """
+    path = os.path.join(data_dir, PACKED_CATALOG_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        packed = PackedCatalog(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取打包目录失败，改为读取JSON: {e}")
+        return None
+    try:
+        sources = packed.fresh_sources(data_dir)
+        if sources is None:
+            logger.info("打包目录已过期，改为读取JSON")
+            return None
+        brand_files = {}
+        for file_name, entry in packed.brands.items():
+            cars = packed.index_cars(file_name, INDEX_CAR_FIELDS, CONFIG_SUMMARY_FIELDS)
+            brand_files[file_name] = (dict(entry['meta'], cars=cars), sources[file_name])
+        return brand_files
+    finally:
+        packed.close()
+
+
+def _load_pypinyin():
+    global _pypinyin
+    if _pypinyin is None:
+        try:
+            import pypinyin
+            _pypinyin = pypinyin
+        except ImportError:
+            _pypinyin = False
+    return _pypinyin
+
+
+def pinyin_terms(text):
+    """中文名称的全拼和首字母索引项，如 海豚 -> haitun, ht"""
+    if not text or not _CJK_RE.search(text):
+        return []
+    pypinyin = _load_pypinyin()
+    if not pypinyin:
+        return []
+    syllables = [s.lower() for s in pypinyin.lazy_pinyin(text) if s.strip()]
+    initials = [s.lower() for s in pypinyin.lazy_pinyin(text, style=pypinyin.Style.FIRST_LETTER) if s.strip()]
+    return [''.join(syllables).replace(' ', ''), ''.join(initials).replace(' ', '')]
+
+
+def fuzzy_match(text, pattern):
+    """与前端fuzzyMatch相同：包含，或模式中的字符按顺序出现在文本中"""
+    if not text or not pattern:
+        return False
+    if pattern in text:
+        return True
+    position = 0
+    for char in text:
+        if char == pattern[position]:
+            position += 1
+            if position == len(pattern):
+                return True
+    return False
+
+
+def _brand_text(car):
+    return (car.get('brand') or car.get('brandCn') or car.get('brandEn') or '').lower()
+
+
+class BrandSegment:
+    """
+    单个品牌的车型及其倒排项，品牌文件变化时整体替换
+    车型编号全局递增、不复用，新旧品牌段的倒排项不会混淆
+    """
+
+    def __init__(self, brand, brand_data, source, car_ids):
+        self.file = brand['file']
+        self.brand = brand
+        self.source = source
+        self.meta = {key: value for key, value in brand_data.items() if key != 'cars'}
+        self.cars = {}
+        self.car_ids = []
+        self.terms = {}
+        self.name_chars = {}
+        self.full_names = {}
+        self.config_chars = {}
+        self.config_count = 0
+        for car in brand_data.get('cars') or []:
+            car_id = next(car_ids)
+            self.car_ids.append(car_id)
+            self.cars[car_id] = flatten_car(car, brand, brand_data)
+            self._index_car(car_id, self.cars[car_id])
+
+    @staticmethod
+    def _add(postings, key, car_index):
+        postings.setdefault(key, set()).add(car_index)
+
+    def _index_car(self, car_index, car):
+        car_name = (car.get('carName') or '').lower()
+        if car_name:
+            self._add(self.terms, car_name, car_index)
+            for word in car_name.split():
+                if len(word) > 1:
+                    self._add(self.terms, word, car_index)
+
+        for field in ('brand', 'brandCn', 'brandEn'):
+            value = (car.get(field) or '').lower()
+            if value:
+                self._add(self.terms, value, car_index)
+
+        brand_cn = (car.get('brandCn') or '').lower()
+        brand_pinyin = pinyin_terms(brand_cn)
+        car_pinyin = pinyin_terms(car_name)
+        for term in brand_pinyin + car_pinyin:
+            self._add(self.terms, term, car_index)
+        # 品牌+车型组合拼音，如 biyadihaitun、bydht
+        if brand_pinyin and car_pinyin:
+            for brand_term, car_term in zip(brand_pinyin, car_pinyin):
+                self._add(self.terms, brand_term + car_term, car_index)
+
+        full_name = _brand_text(car) + (car.get('carName') or car.get('name') or '').lower()
+        self._add(self.full_names, full_name, car_index)
+        for char in set(full_name):
+            if not char.isspace():
+                self._add(self.name_chars, char, car_index)
+
+        for config in car.get('configs') or []:
+            self.config_count += 1
+            config_name = (config.get('configName') or '').lower()
+            if not config_name:
+                continue
+            self._add(self.terms, config_name, car_index)
+            for word in config_name.split():
+                if len(word) > 1:
+                    self._add(self.terms, word, car_index)
+            for char in set(config_name):
+                if not char.isspace():
+                    self._add(self.config_chars, char, car_index)
+
+
+def _segment_configs(segment):
+    """品牌段中的配置，按配置ID索引"""
+    configs = {}
+    for car_id in segment.car_ids:
+        car = segment.cars[car_id]
+        for config in car.get('configs') or []:
+            configs[str(config.get('configId'))] = (car, config)
+    return configs
+
+
+def diff_segments(old, new):
+    """
+    比较同一品牌文件的新旧两个版本，返回新增、删除、调价的配置，
+    以及价格以外的摘要字段（含所属车型名称）有变化的配置
+    """
+    old_configs = _segment_configs(old)
+    new_configs = _segment_configs(new)
+    diff = {'added': [], 'removed': [], 'repriced': [], 'updated': []}
+    for config_id, (car, config) in new_configs.items():
+        if config_id not in old_configs:
+            diff['added'].append({
+                'carId': car.get('carId'),
+                'carName': car.get('carName'),
+                'config': {field: config.get(field) for field in CONFIG_SUMMARY_FIELDS if field in config}
+            })
+            continue
+        old_car, old_config = old_configs[config_id]
+        if old_config.get('price') != config.get('price'):
+            diff['repriced'].append({
+                'carId': car.get('carId'),
+                'configId': config.get('configId'),
+                'oldPrice': old_config.get('price'),
+                'price': config.get('price')
+            })
+        if old_car.get('carName') != car.get('carName') or any(
+                old_config.get(field) != config.get(field) for field in CONFIG_SUMMARY_FIELDS if field != 'price'):
+            diff['updated'].append({'carId': car.get('carId'), 'configId': config.get('configId')})
+    for config_id, (car, config) in old_configs.items():
+        if config_id not in new_configs:
+            diff['removed'].append({'carId': car.get('carId'), 'configId': config.get('configId')})
+    return diff
+
+
+def _patch_postings(postings, removed, added):
+    """
+    返回替换了部分品牌倒排项的新字典：只为受影响的键创建新集合，
+    其余键与旧快照共用同一个集合对象，旧集合不会被修改
+    """
+    patched = dict(postings)
+    for segment in removed:
+        for key, ids in segment.items():
+            remaining = patched[key] - ids
+            if remaining:
+                patched[key] = remaining
+            else:
+                del patched[key]
+    for segment in added:
+        for key, ids in segment.items():
+            patched[key] = patched[key] | ids if key in patched else set(ids)
+    return patched
+
+
+def _config_result(car, config):
+    return {
+        'brand': car.get('brand'),
+        'brandCn': car.get('brandCn'),
+        'brandEn': car.get('brandEn'),
+        'brandImage': car.get('brandImage'),
+        'carId': car.get('carId'),
+        'carName': car.get('carName'),
+        'config': {field: config.get(field) for field in CONFIG_SUMMARY_FIELDS if field in config}
+    }
+
+
+class CatalogIndex:
+    """
+    不可变的索引快照，由各品牌段合并而成：
+    terms      索引词 -> 车型编号集合（车型名、品牌、配置名及其分词、拼音）
+    name_chars 品牌+车型名中的字符 -> 车型编号集合，用于召回包含匹配和模糊匹配的候选
+    full_names 品牌+车型名 -> 车型编号集合，用于召回名称被两词组合包含的车型
+    config_chars 配置名中的字符 -> 车型编号集合，用于召回配置名包含匹配的候选
+    """
+
+    def __init__(self, version, brands, segments, cars, terms, name_chars, full_names, config_chars,
+                 sorted_terms=None):
+        self.version = version
+        self.brands = brands
+        self.segments = segments
+        self.cars = cars
+        self.terms = terms
+        self.name_chars = name_chars
+        self.full_names = full_names
+        self.config_chars = config_chars
+        self.sorted_terms = sorted_terms if sorted_terms is not None else sorted(terms)
+        self.config_count = sum(segment.config_count for segment in segments.values())
+        # 同分结果按brands.json中的品牌顺序和品牌文件中的车型顺序排列
+        self.car_order = {}
+        for brand_position, brand in enumerate(brands):
+            segment = segments.get(brand.get('file'))
+            if segment is not None:
+                for car_position, car_id in enumerate(segment.car_ids):
+                    self.car_order[car_id] = (brand_position, car_position)
+        self.ordered_car_ids = sorted(self.car_order, key=self.car_order.get)
+        # 分面位图在该快照第一次筛选时建立，品牌文件增量更新时不需要为全部配置重建
+        self._facets = None
+        self._facets_lock = threading.Lock()
+        # 相似配置的特征向量和KD树，同样在第一次查询时建立
+        self._similar = None
+        self._similar_lock = threading.Lock()
+
+    @property
+    def facets(self):
+        if self._facets is None:
+            with self._facets_lock:
+                if self._facets is None:
+                    self._facets = FacetIndex([(self.cars[car_index], config) for car_index in self.ordered_car_ids
+                                               for config in self.cars[car_index].get('configs') or []])
+        return self._facets
+
+    @property
+    def similar_configs(self):
+        if self._similar is None:
+            with self._similar_lock:
+                if self._similar is None:
+                    self._similar = SimilarityIndex(self.facets)
+        return self._similar
+
+    @classmethod
+    def build(cls, version, brands, segments):
+        return cls(version, brands, {}, {}, {}, {}, {}, {}).patched(version, brands, set(), segments)
+
+    def patched(self, version, brands, removed, added):
+        """在当前快照基础上替换品牌段，返回新快照"""
+        segments = {file_name: segment for file_name, segment in self.segments.items() if file_name not in removed}
+        segments.update(added)
+        old = [segment for file_name, segment in self.segments.items() if file_name in removed]
+        new = list(added.values())
+
+        cars = dict(self.cars)
+        for segment in old:
+            for car_id in segment.car_ids:
+                del cars[car_id]
+        for segment in new:
+            cars.update(segment.cars)
+
+        terms = _patch_postings(self.terms, [s.terms for s in old], [s.terms for s in new])
+        sorted_terms = self.sorted_terms if terms.keys() == self.terms.keys() else None
+        return CatalogIndex(
+            version, brands, segments, cars, terms,
+            _patch_postings(self.name_chars, [s.name_chars for s in old], [s.name_chars for s in new]),
+            _patch_postings(self.full_names, [s.full_names for s in old], [s.full_names for s in new]),
+            _patch_postings(self.config_chars, [s.config_chars for s in old], [s.config_chars for s in new]),
+            sorted_terms
+        )
+
+    def _char_candidates(self, postings, text):
+        """包含text中所有字符的车型，是包含匹配和模糊匹配结果的超集"""
+        chars = {char for char in text if not char.isspace()}
+        if not chars:
+            return set()
+        candidates = None
+        for char in sorted(chars, key=lambda c: len(postings.get(c, ()))):
+            matched = postings.get(char)
+            if not matched:
+                return set()
+            candidates = set(matched) if candidates is None else candidates & matched
+        return candidates
+
+    def _score_cars(self, query):
+        query_lower = query.lower()
+        query_words = query_lower.split()
+        scores = {}
+
+        def add(car_index, points):
+            scores[car_index] = scores.get(car_index, 0) + points
+
+        # 索引词完全匹配和前缀匹配
+        for word in query_words:
+            for car_index in self.terms.get(word, ()):
+                add(car_index, 10)
+            start = bisect.bisect_left(self.sorted_terms, word)
+            for term in self.sorted_terms[start:]:
+                if not term.startswith(word):
+                    break
+                for car_index in self.terms[term]:
+                    add(car_index, 5)
+
+        # 包含/模糊匹配只需检查可能命中某条规则的候选车型：
+        # 两词规则要求名称含有前两个词的全部字符，或名称本身是两词组合的子串；
+        # 单词规则要求名称含有该词的全部字符；完整查询规则要求名称含有完整查询的全部字符
+        name_candidates = self._char_candidates(self.name_chars, query_lower)
+        if len(query_words) >= 2:
+            combined = f'{query_words[0]}{query_words[1]}'
+            name_candidates |= self._char_candidates(self.name_chars, combined)
+            for start in range(len(combined) + 1):
+                for end in range(start, len(combined) + 1):
+                    name_candidates |= self.full_names.get(combined[start:end], set())
+        elif len(query_words) == 1:
+            name_candidates |= self._char_candidates(self.name_chars, query_words[0])
+        for car_index in name_candidates:
+            car = self.cars[car_index]
+            car_brand = _brand_text(car)
+            car_name = (car.get('carName') or car.get('name') or '').lower()
+            full_name = f'{car_brand}{car_name}'
+
+            if len(query_words) >= 2:
+                brand_candidate, model_candidate = query_words[0], query_words[1]
+                combined = f'{brand_candidate}{model_candidate}'
+                if combined in full_name or full_name in combined:
+                    add(car_index, 50)
+                if brand_candidate in car_brand and model_candidate in car_name:
+                    add(car_index, 30)
+                if fuzzy_match(car_brand, brand_candidate) and fuzzy_match(car_name, model_candidate):
+                    add(car_index, 20)
+            elif len(query_words) == 1:
+                word = query_words[0]
+                if word in car_name:
+                    add(car_index, 25)
+                if word in car_brand:
+                    add(car_index, 15)
+                if fuzzy_match(car_name, word):
+                    add(car_index, 10)
+
+            if len(query_lower) >= 4:
+                if query_lower in full_name:
+                    add(car_index, 40)
+                if query_lower in car_name:
+                    add(car_index, 35)
+
+            if query_lower in full_name or query_lower in car_name or query_lower in car_brand:
+                add(car_index, 15)
+
+        # 配置名包含完整查询
+        for car_index in self._char_candidates(self.config_chars, query_lower):
+            for config in self.cars[car_index].get('configs') or []:
+                if query_lower in (config.get('configName') or '').lower():
+                    add(car_index, 8)
+
+        return scores
+
+    def search(self, query, page=1, page_size=20):
+        """按分数排序的配置级结果，返回 (总数, 当前页结果)"""
+        query_lower = query.lower()
+        results = []
+        for car_index, score in self._score_cars(query).items():
+            if score <= 0:
+                continue
+            car = self.cars[car_index]
+            order = self.car_order[car_index]
+            for config_index, config in enumerate(car.get('configs') or []):
+                config_name = (config.get('configName') or '').lower()
+                config_score = score + (5 if query_lower in config_name else 0)
+                results.append((-config_score, order, config_index, car_index, config_score))
+
+        results.sort()
+        total = len(results)
+        start = (page - 1) * page_size
+        page_items = [self._result(car_index, config_index, score)
+                      for _, _, config_index, car_index, score in results[start:start + page_size]]
+        return total, page_items
+
+    def _result(self, car_index, config_index, score):
+        car = self.cars[car_index]
+        result = _config_result(car, car['configs'][config_index])
+        result['score'] = score
+        return result
+
+    def filter(self, categories, ranges, sort=None, page=1, page_size=20):
+        """分面筛选，返回 (总数, 各分面取值计数, 当前页结果)"""
+        total, counts, positions = self.facets.filter(categories, ranges, sort, (page - 1) * page_size, page_size)
+        rows = self.facets.rows
+        return total, counts, [_config_result(*rows[position]) for position in positions]
+
+    def similar(self, config_id, k=10, categories=None):
+        """
+        与配置最接近的k个配置，返回 (该配置, 结果列表)，结果按距离排序并带有distance
+        配置不存在时返回 (None, None)，配置没有价格时返回 (该配置, None)
+        """
+        position, neighbors = self.similar_configs.nearest(config_id, k, categories)
+        if position is None:
+            return None, None
+        rows = self.facets.rows
+        source = _config_result(*rows[position])
+        if neighbors is None:
+            return source, None
+        results = []
+        for distance, neighbor in neighbors:
+            result = _config_result(*rows[neighbor])
+            result['distance'] = round(distance, 4)
+            results.append(result)
+        return source, results
+
+    def select_configs(self, brand=None, car_id=None, config_ids=None):
+        """按品牌（中英文名均可）、车型ID、配置ID筛选，返回 (车型, 配置) 列表"""
+        brand = brand.lower() if brand else None
+        car_id = str(car_id) if car_id is not None else None
+        config_ids = {str(config_id) for config_id in config_ids} if config_ids is not None else None
+        selected = []
+        for car_index in self.ordered_car_ids:
+            car = self.cars[car_index]
+            if brand and brand not in {(car.get(field) or '').lower() for field in ('brand', 'brandCn', 'brandEn')}:
+                continue
+            if car_id is not None and str(car.get('carId')) != car_id:
+                continue
+            for config in car.get('configs') or []:
+                if config_ids is not None and str(config.get('configId')) not in config_ids:
+                    continue
+                selected.append((car, config))
+        return selected
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'brands': len(self.brands),
+            'brand_files': len(self.segments),
+            'cars': len(self.cars),
+            'configs': self.config_count,
+            'terms': len(self.terms),
+            'facets_built': self._facets is not None,
+            'similar': self._similar.stats() if self._similar is not None else None,
+            'pinyin': bool(_load_pypinyin())
+        }
+
+
+class CarCatalog:
+    """
+    车型目录：首次使用时加载并建立索引，之后所有请求共用
+    refresh()检查brands.json和各品牌文件的mtime/大小，只重新解析变化的品牌并切换到新版本的快照，
+    每个版本的品牌/配置变化记入变更日志，最多保留changelog_size个版本
+    版本号只在同一次加载内递增，对外使用带加载标识的 version_token()
+    """
+
+    def __init__(self, data_dir, watch_interval=0, changelog_size=100):
+        self.data_dir = data_dir
+        self.watch_interval = watch_interval
+        self._changelog = deque(maxlen=changelog_size)
+        self._lock = threading.Lock()
+        self._car_ids = itertools.count()
+        self._index = None
+        # 最近一次完整加载是否读取了打包目录
+        self.packed = False
+        # 完整加载时生成，区分不同进程或重启前后的版本序列
+        self.epoch = None
+        self._brands_source = None
+        # 解析失败的品牌文件状态，文件未再变化时不重复解析
+        self._failed = {}
+        self._watcher = None
+        self.load_ms = 0.0
+        self.searches = 0
+        self.filters = 0
+        self.similar_queries = 0
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_reload_ms = 0.0
+        self.last_reload_at = None
+        self.last_reloaded = []
+
+    def available(self):
+        return os.path.exists(os.path.join(self.data_dir, 'brands.json'))
+
+    def _load(self):
+        """完整加载（调用方需持有锁），有最新的打包目录时优先使用"""
+        started = time.perf_counter()
+        brands, self._brands_source = read_brands(self.data_dir)
+        brand_files = load_packed_brands(self.data_dir) or {}
+        self.packed = bool(brand_files)
+        segments = {}
+        for brand in brands:
+            file_name = brand.get('file', '')
+            try:
+                brand_data, source = brand_files.get(file_name) or read_brand_file(self.data_dir, file_name)
+            except (OSError, ValueError) as e:
+                logger.warning(f"加载品牌 {brand.get('name')} 失败: {e}")
+                continue
+            segments[file_name] = BrandSegment(brand, brand_data, source, self._car_ids)
+        index = CatalogIndex.build(1, brands, segments)
+        self.epoch = secrets.token_hex(6)
+        self.load_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"车型目录加载完成: {len(index.cars)} 个车型, "
+                    f"{len(index.terms)} 个索引项, 耗时 {self.load_ms:.0f}ms")
+        self._index = index
+
+    def build_pack(self):
+        """按当前数据文件生成打包目录供之后的启动使用，数据目录不可写时只记录警告"""
+        started = time.perf_counter()
+        try:
+            path = build_packed_catalog(self.data_dir)
+        except (OSError, ValueError) as e:
+            logger.warning(f"生成打包目录失败，之后的启动仍读取JSON: {e}")
+            return None
+        logger.info(f"已生成打包目录 {path}，耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+        return path
+
+    def index(self):
+        """返回当前的索引快照，数据目录不存在时抛出FileNotFoundError"""
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._load()
+        return self._index
+
+    def refresh(self):
+        """
+        增量重新加载：只解析状态变化的品牌文件，返回变化的文件名列表
+        品牌文件正在被改写（JSON不完整）时保留旧数据，下次检查时重试
+        """
+        if self._index is None:
+            self.index()
+            return []
+        with self._lock:
+            started = time.perf_counter()
+            current = self._index
+            brands = current.brands
+            if source_stat(os.path.join(self.data_dir, 'brands.json')) != self._brands_source:
+                brands, self._brands_source = read_brands(self.data_dir)
+            listed = {brand.get('file', ''): brand for brand in brands}
+
+            removed = set()
+            added = {}
+            for file_name, segment in current.segments.items():
+                path = os.path.join(self.data_dir, file_name)
+                # 从brands.json中移除、文件被删除，或品牌名称/图标变化时都需要替换该品牌段
+                if listed.get(file_name) != segment.brand or not os.path.exists(path):
+                    removed.add(file_name)
+            for file_name, brand in listed.items():
+                segment = current.segments.get(file_name)
+                path = os.path.join(self.data_dir, file_name)
+                keep_old = segment is not None and segment.brand == brand
+                stat = None
+                try:
+                    stat = source_stat(path)
+                    if segment is not None and file_name not in removed and stat == segment.source:
+                        continue
+                    if self._failed.get(file_name) == stat:
+                        if keep_old:
+                            removed.discard(file_name)
+                        continue
+                    brand_data, source = read_brand_file(self.data_dir, file_name)
+                except FileNotFoundError:
+                    continue
+                except (OSError, ValueError) as e:
+                    self.reload_errors += 1
+                    self._failed[file_name] = stat
+                    logger.warning(f"重新加载品牌 {brand.get('name')} 失败，保留旧数据: {e}")
+                    if keep_old:
+                        removed.discard(file_name)
+                    continue
+                self._failed.pop(file_name, None)
+                if segment is not None:
+                    removed.add(file_name)
+                added[file_name] = BrandSegment(brand, brand_data, source, self._car_ids)
+
+            if not removed and not added and brands is current.brands:
+                return []
+            # 新快照构建完成后再切换引用，进行中的搜索继续使用旧快照
+            index = current.patched(current.version + 1, brands, removed, added)
+            changed = sorted(removed | set(added))
+            self._changelog.append(self._change_entry(index, current, changed))
+            self._index = index
+            self.reloads += 1
+            self.last_reload_ms = (time.perf_counter() - started) * 1000
+            self.last_reload_at = time.time()
+            self.last_reloaded = changed
+            logger.info(f"车型目录已更新到版本 {self._index.version}: {', '.join(changed) or 'brands.json'}, "
+                        f"耗时 {self.last_reload_ms:.0f}ms")
+            return changed
+
+    @staticmethod
+    def _change_entry(index, previous, changed):
+        brands = []
+        for file_name in changed:
+            old = previous.segments.get(file_name)
+            new = index.segments.get(file_name)
+            segment = new or old
+            entry = {'file': file_name, 'brand': segment.brand.get('name')}
+            if old is None:
+                entry['status'] = 'added'
+            elif new is None:
+                entry['status'] = 'removed'
+            else:
+                entry['status'] = 'changed'
+                entry['configs'] = diff_segments(old, new)
+            brands.append(entry)
+        return {
+            'version': index.version,
+            'at': time.time(),
+            'brands_changed': index.brands is not previous.brands,
+            'brands': brands
+        }
+
+    def version_token(self, version=None):
+        """对外的版本号 "<加载标识>:<版本>"，默认为当前版本"""
+        return f'{self.epoch}:{self.version if version is None else version}'
+
+    def changes(self, since):
+        """
+        since为 version_token() 返回的版本号，返回 (当前版本号, 是否完整, since之后各版本的变更)
+        since来自其他进程或重启前的加载（加载标识不同）、早于保留的变更日志或大于当前版本时不完整，
+        客户端需要全量同步；格式错误时抛出ValueError
+        """
+        epoch, since_version = parse_version_token(since)
+        self.index()
+        with self._lock:
+            entries = [entry for entry in self._changelog if entry['version'] > since_version]
+            version = self._index.version
+            current_epoch = self.epoch
+        expected = version - since_version
+        complete = (epoch == current_epoch and since_version >= 1 and expected >= 0
+                    and len(entries) == expected)
+        token = f'{current_epoch}:{version}'
+        if not complete:
+            return token, False, []
+        return token, True, [dict(entry, version=f'{current_epoch}:{entry["version"]}') for entry in entries]
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                self.reload_errors += 1
+                logger.error(f"检查车型数据变化失败: {e}")
+
+    def start_watcher(self):
+        """启动后台线程，每watch_interval秒检查一次数据文件变化"""
+        if self.watch_interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, name='catalog-watcher', daemon=True)
+        self._watcher.start()
+
+    @property
+    def version(self):
+        return self._index.version if self._index is not None else 0
+
+    def search(self, query, page=1, page_size=20):
+        """返回 (索引版本, 总数, 当前页结果)，整个搜索使用同一个快照"""
+        index = self.index()
+        self.searches += 1
+        total, results = index.search(query, page, page_size)
+        return self.version_token(index.version), total, results
+
+    def filter(self, categories, ranges, sort=None, page=1, page_size=20):
+        """返回 (索引版本, 总数, 各分面取值计数, 当前页结果)"""
+        index = self.index()
+        self.filters += 1
+        total, counts, results = index.filter(categories, ranges, sort, page, page_size)
+        return self.version_token(index.version), total, counts, results
+
+    def similar(self, config_id, k=10, categories=None):
+        """返回 (索引版本, 该配置, 最接近的k个配置)"""
+        index = self.index()
+        self.similar_queries += 1
+        source, results = index.similar(config_id, k, categories)
+        return self.version_token(index.version), source, results
+
+    def select_configs(self, brand=None, car_id=None, config_ids=None):
+        return self.index().select_configs(brand, car_id, config_ids)
+
+    def stats(self):
+        stats = {
+            'data_dir': self.data_dir,
+            'loaded': self._index is not None,
+            'epoch': self.epoch,
+            'load_ms': round(self.load_ms, 2),
+            'searches': self.searches,
+            'filters': self.filters,
+            'similar_queries': self.similar_queries,
+            'watch_interval': self.watch_interval,
+            'reloads': self.reloads,
+            'reload_errors': self.reload_errors,
+            'last_reload_ms': round(self.last_reload_ms, 2),
+            'last_reload_at': self.last_reload_at,
+            'last_reloaded': self.last_reloaded,
+            'changelog_versions': len(self._changelog)
+        }
+        if self._index is not None:
+            stats.update(self._index.stats())
+        return stats
+
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+车型目录分面筛选 - 建立索引时为每个分面取值生成位图（Python整数，第i位对应第i个配置），
+数值字段按值排序并每隔一段保存一次前缀位图，区间筛选只需二分查找和少量位运算
+"""
+import re
+import bisect
+import itertools
+
+from catalog_pack import price_to_yuan
+
+# 取值型分面：参数名 -> 取值函数
+CATEGORY_FACETS = {
+    'brand': lambda car, config: car.get('brand'),
+    'class': lambda car, config: config.get('class'),
+    'fuelType': lambda car, config: config.get('fuelType'),
+    'manufacturer': lambda car, config: config.get('manufacturer'),
+}
+
+_POWER_RE = re.compile(r'(\d+(?:\.\d+)?)马力')
+_SIZE_RE = re.compile(r'(\d+)[x×*](\d+)[x×*](\d+)')
+
+
+def _price(car, config):
+    """报价，单位万元"""
+    yuan = price_to_yuan(config.get('price'))
+    return yuan / 10000 if yuan == yuan else None
+
+
+def _power(car, config):
+    match = _POWER_RE.search(config.get('power') or '')
+    return float(match.group(1)) if match else None
+
+
+def _size(index):
+    def extract(car, config):
+        match = _SIZE_RE.search(config.get('size') or '')
+        return int(match.group(index)) if match else None
+    return extract
+
+
+# 数值型分面：参数名前缀（priceMin/priceMax等） -> 取值函数
+RANGE_FACETS = {
+    'price': _price,
+    'power': _power,
+    'length': _size(1),
+    'width': _size(2),
+    'height': _size(3),
+}
+
+# 前缀位图的间隔，区间端点处最多再补 CHECKPOINT_EVERY-1 个位
+CHECKPOINT_EVERY = 64
+
+# 每个字节值中为1的位
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def iter_bits(bitmap, size):
+    """按位置从小到大产出位图中为1的位"""
+    for offset, byte in enumerate(bitmap.to_bytes((size + 7) // 8 or 1, 'little')):
+        if byte:
+            base = offset << 3
+            for bit in _BYTE_BITS[byte]:
+                yield base | bit
+
+
+def _bitmap(positions, size):
+    buffer = bytearray((size + 7) // 8 or 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class RangeColumn:
+    """按值排序的数值列，prefix(k)为排序后前k个配置的位图；同值的配置按目录顺序排列"""
+
+    def __init__(self, values, size):
+        pairs = sorted((value, position) for position, value in enumerate(values) if value is not None)
+        self.keys = [value for value, _ in pairs]
+        self.positions = [position for _, position in pairs]
+        self.descending = [position for _, position in sorted(pairs, key=lambda pair: (-pair[0], pair[1]))]
+        self.checkpoints = [0]
+        bitmap = 0
+        for start in range(0, len(self.positions), CHECKPOINT_EVERY):
+            bitmap |= _bitmap(self.positions[start:start + CHECKPOINT_EVERY], size)
+            self.checkpoints.append(bitmap)
+        self.present = bitmap
+
+    def prefix(self, k):
+        checkpoint = k // CHECKPOINT_EVERY
+        bitmap = self.checkpoints[checkpoint]
+        for position in self.positions[checkpoint * CHECKPOINT_EVERY:k]:
+            bitmap |= 1 << position
+        return bitmap
+
+    def between(self, low=None, high=None):
+        """取值在 [low, high] 内的配置位图，未解析出数值的配置不参与区间筛选"""
+        start = bisect.bisect_left(self.keys, low) if low is not None else 0
+        end = bisect.bisect_right(self.keys, high) if high is not None else len(self.keys)
+        if end <= start:
+            return 0
+        return self.prefix(end) ^ self.prefix(start)
+
+
+class FacetIndex:
+    """
+    一个目录快照的分面索引，rows为按目录顺序排列的 (车型, 配置)
+    分面内多个取值为或，不同分面之间为且；某个分面的计数不受该分面自身条件影响
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.size = len(rows)
+        self.all = (1 << self.size) - 1
+        self.values = {}
+        for facet, extract in CATEGORY_FACETS.items():
+            positions = {}
+            for position, (car, config) in enumerate(rows):
+                value = extract(car, config)
+                if value:
+                    positions.setdefault(value, []).append(position)
+            self.values[facet] = {value: _bitmap(items, self.size) for value, items in positions.items()}
+        self.numbers = {}
+        self.ranges = {}
+        for facet, extract in RANGE_FACETS.items():
+            self.numbers[facet] = [extract(car, config) for car, config in rows]
+            self.ranges[facet] = RangeColumn(self.numbers[facet], self.size)
+
+    def value_bitmap(self, facet, value):
+        """分面取值的位图；没有完全相同的取值时匹配包含该文本的取值（如 SUV -> 紧凑型SUV、中型SUV）"""
+        values = self.values[facet]
+        bitmap = values.get(value)
+        if bitmap is not None:
+            return bitmap
+        bitmap = 0
+        for candidate, candidate_bitmap in values.items():
+            if value in candidate:
+                bitmap |= candidate_bitmap
+        return bitmap
+
+    def filter(self, categories, ranges, sort=None, start=0, limit=20):
+        """
+        categories {分面: [取值, ...]}，ranges {数值分面: (下限, 上限)}，sort为数值分面名，前加-为降序
+        返回 (匹配总数, 各分面取值计数, 第start个起最多limit个匹配位置)
+        """
+        constraints = {}
+        for facet, values in categories.items():
+            bitmap = 0
+            for value in values:
+                bitmap |= self.value_bitmap(facet, value)
+            constraints[facet] = bitmap
+        for facet, (low, high) in ranges.items():
+            constraints[f'range:{facet}'] = self.ranges[facet].between(low, high)
+
+        matched = self.all
+        for bitmap in constraints.values():
+            matched &= bitmap
+
+        counts = {}
+        for facet, values in self.values.items():
+            # 计数时去掉该分面自身的条件，客户端可以看到切换取值后的结果数
+            base = self.all
+            for name, bitmap in constraints.items():
+                if name != facet:
+                    base &= bitmap
+            facet_counts = {}
+            if base:
+                for value, bitmap in values.items():
+                    count = (bitmap & base).bit_count()
+                    if count:
+                        facet_counts[value] = count
+            counts[facet] = facet_counts
+
+        total = matched.bit_count()
+        if start >= total:
+            return total, counts, []
+        if not sort:
+            return total, counts, list(itertools.islice(iter_bits(matched, self.size), start, start + limit))
+        return total, counts, self._sorted_page(matched, total, sort, start, limit)
+
+    def _sorted_page(self, matched, total, sort, start, limit):
+        """按数值排序的一页，没有该数值的配置排在最后"""
+        field = sort.lstrip('-')
+        descending = sort.startswith('-')
+        column = self.ranges[field]
+        end = start + limit
+        if total * 8 <= self.size:
+            # 匹配较少时直接排序
+            numbers = self.numbers[field]
+            positions = list(iter_bits(matched, self.size))
+            present = [position for position in positions if numbers[position] is not None]
+            present.sort(key=(lambda position: (-numbers[position], position)) if descending else
+                         (lambda position: (numbers[position], position)))
+            missing = [position for position in positions if numbers[position] is None]
+            return (present + missing)[start:end]
+        ordered = column.descending if descending else column.positions
+        if matched == self.all:
+            page = ordered[start:end]
+            if len(page) < limit:
+                page += list(itertools.islice(iter_bits(self.all & ~column.present, self.size),
+                                              max(start - len(ordered), 0), end - len(ordered)))
+            return page
+        # 匹配较多时按排好序的列扫描，取满一页即停止
+        mask = matched.to_bytes((self.size + 7) // 8 or 1, 'little')
+        page = []
+        seen = 0
+        for position in ordered:
+            if mask[position >> 3] >> (position & 7) & 1:
+                if seen >= start:
+                    page.append(position)
+                    if len(page) == limit:
+                        return page
+                seen += 1
+        missing = matched & ~column.present
+        return page + list(itertools.islice(iter_bits(missing, self.size), max(start - seen, 0), end - seen))
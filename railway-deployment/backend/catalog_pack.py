@@ -0,0 +1,555 @@
+#!/usr/bin/env python3
+"""
+紧凑列式车型目录 - 把 data/*.json 打包成一个可以mmap的二进制文件
+
+文件结构：8字节魔数 + 4字节头部长度 + JSON头部 + 按8字节对齐的列数据
+- 字符串全部去重，列中只保存字符串编号
+- carId/configId 保存为整数列，price 解析为数值列（"9.98万" -> 99800.0元）
+- 图片URL拆成 前缀编号 + 后缀，前缀字典保存在头部
+- 列数据加载时直接从mmap转换为memoryview，不需要解析
+- 未登记的字段和不符合列编码的值（如非字符串的图片地址、超出64位的整数）整体存为该行的JSON文本
+- 头部记录每个源文件的SHA-256，内容不变时即使检出后mtime变化也仍然有效
+- 建立搜索索引时只按列读取索引需要的字段（index_cars），不还原图片等完整记录
+
+还原结果与JSON源文件的逐个品牌对比见 tests/test_catalog_pack.py
+
+用法：
+    python catalog_pack.py build [数据目录] [输出文件]   生成打包文件
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import math
+import time
+import struct
+import hashlib
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CQCAT1\x00\x00'
+FORMAT_VERSION = 3
+PACKED_CATALOG_NAME = 'catalog.bin'
+
+# 每张表允许的字段及编码方式，字段顺序由每行的shape记录
+TABLES = {
+    'cars': (
+        ('carId', 'id'),
+        ('carName', 'str'),
+        ('mainImage', 'url'),
+        ('lastUpdated', 'str'),
+        ('configs', 'rows:configs'),
+    ),
+    'configs': (
+        ('configName', 'str'),
+        ('configId', 'id'),
+        ('index', 'int'),
+        ('price', 'price'),
+        ('manufacturer', 'str'),
+        ('class', 'str'),
+        ('fuelType', 'str'),
+        ('power', 'str'),
+        ('size', 'str'),
+        ('exteriorImages', 'rows:images'),
+        ('interiorImages', 'rows:images'),
+        ('configImage', 'url'),
+    ),
+    'images': (
+        ('name', 'str'),
+        ('colors', 'strlist'),
+        ('mainImage', 'url'),
+    ),
+}
+
+# 每种编码对应的列：(列名后缀, array类型码)
+CODEC_COLUMNS = {
+    'str': (('', 'I'),),
+    'int': (('', 'q'),),
+    'id': (('', 'q'), ('.kind', 'B')),
+    'price': (('.scaled', 'q'), ('.decimals', 'B'), ('.yuan', 'd')),
+    'url': (('.prefix', 'H'), ('', 'I')),
+    'strlist': (('.start', 'I'), ('.count', 'I')),
+    'rows': (('.start', 'I'), ('.count', 'I')),
+}
+
+# id列的kind：JSON整数、纯数字字符串、其他字符串（值为字符串编号）
+ID_INT, ID_DIGITS, ID_STRING = 0, 1, 2
+# price列decimals为该值时表示无法解析，scaled保存原始字符串编号
+PRICE_RAW = 255
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+_PRICE_RE = re.compile(r'(\d+)(?:\.(\d+))?万')
+
+
+def parse_price(text):
+    """把 "9.98万" 解析为 (去掉小数点的整数, 小数位数)，无法解析时返回None"""
+    match = _PRICE_RE.fullmatch(text)
+    if not match or str(int(match.group(1))) != match.group(1):
+        return None
+    decimals = match.group(2) or ''
+    return int(match.group(1) + decimals), len(decimals)
+
+
+def format_price(scaled, decimals):
+    digits = str(scaled).rjust(decimals + 1, '0')
+    if decimals:
+        return f'{digits[:-decimals]}.{digits[-decimals:]}万'
+    return f'{digits}万'
+
+
+def price_to_yuan(text):
+    """报价字符串换算为元，无法解析时返回NaN"""
+    parsed = parse_price(text) if isinstance(text, str) else None
+    if parsed is None:
+        return math.nan
+    scaled, decimals = parsed
+    return scaled * 10000 / 10 ** decimals
+
+
+def split_url(url):
+    """http(s)地址拆成 (目录前缀, 文件名)，其他字符串（如data:image）整体作为后缀"""
+    if url.startswith(('http://', 'https://')) and '/' in url[8:]:
+        prefix, _, name = url.rpartition('/')
+        return prefix + '/', name
+    return '', url
+
+
+def source_stat(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def source_digest(path):
+    """源文件内容的SHA-256，用于判断打包文件是否过期"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class _Encoder:
+    """按TABLES把品牌数据写入各列"""
+
+    def __init__(self):
+        self.strings = {}
+        self.prefixes = {'': 0}
+        self.shapes = {name: {} for name in TABLES}
+        self.rows = {name: 0 for name in TABLES}
+        self.columns = {'strlist': array('I')}
+        for table, fields in TABLES.items():
+            self.columns[f'{table}.shape'] = array('H')
+            # 该行JSON文本的字符串编号+1，0表示没有
+            self.columns[f'{table}.extra'] = array('I')
+            for key, codec in fields:
+                for suffix, typecode in CODEC_COLUMNS[codec.split(':')[0]]:
+                    self.columns[f'{table}.{key}{suffix}'] = array(typecode)
+
+    def string(self, value):
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    @staticmethod
+    def _fits(kind, value):
+        """值能否按该编码写入列"""
+        if kind in ('str', 'url'):
+            return isinstance(value, str)
+        if kind in ('int', 'id'):
+            if isinstance(value, int) and not isinstance(value, bool):
+                return INT64_MIN <= value <= INT64_MAX
+            return kind == 'id' and isinstance(value, str)
+        if kind == 'price':
+            if not isinstance(value, str):
+                return False
+            parsed = parse_price(value)
+            return parsed is None or (parsed[0] <= INT64_MAX and parsed[1] < PRICE_RAW)
+        if kind == 'strlist':
+            return isinstance(value, list) and all(isinstance(item, str) for item in value)
+        return isinstance(value, list) and all(isinstance(item, dict) for item in value)
+
+    def encode_row(self, table, record):
+        fields = dict(TABLES[table])
+        # 未登记的字段和不符合编码的值存入该行的JSON文本，还原时按shape中的位置放回
+        extra = {key: value for key, value in record.items()
+                 if key not in fields or not self._fits(fields[key].split(':')[0], value)}
+        shape = tuple(record)
+        shape_id = self.shapes[table].setdefault(shape, len(self.shapes[table]))
+        values = {}
+        # 子表的行需要先写入，才能知道起始位置和数量
+        for key, codec in TABLES[table]:
+            if key in record and key not in extra and codec.startswith('rows:'):
+                child = codec.split(':')[1]
+                children = record[key]
+                start = self.rows[child]
+                for item in children:
+                    self.encode_row(child, item)
+                values[key] = (start, len(children))
+
+        self.columns[f'{table}.shape'].append(shape_id)
+        self.columns[f'{table}.extra'].append(
+            self.string(json.dumps(extra, ensure_ascii=False)) + 1 if extra else 0)
+        for key, codec in TABLES[table]:
+            kind = codec.split(':')[0]
+            present = key in record and key not in extra
+            value = record.get(key)
+            columns = [self.columns[f'{table}.{key}{suffix}'] for suffix, _ in CODEC_COLUMNS[kind]]
+            if not present:
+                for column in columns:
+                    column.append(math.nan if column.typecode == 'd' else 0)
+            elif kind == 'str':
+                columns[0].append(self.string(value))
+            elif kind == 'int':
+                columns[0].append(value)
+            elif kind == 'id':
+                if isinstance(value, int):
+                    columns[0].append(value)
+                    columns[1].append(ID_INT)
+                elif value.isascii() and value.isdigit() and str(int(value)) == value and int(value) <= INT64_MAX:
+                    columns[0].append(int(value))
+                    columns[1].append(ID_DIGITS)
+                else:
+                    columns[0].append(self.string(value))
+                    columns[1].append(ID_STRING)
+            elif kind == 'price':
+                parsed = parse_price(value)
+                if parsed is None:
+                    columns[0].append(self.string(value))
+                    columns[1].append(PRICE_RAW)
+                else:
+                    columns[0].append(parsed[0])
+                    columns[1].append(parsed[1])
+                columns[2].append(price_to_yuan(value))
+            elif kind == 'url':
+                prefix, name = split_url(value)
+                # 前缀编号为16位，前缀字典写满后新地址整体作为后缀
+                if prefix not in self.prefixes and len(self.prefixes) > 0xFFFF:
+                    prefix, name = '', value
+                prefix_id = self.prefixes.setdefault(prefix, len(self.prefixes))
+                columns[0].append(prefix_id)
+                columns[1].append(self.string(name))
+            elif kind == 'strlist':
+                columns[0].append(len(self.columns['strlist']))
+                columns[1].append(len(value))
+                for item in value:
+                    self.columns['strlist'].append(self.string(item))
+            elif kind == 'rows':
+                columns[0].append(values[key][0])
+                columns[1].append(values[key][1])
+        self.rows[table] += 1
+
+
+def build_packed_catalog(data_dir, output_path=None):
+    """读取brands.json和各品牌文件，生成打包文件，返回输出路径"""
+    output_path = output_path or os.path.join(data_dir, PACKED_CATALOG_NAME)
+    brands_path = os.path.join(data_dir, 'brands.json')
+    with open(brands_path, 'r', encoding='utf-8') as f:
+        brands = json.load(f)
+
+    encoder = _Encoder()
+    brand_entries = []
+    missing = []
+    for brand in brands:
+        path = os.path.join(data_dir, brand.get('file', ''))
+        if not os.path.exists(path):
+            logger.warning(f"品牌文件不存在，跳过: {path}")
+            missing.append(brand.get('file', ''))
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            brand_data = json.load(f)
+        car_start = encoder.rows['cars']
+        for car in brand_data.get('cars') or []:
+            encoder.encode_row('cars', car)
+        meta = {key: (None if key == 'cars' else value) for key, value in brand_data.items()}
+        brand_entries.append({
+            'file': brand['file'],
+            'meta': meta,
+            'car_start': car_start,
+            'car_count': encoder.rows['cars'] - car_start,
+            'sha256': source_digest(path)
+        })
+
+    # 字符串表：UTF-8拼接 + 偏移量
+    offsets = array('I', [0])
+    data = bytearray()
+    for value in encoder.strings:
+        data += value.encode('utf-8')
+        offsets.append(len(data))
+    encoder.columns['strings.offsets'] = offsets
+    encoder.columns['strings.data'] = array('B', data)
+
+    sections = {}
+    blobs = []
+    position = 0
+    for name, column in encoder.columns.items():
+        raw = column.tobytes()
+        sections[name] = {'typecode': column.typecode, 'offset': position, 'length': len(raw)}
+        padding = -len(raw) % 8
+        blobs.append(raw + b'\x00' * padding)
+        position += len(raw) + padding
+
+    header = {
+        'version': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'itemsizes': {code: array(code).itemsize for code in 'BHIqd'},
+        'brands_json': brands,
+        'brands_sha256': source_digest(brands_path),
+        'brands': brand_entries,
+        'missing': missing,
+        'rows': encoder.rows,
+        'shapes': {table: [list(shape) for shape in shapes] for table, shapes in encoder.shapes.items()},
+        'url_prefixes': list(encoder.prefixes),
+        'sections': sections
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    header_bytes += b' ' * (-(len(MAGIC) + 4 + len(header_bytes)) % 8)
+
+    # 多个进程可能同时生成，各自写入自己的临时文件
+    temp_path = f'{output_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+    # 原子替换，正在读取旧文件的进程不受影响
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+class PackedCatalog:
+    """只读打包目录：列数据直接引用mmap，字符串按需解码"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'不是车型目录打包文件: {path}')
+        header_length = struct.unpack_from('<I', self._mmap, len(MAGIC))[0]
+        data_start = len(MAGIC) + 4 + header_length
+        self.header = json.loads(self._mmap[len(MAGIC) + 4:data_start])
+        if self.header['version'] != FORMAT_VERSION or self.header['byteorder'] != sys.byteorder:
+            raise ValueError('打包文件版本或字节序不匹配，请重新生成')
+        if any(array(code).itemsize != size for code, size in self.header['itemsizes'].items()):
+            raise ValueError('打包文件的整数宽度与当前平台不一致，请重新生成')
+
+        view = memoryview(self._mmap)
+        self.columns = {}
+        for name, section in self.header['sections'].items():
+            start = data_start + section['offset']
+            self.columns[name] = view[start:start + section['length']].cast(section['typecode'])
+        self.prefixes = self.header['url_prefixes']
+        self.shapes = {table: [tuple(shape) for shape in shapes]
+                       for table, shapes in self.header['shapes'].items()}
+        self.brands = {entry['file']: entry for entry in self.header['brands']}
+        self._strings = {}
+
+    def close(self):
+        self.columns = {}
+        self._mmap.close()
+
+    def string(self, index):
+        value = self._strings.get(index)
+        if value is None:
+            offsets = self.columns['strings.offsets']
+            data = self.columns['strings.data']
+            value = self._strings[index] = bytes(data[offsets[index]:offsets[index + 1]]).decode('utf-8')
+        return value
+
+    def fresh_sources(self, data_dir):
+        """
+        所有源文件内容都与打包时相同时返回 {文件名: 当前文件状态}，否则返回None
+        按内容哈希比较，新检出的仓库中mtime变化不影响；返回的状态用于之后检查文件变化
+        """
+        try:
+            if source_digest(os.path.join(data_dir, 'brands.json')) != self.header['brands_sha256']:
+                return None
+            if any(os.path.exists(os.path.join(data_dir, name)) for name in self.header['missing']):
+                return None
+            sources = {}
+            for entry in self.header['brands']:
+                path = os.path.join(data_dir, entry['file'])
+                stat = source_stat(path)
+                if source_digest(path) != entry['sha256']:
+                    return None
+                sources[entry['file']] = stat
+            return sources
+        except OSError:
+            return None
+
+    def is_fresh(self, data_dir):
+        return self.fresh_sources(data_dir) is not None
+
+    def brands_json(self):
+        return self.header['brands_json']
+
+    def price_yuan(self):
+        """所有配置的报价（元），与configs表的行一一对应，无法解析为NaN"""
+        return self.columns['configs.price.yuan']
+
+    def _decode_value(self, table, key, codec, row):
+        kind = codec.split(':')[0]
+        column = f'{table}.{key}'
+        if kind == 'str':
+            return self.string(self.columns[column][row])
+        if kind == 'int':
+            return self.columns[column][row]
+        if kind == 'id':
+            value, id_kind = self.columns[column][row], self.columns[column + '.kind'][row]
+            if id_kind == ID_INT:
+                return value
+            return str(value) if id_kind == ID_DIGITS else self.string(value)
+        if kind == 'price':
+            scaled, decimals = self.columns[column + '.scaled'][row], self.columns[column + '.decimals'][row]
+            return self.string(scaled) if decimals == PRICE_RAW else format_price(scaled, decimals)
+        if kind == 'url':
+            return self.prefixes[self.columns[column + '.prefix'][row]] + self.string(self.columns[column][row])
+        start, count = self.columns[column + '.start'][row], self.columns[column + '.count'][row]
+        if kind == 'strlist':
+            strlist = self.columns['strlist']
+            return [self.string(strlist[i]) for i in range(start, start + count)]
+        child = codec.split(':')[1]
+        return [self.row(child, i) for i in range(start, start + count)]
+
+    def extra(self, table, row):
+        """该行存为JSON文本的字段，没有时返回空字典"""
+        index = self.columns[f'{table}.extra'][row]
+        return json.loads(self.string(index - 1)) if index else {}
+
+    def row(self, table, row, skip=()):
+        """还原一行记录，字段顺序与源文件一致；skip中的字段不解码"""
+        codecs = dict(TABLES[table])
+        shape = self.shapes[table][self.columns[f'{table}.shape'][row]]
+        extra = self.extra(table, row)
+        return {key: (extra[key] if key in extra else self._decode_value(table, key, codecs[key], row))
+                for key in shape if key not in skip}
+
+    def brand_json(self, file_name):
+        """还原完整的品牌文件内容"""
+        entry = self.brands[file_name]
+        cars = [self.row('cars', i) for i in range(entry['car_start'], entry['car_start'] + entry['car_count'])]
+        return {key: (cars if key == 'cars' else value) for key, value in entry['meta'].items()}
+
+    def _column_reader(self, table, key):
+        """返回按行号读取该字段的函数，列在这里取出一次，读取时不再按名称查找"""
+        kind = dict(TABLES[table])[key].split(':')[0]
+        column = self.columns.get(f'{table}.{key}')
+        string = self.string
+        if kind == 'str':
+            return lambda row: string(column[row])
+        if kind == 'int':
+            return column.__getitem__
+        if kind == 'id':
+            kinds = self.columns[f'{table}.{key}.kind']
+
+            def read_id(row):
+                id_kind = kinds[row]
+                if id_kind == ID_INT:
+                    return column[row]
+                return str(column[row]) if id_kind == ID_DIGITS else string(column[row])
+            return read_id
+        if kind == 'price':
+            scaled = self.columns[f'{table}.{key}.scaled']
+            decimals = self.columns[f'{table}.{key}.decimals']
+
+            def read_price(row):
+                if decimals[row] == PRICE_RAW:
+                    return string(scaled[row])
+                return format_price(scaled[row], decimals[row])
+            return read_price
+        raise ValueError(f'index_cars不支持的字段: {table}.{key}')
+
+    def _shape_readers(self, table, fields):
+        """
+        每种shape中出现的字段及其读取函数，字段顺序与源文件一致
+        未登记的字段只会出现在行的JSON文本中，读取函数为None
+        """
+        codecs = dict(TABLES[table])
+        readers = {key: (self._column_reader(table, key) if key in codecs else None) for key in fields}
+        return [tuple((key, readers[key]) for key in shape if key in readers) for shape in self.shapes[table]]
+
+    def _read_row(self, table, readers, row):
+        index = self.columns[f'{table}.extra'][row]
+        if not index:
+            return {key: read(row) for key, read in readers}
+        extra = json.loads(self.string(index - 1))
+        return {key: (extra[key] if key in extra else read(row)) for key, read in readers}
+
+    def index_cars(self, file_name, car_fields, config_fields):
+        """
+        建立搜索索引用的车型列表：只按列读取car_fields和config_fields（标量字段），
+        不经过完整记录的还原，字符串按编号共享
+        """
+        entry = self.brands[file_name]
+        car_shapes = self._shape_readers('cars', car_fields)
+        config_shapes = self._shape_readers('configs', config_fields)
+        car_shape_column = self.columns['cars.shape']
+        config_shape_column = self.columns['configs.shape']
+        config_starts = self.columns['cars.configs.start']
+        config_counts = self.columns['cars.configs.count']
+        cars = []
+        read_row = self._read_row
+        for i in range(entry['car_start'], entry['car_start'] + entry['car_count']):
+            car = read_row('cars', car_shapes[car_shape_column[i]], i)
+            start = config_starts[i]
+            car['configs'] = [read_row('configs', config_shapes[config_shape_column[j]], j)
+                              for j in range(start, start + config_counts[i])]
+            cars.append(car)
+        return cars
+
+
+def verify_packed_catalog(data_dir, packed_path):
+    """
+    逐个品牌对比还原结果与JSON源文件，并检查索引读取的字段与JSON中的对应字段相同，
+    返回不一致的文件列表
+    """
+    from catalog import INDEX_CAR_FIELDS, CONFIG_SUMMARY_FIELDS
+    packed = PackedCatalog(packed_path)
+    mismatched = []
+    try:
+        with open(os.path.join(data_dir, 'brands.json'), 'r', encoding='utf-8') as f:
+            if json.load(f) != packed.brands_json():
+                mismatched.append('brands.json')
+        for file_name in packed.brands:
+            with open(os.path.join(data_dir, file_name), 'r', encoding='utf-8') as f:
+                expected = json.load(f)
+            # 序列化后比较，同时检查字段顺序和类型（如 "243298" 与 243298）
+            if json.dumps(expected, ensure_ascii=False) != json.dumps(packed.brand_json(file_name), ensure_ascii=False):
+                mismatched.append(file_name)
+                continue
+            projected = [
+                dict({key: car[key] for key in car if key in INDEX_CAR_FIELDS},
+                     configs=[{key: config[key] for key in config if key in CONFIG_SUMMARY_FIELDS}
+                              for config in car.get('configs') or []])
+                for car in expected.get('cars') or []
+            ]
+            if json.dumps(projected, ensure_ascii=False) != json.dumps(
+                    packed.index_cars(file_name, INDEX_CAR_FIELDS, CONFIG_SUMMARY_FIELDS), ensure_ascii=False):
+                mismatched.append(f'{file_name} (index_cars)')
+    finally:
+        packed.close()
+    return mismatched
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+    packed_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(data_dir, PACKED_CATALOG_NAME)
+
+    if command == 'build':
+        started = time.perf_counter()
+        build_packed_catalog(data_dir, packed_path)
+        print(f"已生成 {packed_path}: {os.path.getsize(packed_path)} 字节, "
+              f"耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+        return 0
+
+    print(__doc__)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
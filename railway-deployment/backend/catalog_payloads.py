@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+车型数据文件分发 - brands.json和各品牌文件按内容哈希生成ETag，并预先压缩为gzip/brotli
+客户端带If-None-Match请求未变化的品牌时直接返回304
+"""
+import os
+import gzip
+import hashlib
+import threading
+import logging
+
+try:
+    import brotli
+except ImportError:  # 未安装时只提供gzip
+    brotli = None
+
+from catalog_pack import source_stat
+
+logger = logging.getLogger(__name__)
+
+
+class BrandPayload:
+    """单个数据文件的原始内容、内容哈希和各编码的预压缩版本"""
+
+    def __init__(self, content, source, gzip_level, brotli_quality):
+        self.source = source
+        self.digest = hashlib.sha256(content).hexdigest()
+        # 各编码内容相同，使用弱ETag，配合Vary: Accept-Encoding
+        self.etag = f'W/"{self.digest[:32]}"'
+        self.variants = {'identity': content, 'gzip': gzip.compress(content, gzip_level, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(content, quality=brotli_quality)
+
+    def size(self):
+        return sum(len(content) for content in self.variants.values())
+
+
+class BrandPayloads:
+    """
+    按文件状态（mtime/大小）缓存各数据文件的压缩结果，文件变化后下次请求时重新生成
+    只提供brands.json及其中列出的品牌文件，其它路径一律视为不存在
+    """
+
+    def __init__(self, data_dir, gzip_level=9, brotli_quality=9):
+        self.data_dir = data_dir
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self._payloads = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _allowed(self, file_name, listed_files):
+        return file_name == 'brands.json' or file_name in listed_files
+
+    def get(self, file_name, listed_files):
+        """返回文件的BrandPayload，文件不在目录中或不存在时返回None"""
+        if not self._allowed(file_name, listed_files):
+            return None
+        path = os.path.join(self.data_dir, file_name)
+        try:
+            source = source_stat(path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            payload = self._payloads.get(file_name)
+            if payload is not None and payload.source == source:
+                self.hits += 1
+                return payload
+            self.misses += 1
+        with open(path, 'rb') as f:
+            content = f.read()
+        # 压缩在锁外进行，同一文件并发未命中时各自生成，结果相同
+        payload = BrandPayload(content, source, self.gzip_level, self.brotli_quality)
+        with self._lock:
+            self._payloads[file_name] = payload
+        return payload
+
+    def prebuild(self, listed_files):
+        """预先压缩全部数据文件，启动时在后台线程调用"""
+        for file_name in ['brands.json'] + sorted(listed_files):
+            try:
+                self.get(file_name, listed_files)
+            except OSError as e:
+                logger.warning(f"预压缩数据文件 {file_name} 失败: {e}")
+        logger.info(f"数据文件预压缩完成: {len(self._payloads)} 个文件")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._payloads),
+                'bytes': sum(payload.size() for payload in self._payloads.values()),
+                'encodings': ['identity', 'gzip'] + (['br'] if brotli is not None else []),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+相似配置查询 - 把价格、功率、长宽高换算为特征向量，建立KD树，按加权欧氏距离查找最接近的配置
+
+特征取自分面索引已解析的数值（catalog_facets.RANGE_FACETS）：价格和功率取对数（按比例比较），
+各维按全部配置的标准差归一化后乘以权重；缺少功率或尺寸的配置用同级别配置的中位数补齐，
+没有价格的配置不参与比较。按燃料类型、级别筛选时为每种筛选条件单独建树并缓存
+
+KD树与逐个计算距离的对比见 tests/test_catalog_similar.py
+"""
+import math
+import heapq
+import threading
+from collections import OrderedDict
+
+from catalog_facets import iter_bits
+
+# 特征 -> 权重，权重越大该项差异对距离的影响越大
+FEATURE_WEIGHTS = {
+    'price': 2.0,
+    'power': 1.0,
+    'length': 1.0,
+    'width': 0.5,
+    'height': 0.5,
+}
+# 按比例比较的特征
+LOG_FEATURES = {'price', 'power'}
+# 支持的筛选分面
+SIMILAR_FILTER_FACETS = ('fuelType', 'class')
+
+LEAF_SIZE = 16
+# 缓存的筛选条件子树数量
+MAX_FILTER_TREES = 64
+
+
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+class KDTree:
+    """
+    静态KD树，节点保存在平行列表中：叶子节点保存位置列表，内部节点按分布最广的维度在中位数处切分
+    """
+
+    def __init__(self, vectors, positions, leaf_size=LEAF_SIZE):
+        self.vectors = vectors
+        self.size = len(positions)
+        self.leaf_size = leaf_size
+        self.split_dims = []
+        self.split_values = []
+        self.children = []
+        self.leaves = []
+        self.root = self._build(list(positions)) if positions else None
+
+    def _node(self, split_dim=None, split_value=None, leaf=None):
+        self.split_dims.append(split_dim)
+        self.split_values.append(split_value)
+        self.children.append(None)
+        self.leaves.append(leaf)
+        return len(self.leaves) - 1
+
+    def _build(self, positions):
+        vectors = self.vectors
+        if len(positions) <= self.leaf_size:
+            return self._node(leaf=positions)
+        dims = len(vectors[positions[0]])
+        spreads = []
+        for dim in range(dims):
+            values = [vectors[position][dim] for position in positions]
+            spreads.append(max(values) - min(values))
+        split_dim = max(range(dims), key=spreads.__getitem__)
+        if spreads[split_dim] == 0:
+            return self._node(leaf=positions)
+        positions.sort(key=lambda position: vectors[position][split_dim])
+        middle = len(positions) // 2
+        node = self._node(split_dim, vectors[positions[middle]][split_dim])
+        self.children[node] = (self._build(positions[:middle]), self._build(positions[middle:]))
+        return node
+
+    def nearest(self, point, k, exclude=None):
+        """距离point最近的k个位置，返回 [(距离平方, 位置), ...]，按距离、位置排序"""
+        if self.root is None or k <= 0:
+            return []
+        vectors = self.vectors
+        split_dims = self.split_dims
+        split_values = self.split_values
+        children = self.children
+        leaves = self.leaves
+        # 大顶堆：(-距离平方, -位置)，堆顶是当前第k近的结果
+        heap = []
+
+        def visit(node):
+            leaf = leaves[node]
+            if leaf is not None:
+                for position in leaf:
+                    if position == exclude:
+                        continue
+                    vector = vectors[position]
+                    distance = 0.0
+                    for a, b in zip(point, vector):
+                        distance += (a - b) * (a - b)
+                    item = (-distance, -position)
+                    if len(heap) < k:
+                        heapq.heappush(heap, item)
+                    elif item > heap[0]:
+                        heapq.heapreplace(heap, item)
+                return
+            diff = point[split_dims[node]] - split_values[node]
+            near, far = children[node] if diff < 0 else children[node][::-1]
+            visit(near)
+            # 切分平面比当前第k近的结果还远时跳过另一侧
+            if len(heap) < k or diff * diff <= -heap[0][0]:
+                visit(far)
+
+        visit(self.root)
+        return sorted((-distance, -position) for distance, position in heap)
+
+
+class SimilarityIndex:
+    """一个目录快照的相似配置索引，位置与FacetIndex.rows一致"""
+
+    def __init__(self, facets):
+        self.facets = facets
+        self.size = facets.size
+        self.position_of = {}
+        for position, (_, config) in enumerate(facets.rows):
+            config_id = config.get('configId')
+            if config_id is not None:
+                self.position_of.setdefault(str(config_id), position)
+        self.vectors = self._vectors()
+        self.indexed = [position for position, vector in enumerate(self.vectors) if vector is not None]
+        self.tree = KDTree(self.vectors, self.indexed)
+        self._filter_trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _vectors(self):
+        numbers = {}
+        for feature in FEATURE_WEIGHTS:
+            column = self.facets.numbers[feature]
+            if feature in LOG_FEATURES:
+                column = [math.log(value) if value and value > 0 else None for value in column]
+            numbers[feature] = column
+
+        classes = [config.get('class') for _, config in self.facets.rows]
+        scales = {}
+        fills = {}
+        for feature, column in numbers.items():
+            present = [value for value in column if value is not None]
+            if not present:
+                scales[feature] = 0.0
+                continue
+            mean = sum(present) / len(present)
+            std = math.sqrt(sum((value - mean) ** 2 for value in present) / len(present))
+            scales[feature] = FEATURE_WEIGHTS[feature] / std if std else 0.0
+            by_class = {}
+            for value, class_name in zip(column, classes):
+                if value is not None:
+                    by_class.setdefault(class_name, []).append(value)
+            fills[feature] = ({class_name: _median(values) for class_name, values in by_class.items()},
+                              _median(present))
+
+        vectors = []
+        for position in range(self.size):
+            if numbers['price'][position] is None:
+                vectors.append(None)
+                continue
+            vector = []
+            for feature, column in numbers.items():
+                value = column[position]
+                if value is None:
+                    class_fills, default = fills.get(feature, ({}, 0.0))
+                    value = class_fills.get(classes[position], default)
+                vector.append((value or 0.0) * scales[feature])
+            vectors.append(tuple(vector))
+        return vectors
+
+    def _tree_for(self, categories):
+        """按筛选条件取子树，categories {分面: [取值, ...]}，取值匹配规则与分面筛选相同"""
+        if not categories:
+            return self.tree
+        key = tuple((facet, tuple(sorted(categories[facet]))) for facet in sorted(categories))
+        with self._lock:
+            tree = self._filter_trees.get(key)
+            if tree is not None:
+                self._filter_trees.move_to_end(key)
+                return tree
+            matched = (1 << self.size) - 1
+            for facet, values in categories.items():
+                bitmap = 0
+                for value in values:
+                    bitmap |= self.facets.value_bitmap(facet, value)
+                matched &= bitmap
+            positions = [position for position in iter_bits(matched, self.size) if self.vectors[position] is not None]
+            tree = self._filter_trees[key] = KDTree(self.vectors, positions)
+            if len(self._filter_trees) > MAX_FILTER_TREES:
+                self._filter_trees.popitem(last=False)
+            return tree
+
+    def nearest(self, config_id, k=10, categories=None):
+        """
+        与配置最接近的k个配置，返回 (配置位置, [(距离, 位置), ...])
+        配置不存在时返回 (None, None)，配置没有价格时返回 (位置, None)
+        """
+        position = self.position_of.get(str(config_id))
+        if position is None:
+            return None, None
+        point = self.vectors[position]
+        if point is None:
+            return position, None
+        tree = self._tree_for(categories)
+        return position, [(math.sqrt(distance), neighbor)
+                          for distance, neighbor in tree.nearest(point, k, exclude=position)]
+
+    def stats(self):
+        return {
+            'indexed': len(self.indexed),
+            'filter_trees': len(self._filter_trees)
+        }
+
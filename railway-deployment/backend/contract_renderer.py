@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+合同渲染器 - 按配置的引擎生成合同xlsx，供单个生成接口和批量生成的工作进程共用
+"""
+import logging
+
+from template_cache import TemplateCache
+from contract_plan import OpenpyxlContractWriter, build_fill_plan
+from fast_writer import FastContractWriter
+
+logger = logging.getLogger(__name__)
+
+
+def validate_contract_data(data):
+    """校验合同请求数据，返回错误信息，校验通过返回None"""
+    if not data:
+        return '未收到数据'
+    if not isinstance(data, dict):
+        return '合同数据格式错误'
+    if not data.get('buyerName') or not data.get('contractNumber'):
+        return 'Missing required fields: buyerName, contractNumber'
+    return None
+
+
+class TemplateEngines:
+    """单个模板的模板缓存和两种生成引擎"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.template_cache = TemplateCache(spec.path)
+        self.openpyxl_writer = OpenpyxlContractWriter(self.template_cache, spec.layout)
+        self.fast_writer = FastContractWriter(self.template_cache, spec.layout)
+
+
+class ContractRenderer:
+    """按模板注册表持有每个模板的缓存和两种生成引擎，快速引擎失败时回退到openpyxl"""
+
+    def __init__(self, registry, engine='openpyxl'):
+        self.registry = registry
+        self.engine = engine
+        # 模板缓存在首次使用时才解析模板文件
+        self.templates = {spec.id: TemplateEngines(spec) for spec in registry}
+
+    def template(self, template_id=None):
+        """按模板ID取模板引擎，未知模板抛出UnknownTemplateError"""
+        return self.templates[self.registry.resolve(template_id).id]
+
+    def template_exists(self, template_id=None):
+        return self.registry.resolve(template_id).exists()
+
+    def plan(self, data):
+        """按请求中的templateId（未指定时为默认模板）的布局生成填充计划"""
+        spec = self.registry.resolve(data.get('templateId'))
+        return build_fill_plan(data, spec.layout, spec.id)
+
+    def warm(self):
+        """预先解析所有存在的模板并编译当前引擎需要的结构"""
+        for engines in self.templates.values():
+            if not engines.spec.exists():
+                continue
+            engines.template_cache.warm()
+            engines.openpyxl_writer.cell_map()
+            if self.engine == 'fast':
+                engines.fast_writer.compiled()
+
+    def render(self, plan):
+        """按填充计划生成xlsx字节，使用计划中记录的模板"""
+        engines = self.template(plan.get('template'))
+        if self.engine == 'fast':
+            try:
+                return engines.fast_writer.render(plan)
+            except Exception as e:
+                logger.warning(f"快速引擎生成失败，回退到openpyxl: {e}")
+        # 从模板缓存获取工作簿副本并填充，直接在内存中序列化
+        return engines.openpyxl_writer.render(plan)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+汇率服务 - 所有用户共用后端缓存的汇率，每个币种每个周期只请求一次上游
+
+- 同一币种的并发请求合并为一次上游请求（single-flight）
+- 缓存过期后在stale_ttl内先返回旧汇率，同时在后台刷新（stale-while-revalidate）
+- 上游连续失败达到阈值后熔断，冷却期内不再请求上游，直接返回旧汇率或降级汇率
+- 上游与前端 js/exchangeRate.js 相同（Open Exchange Rates，主/备用app_id），汇率为 CNY/币种
+
+请求合并、过期刷新和熔断的检查见 tests/test_exchange_rates.py
+"""
+import json
+import time
+import logging
+import threading
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = 'https://openexchangerates.org/api/latest.json'
+# 与 js/config.js 中的主、备用app_id相同
+DEFAULT_APP_IDS = ('9625bee048bd4599842279906b9ca677', '145b3ca7abb2474f9e1f30b2ed19b77f')
+# 上游不可用且没有缓存时的降级汇率，与前端一致
+FALLBACK_RATES = {'USD': 7.2, 'EUR': 7.8, 'GBP': 9.1, 'CNY': 1.0}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class OpenExchangeRatesFetcher:
+    """请求上游汇率表并换算为 CNY/币种，主app_id失败时使用备用app_id"""
+
+    def __init__(self, api_url=DEFAULT_API_URL, app_ids=DEFAULT_APP_IDS, timeout=5.0):
+        self.api_url = api_url
+        self.app_ids = tuple(app_ids)
+        self.timeout = timeout
+        self.requests = 0
+
+    def _fetch_rates(self, app_id):
+        separator = '&' if '?' in self.api_url else '?'
+        url = f'{self.api_url}{separator}{urllib.parse.urlencode({"app_id": app_id})}'
+        self.requests += 1
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                data = json.loads(response.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            raise UpstreamError(f'请求汇率接口失败: {e}')
+        if not isinstance(data, dict) or not isinstance(data.get('rates'), dict):
+            raise UpstreamError('汇率接口未返回rates')
+        return data['rates']
+
+    def __call__(self, currency):
+        if currency == 'CNY':
+            return 1.0
+        errors = []
+        for app_id in self.app_ids or ('',):
+            try:
+                rates = self._fetch_rates(app_id)
+                rate = rates['CNY'] / rates[currency]
+            except (UpstreamError, KeyError, TypeError, ZeroDivisionError) as e:
+                errors.append(str(e))
+                continue
+            # 与前端相同的合理性检查
+            if not 0 < rate <= 20:
+                errors.append(f'汇率不合理: {rate}')
+                continue
+            return rate
+        raise UpstreamError('; '.join(errors))
+
+
+class CircuitBreaker:
+    """
+    closed: 正常请求；连续失败failure_threshold次后open
+    open: cooldown秒内拒绝请求；之后half_open，只放行一个试探请求，成功则closed，失败则重新open
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.opens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if self.clock() - self.opened_at < self.cooldown else 'half_open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_running:
+                    self.opens += 1
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+
+class ExchangeRateService:
+    """
+    按币种缓存汇率：ttl秒内直接返回；ttl到ttl+stale_ttl之间返回旧值并在后台刷新；
+    更旧或没有缓存时等待上游（同一币种只有一个请求在进行），上游失败时返回旧值或降级汇率
+    """
+
+    def __init__(self, fetch, ttl=300.0, stale_ttl=86400.0, breaker=None, fallback_rates=FALLBACK_RATES,
+                 clock=time.time):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.breaker = breaker or CircuitBreaker()
+        self.fallback_rates = dict(fallback_rates)
+        self.clock = clock
+        # 币种 -> (汇率, 获取时间)
+        self._cache = {}
+        # 币种 -> 进行中的上游请求
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.fallbacks = 0
+        self.upstream_fetches = 0
+        self.upstream_errors = 0
+        self.last_error = None
+
+    @property
+    def currencies(self):
+        return tuple(self.fallback_rates)
+
+    def _fetch_once(self, currency):
+        """发起或加入该币种进行中的上游请求，返回 (Future, 是否由本线程发起)"""
+        with self._lock:
+            future = self._inflight.get(currency)
+            if future is not None:
+                return future, False
+            future = self._inflight[currency] = Future()
+        return future, True
+
+    def _run_fetch(self, currency, future):
+        try:
+            if not self.breaker.allow():
+                raise UpstreamError('上游熔断中')
+            with self._lock:
+                self.upstream_fetches += 1
+            try:
+                rate = self.fetch(currency)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            with self._lock:
+                self._cache[currency] = (rate, self.clock())
+            future.set_result(rate)
+        except Exception as e:
+            with self._lock:
+                self.upstream_errors += 1
+                self.last_error = str(e)
+            logger.warning(f"获取 {currency} 汇率失败: {e}")
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(currency, None)
+
+    def _refresh_in_background(self, currency):
+        future, owner = self._fetch_once(currency)
+        if owner:
+            threading.Thread(target=self._run_fetch, args=(currency, future),
+                             name=f'exchange-rate-{currency}', daemon=True).start()
+
+    def _result(self, currency, rate, fetched_at, source):
+        now = self.clock()
+        return {
+            'currency': currency,
+            'rate': rate,
+            'source': source,
+            'fetchedAt': datetime.fromtimestamp(fetched_at).isoformat(timespec='seconds') if fetched_at is not None else None,
+            'age': round(now - fetched_at, 3) if fetched_at is not None else None,
+            'maxAge': max(int(fetched_at + self.ttl - now), 0) if source == 'live' else 0
+        }
+
+    def get(self, currency):
+        """返回汇率信息，source为 live（未过期）、stale（过期的缓存）或 fallback（降级汇率）"""
+        cached = self._cache.get(currency)
+        now = self.clock()
+        if cached is not None:
+            rate, fetched_at = cached
+            age = now - fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return self._result(currency, rate, fetched_at, 'live')
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh_in_background(currency)
+                return self._result(currency, rate, fetched_at, 'stale')
+
+        future, owner = self._fetch_once(currency)
+        if owner:
+            self._run_fetch(currency, future)
+        try:
+            future.result()
+            rate, fetched_at = self._cache[currency]
+            return self._result(currency, rate, fetched_at, 'live')
+        except Exception:
+            pass
+        cached = self._cache.get(currency)
+        if cached is not None:
+            self.stale_hits += 1
+            return self._result(currency, cached[0], cached[1], 'stale')
+        self.fallbacks += 1
+        return self._result(currency, self.fallback_rates[currency], None, 'fallback')
+
+    def stats(self):
+        now = self.clock()
+        return {
+            'ttl': self.ttl,
+            'stale_ttl': self.stale_ttl,
+            'cached': {currency: {'rate': rate, 'age': round(now - fetched_at, 3)}
+                       for currency, (rate, fetched_at) in list(self._cache.items())},
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'fallbacks': self.fallbacks,
+            'upstream_fetches': self.upstream_fetches,
+            'upstream_errors': self.upstream_errors,
+            'last_error': self.last_error,
+            'breaker': {
+                'state': self.breaker.state,
+                'failures': self.breaker.failures,
+                'opens': self.breaker.opens
+            }
+        }
+
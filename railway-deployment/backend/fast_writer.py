@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+快速合同生成引擎 - 预编译模板的sheet XML，按请求直接拼接单元格和隐藏行后写入zip
+
+编译时用openpyxl把所有目标单元格写入占位符并取消加粗后保存一次，
+得到基础XML、样式表和"已写入"状态的样式编号；目标单元格的原始样式也提前登记到样式表。
+之后每个请求只需要拼接字符串并压缩，不再构建openpyxl对象模型。
+"""
+import io
+import re
+import math
+import zipfile
+import threading
+import logging
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ERROR_CODES, ILLEGAL_CHARACTERS_RE
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.utils.cell import coordinate_to_tuple
+
+from contract_plan import safe_set_cell_value, save_workbook_to_bytes
+from metrics import stage
+from template_registry import DEFAULT_LAYOUT
+
+logger = logging.getLogger(__name__)
+
+# 占位符使用私有区字符，不会出现在模板内容中
+PLACEHOLDER_START = '\ue000'
+PLACEHOLDER_END = '\ue001'
+
+# Excel单元格字符串长度上限（与openpyxl一致）
+MAX_STRING_LENGTH = 32767
+
+CORE_PART = 'docProps/core.xml'
+MODIFIED_RE = re.compile(r'(<dcterms:modified xsi:type="dcterms:W3CDTF">)[^<]*(</dcterms:modified>)')
+
+
+class UnsupportedValueError(ValueError):
+    """快速引擎无法按openpyxl的规则输出该值，需要回退到openpyxl引擎"""
+
+
+def _sheet_part_name(index):
+    # openpyxl按sheet顺序命名 xl/worksheets/sheetN.xml
+    return f'xl/worksheets/sheet{index + 1}.xml'
+
+
+def _save_workbook(workbook):
+    content, _ = save_workbook_to_bytes(workbook)
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        return [(info.filename, archive.read(info.filename)) for info in archive.infolist()]
+
+
+def _text_xml(value):
+    """按openpyxl(ElementTree)的方式输出<t>节点"""
+    text = escape(value)
+    stripped = value.strip()
+    if stripped and value != stripped:
+        return f'<t xml:space="preserve">{text}</t>'
+    return f'<t>{text}</t>'
+
+
+def render_cell(prefix, value):
+    """
+    输出单元格XML，prefix为 <c r="C3" s="12"
+    只支持JSON中会出现的标量值（字符串按openpyxl规则识别公式和错误值），
+    其余情况抛出UnsupportedValueError
+    """
+    if value is None:
+        return f'{prefix} t="n" />'
+    if isinstance(value, bool):
+        return f'{prefix} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+            raise UnsupportedValueError(value)
+        return f'{prefix} t="n"><v>{"%.16g" % value}</v></c>'
+    if isinstance(value, str):
+        value = value[:MAX_STRING_LENGTH]
+        if value == '':
+            return f'{prefix} t="inlineStr" />'
+        if ILLEGAL_CHARACTERS_RE.search(value):
+            raise UnsupportedValueError(value)
+        if len(value) > 1 and value.startswith('='):
+            return f'{prefix}><f>{escape(value[1:])}</f><v /></c>'
+        if value in ERROR_CODES:
+            return f'{prefix} t="e"><v>{escape(value)}</v></c>'
+        return f'{prefix} t="inlineStr"><is>{_text_xml(value)}</is></c>'
+    raise UnsupportedValueError(value)
+
+
+class CompiledTemplate:
+    """编译后的模板：静态部件 + 可拼接的sheet片段"""
+
+    def __init__(self, template_cache, layout=DEFAULT_LAYOUT):
+        self.version = template_cache.version
+        self.layout = layout
+        self.anchors = {}
+        self.written_prefix = {}
+        self.original_xml = {}
+        self.row_tags = {}
+        self.sheet_parts = {}
+        self.parts = []
+        self._compile(template_cache)
+
+    def _compile(self, template_cache):
+        layout = self.layout
+        workbook = template_cache.get_workbook(record=False)
+        fill_sheet = workbook[layout.fill_sheet]
+
+        # 记录目标单元格（合并单元格取主单元格）的原始值和原始样式
+        originals = {}
+        for address in layout.all_target_cells():
+            anchor = address
+            for merged_range in fill_sheet.merged_cells.ranges:
+                if address in merged_range:
+                    anchor = merged_range.start_cell.coordinate
+                    break
+            self.anchors[address] = anchor
+            cell = fill_sheet._cells.get(coordinate_to_tuple(anchor))
+            if anchor not in originals:
+                originals[anchor] = (cell._value, StyleArray(cell._style)) if cell is not None else None
+
+        # 目标单元格写入占位符并取消加粗，得到"已写入"状态的样式编号
+        for anchor in originals:
+            safe_set_cell_value(fill_sheet, anchor, f'{PLACEHOLDER_START}{anchor}{PLACEHOLDER_END}')
+
+        # 原始样式提前登记到样式表，保证未写入的单元格也能引用
+        original_prefix = {}
+        for anchor, original in originals.items():
+            if original is None:
+                continue
+            value, style = original
+            if any(style):
+                original_prefix[anchor] = f'<c r="{anchor}" s="{workbook._cell_styles.add(style)}"'
+            else:
+                original_prefix[anchor] = f'<c r="{anchor}"'
+
+        sheet_names = workbook.sheetnames
+        part_sheets = {_sheet_part_name(i): name for i, name in enumerate(sheet_names)}
+        fill_part = _sheet_part_name(sheet_names.index(layout.fill_sheet))
+        hide_parts = {_sheet_part_name(sheet_names.index(name)) for name in layout.hide_row_sheets}
+        goods_rows = layout.goods_rows
+
+        for name, content in _save_workbook(workbook):
+            if name == CORE_PART:
+                # 修改时间与openpyxl一样在每次生成时写入，不沿用编译时的时间
+                match = MODIFIED_RE.search(content.decode('utf-8'))
+                if match is not None:
+                    xml = content.decode('utf-8')
+                    self.parts.append((name, [xml[:match.end(1)], ('modified', None), xml[match.start(2):]]))
+                    continue
+            if name not in hide_parts and name != fill_part:
+                self.parts.append((name, content))
+                continue
+
+            xml = content.decode('utf-8')
+            sheet_name = part_sheets[name]
+            # 片段列表：字符串为静态内容，元组为('cell', 单元格)、('row', 行号) 或 ('modified', None)
+            markers = []
+
+            if name == fill_part:
+                for anchor, original in originals.items():
+                    match = re.search(
+                        rf'(<c r="{anchor}"[^>]*?) t="inlineStr"><is><t>'
+                        rf'{PLACEHOLDER_START}{anchor}{PLACEHOLDER_END}</t></is></c>', xml)
+                    if match is None:
+                        raise ValueError(f"编译模板失败，未找到单元格占位符: {anchor}")
+                    self.written_prefix[anchor] = match.group(1)
+                    # 与openpyxl一致：没有值也没有样式的单元格不输出
+                    if original is None or (original[0] is None and anchor not in original_prefix):
+                        self.original_xml[anchor] = ''
+                    else:
+                        self.original_xml[anchor] = render_cell(original_prefix[anchor], original[0])
+                    markers.append((match.start(), match.end(), ('cell', anchor)))
+
+            if name in hide_parts:
+                for row in goods_rows:
+                    match = re.search(rf'<row r="{row}"[^>]*?>', xml)
+                    if match is None:
+                        raise ValueError(f"编译模板失败，未找到商品行: {sheet_name}!{row}")
+                    visible_tag = match.group(0)
+                    # openpyxl输出<row>属性时hidden紧跟在r之后
+                    hidden_tag = visible_tag
+                    if ' hidden="1"' not in visible_tag:
+                        hidden_tag = visible_tag.replace(f'<row r="{row}"', f'<row r="{row}" hidden="1"', 1)
+                    self.row_tags[(sheet_name, row)] = (visible_tag, hidden_tag)
+                    markers.append((match.start(), match.end(), ('row', row)))
+
+            segments = []
+            position = 0
+            for start, end, marker in sorted(markers):
+                segments.append(xml[position:start])
+                segments.append(marker)
+                position = end
+            segments.append(xml[position:])
+            self.sheet_parts[name] = sheet_name
+            self.parts.append((name, segments))
+
+    def render(self, plan):
+        """按填充计划生成xlsx字节"""
+        cell_xml = {}
+        for address, value in plan['cells']:
+            anchor = self.anchors[address]
+            cell_xml[anchor] = render_cell(self.written_prefix[anchor], value)
+        hidden_rows = set(plan['hidden_rows'])
+        modified = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in self.parts:
+                if isinstance(content, bytes):
+                    archive.writestr(name, content)
+                    continue
+                sheet_name = self.sheet_parts.get(name)
+                pieces = []
+                for segment in content:
+                    if isinstance(segment, str):
+                        pieces.append(segment)
+                    elif segment[0] == 'cell':
+                        anchor = segment[1]
+                        pieces.append(cell_xml.get(anchor) or self.original_xml[anchor])
+                    elif segment[0] == 'modified':
+                        pieces.append(modified)
+                    else:
+                        row = segment[1]
+                        visible_tag, hidden_tag = self.row_tags[(sheet_name, row)]
+                        pieces.append(hidden_tag if row in hidden_rows else visible_tag)
+                archive.writestr(name, ''.join(pieces).encode('utf-8'))
+        return buffer.getvalue()
+
+
+class FastContractWriter:
+    """快速引擎入口：模板变化时自动重新编译"""
+
+    def __init__(self, template_cache, layout=DEFAULT_LAYOUT):
+        self.template_cache = template_cache
+        self.layout = layout
+        self._lock = threading.Lock()
+        self._compiled = None
+
+    def compiled(self):
+        self.template_cache.warm()
+        compiled = self._compiled
+        if compiled is None or compiled.version != self.template_cache.version:
+            with self._lock:
+                compiled = self._compiled
+                if compiled is None or compiled.version != self.template_cache.version:
+                    compiled = CompiledTemplate(self.template_cache, self.layout)
+                    self._compiled = compiled
+                    logger.info("快速引擎模板编译完成")
+        return compiled
+
+    def render(self, plan):
+        compiled = self.compiled()
+        with stage('fast_render'):
+            return compiled.render(plan)
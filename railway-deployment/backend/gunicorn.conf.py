@@ -0,0 +1,17 @@
+"""
+gunicorn配置 - 生产环境入口：gunicorn -c gunicorn.conf.py app:app
+
+gthread工作模式下请求线程只负责收发，CPU密集的合同渲染交给进程池，
+单个慢合同不会阻塞 /health 等其他请求。
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+accesslog = '-'
+
+# 生产环境默认按CPU核数启动渲染进程池（app.py读取），每个gunicorn worker各有一个进程池，核数按worker数平分
+os.environ.setdefault('RENDER_WORKERS', str(max((os.cpu_count() or 1) // workers, 1)))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+日志管道 - 日志记录先放入有界队列，由后台线程格式化并写出，请求线程不再等待I/O；
+合同数据只按采样率记录，并在格式化时脱敏、截断
+"""
+import json
+import queue
+import random
+import atexit
+import logging
+import threading
+import logging.handlers
+
+# 默认脱敏的个人信息和银行信息字段
+DEFAULT_REDACT_FIELDS = ('buyerName', 'buyerPhone', 'buyerAddress',
+                         'sellerPhone', 'sellerAddress', 'bankInfo')
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    队列满时丢弃日志并计数，不阻塞请求线程
+    不在请求线程内格式化：消息和参数原样交给后台线程，由其中的处理器格式化
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        # 多个请求线程可能同时丢弃日志，计数需要加锁
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class LogPipeline:
+    """把根日志器的处理器移到后台线程，根日志器只保留一个队列处理器"""
+
+    def __init__(self, max_queue=10000):
+        self.queue = queue.Queue(max_queue)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.listener = None
+
+    def start(self, logger=None):
+        logger = logger or logging.getLogger()
+        if self.listener is not None:
+            return self
+        handlers = [handler for handler in logger.handlers if handler is not self.handler]
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(self.handler)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        # 退出时写完队列中剩余的日志
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def stats(self):
+        return {
+            'running': self.listener is not None,
+            'queued': self.queue.qsize(),
+            'max_queue': self.queue.maxsize,
+            'dropped': self.handler.dropped
+        }
+
+
+def _redact(value):
+    return f'<redacted:{len(str(value))}>' if value not in (None, '') else value
+
+
+class ContractLogSummary:
+    """
+    合同数据的日志表示，作为日志参数传入，只在后台线程格式化时才脱敏、截断并序列化
+    持有请求数据的引用，调用方在记录日志后不应修改该数据
+    """
+
+    def __init__(self, data, redact_fields, max_goods_rows, max_chars):
+        self.data = data
+        self.redact_fields = redact_fields
+        self.max_goods_rows = max_goods_rows
+        self.max_chars = max_chars
+
+    def summary(self):
+        if not isinstance(self.data, dict):
+            return {'type': type(self.data).__name__}
+        summary = {}
+        for key, value in self.data.items():
+            if key in self.redact_fields:
+                summary[key] = _redact(value)
+            elif key == 'goodsData' and isinstance(value, list):
+                summary[key] = value[:self.max_goods_rows]
+                if len(value) > self.max_goods_rows:
+                    summary['goodsDataOmitted'] = len(value) - self.max_goods_rows
+            else:
+                summary[key] = value
+        return summary
+
+    def __str__(self):
+        text = json.dumps(self.summary(), ensure_ascii=False, default=str)
+        if len(text) > self.max_chars:
+            text = f'{text[:self.max_chars]}...(共{len(text)}字符)'
+        return text
+
+
+class ContractLogger:
+    """合同请求日志：每个请求记录一行摘要，完整数据按采样率记录"""
+
+    def __init__(self, logger, sample_rate=0.1, redact_fields=DEFAULT_REDACT_FIELDS,
+                 max_goods_rows=3, max_chars=2000):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.redact_fields = frozenset(redact_fields)
+        self.max_goods_rows = max_goods_rows
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self.sampled = 0
+
+    def log_request(self, data):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        if isinstance(data, dict):
+            goods = data.get('goodsData')
+            self.logger.info('收到合同数据: 合同号=%s 商品行数=%s', data.get('contractNumber'),
+                             len(goods) if isinstance(goods, list) else 0)
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            with self._lock:
+                self.sampled += 1
+            self.logger.info('合同数据采样: %s', ContractLogSummary(
+                data, self.redact_fields, self.max_goods_rows, self.max_chars))
+
+    def stats(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'sampled': self.sampled,
+            'redact_fields': sorted(self.redact_fields),
+            'max_goods_rows': self.max_goods_rows,
+            'max_chars': self.max_chars
+        }
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+配置价格历史 - 每次采集后导入品牌文件快照，只追加价格或在售状态发生变化的配置
+
+目录结构：MANIFEST（当前段文件列表，整体替换）、seg-NNNNNN.log（段文件）
+写入锁文件放在系统临时目录中，历史目录随数据提交时不会带上锁文件
+段文件：8字节魔数 + 若干数据块，只追加
+数据块：36字节块头（标记、首末快照时间、快照数、记录数、长度、CRC32） + zlib压缩的内容
+块内容：每个快照依次为 时间、品牌文件名表、记录数、按configId排序的记录，
+        记录为 configId差值、文件名编号、状态、价格（元），整数均为变长编码
+
+每次导入追加一个只含一个快照的数据块，段内块数达到segment_blocks时换新段；
+已写满的段超过compact_segments个时（或手动compact）合并为一个段，多个快照放入同一个数据块压缩，
+读取时只解码变化记录，不需要回放完整快照
+
+用法：
+    python price_history.py ingest   [数据目录] [历史目录] [--at 时间]   导入当前品牌文件
+    python price_history.py history  配置ID [历史目录]                   配置的价格历史
+    python price_history.py repriced 日期 [历史目录]                     该日期之后调价的配置
+    python price_history.py compact  [历史目录]                          合并已写满的段
+    python price_history.py stats    [历史目录]
+"""
+import os
+import sys
+import json
+import zlib
+import time
+import hashlib
+import tempfile
+import struct
+import bisect
+import argparse
+import logging
+import threading
+from datetime import datetime
+
+from catalog import read_brands, read_brand_file
+from catalog_pack import price_to_yuan
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CQPH1\x00\x00\x00'
+BLOCK_TAG = b'PHB1'
+# 标记、首个快照时间、最后快照时间、快照数、记录数、内容长度、CRC32
+BLOCK_HEADER = struct.Struct('<4sddIIII')
+MANIFEST_NAME = 'MANIFEST'
+
+# 记录状态
+LISTED = 0      # 在售且有报价
+UNPRICED = 1    # 在售但报价无法解析（如"暂无报价"）
+REMOVED = 2     # 已从品牌文件中消失
+STATUS_NAMES = {LISTED: 'listed', UNPRICED: 'unpriced', REMOVED: 'removed'}
+
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_snapshots(snapshots):
+    """snapshots为 [(时间, [(configId, 文件名, 状态, 价格), ...]), ...]，记录需按configId排序"""
+    out = bytearray()
+    _write_varint(out, len(snapshots))
+    for at, records in snapshots:
+        out += struct.pack('<d', at)
+        files = sorted({record[1] for record in records})
+        file_index = {file_name: i for i, file_name in enumerate(files)}
+        _write_varint(out, len(files))
+        for file_name in files:
+            encoded = file_name.encode('utf-8')
+            _write_varint(out, len(encoded))
+            out += encoded
+        _write_varint(out, len(records))
+        previous = 0
+        for config_id, file_name, status, price in records:
+            _write_varint(out, config_id - previous)
+            previous = config_id
+            _write_varint(out, file_index[file_name])
+            out.append(status)
+            if status == LISTED:
+                _write_varint(out, price)
+    return bytes(out)
+
+
+def decode_snapshots(data):
+    snapshots = []
+    count, offset = _read_varint(data, 0)
+    for _ in range(count):
+        at, = struct.unpack_from('<d', data, offset)
+        offset += 8
+        file_count, offset = _read_varint(data, offset)
+        files = []
+        for _ in range(file_count):
+            length, offset = _read_varint(data, offset)
+            files.append(bytes(data[offset:offset + length]).decode('utf-8'))
+            offset += length
+        record_count, offset = _read_varint(data, offset)
+        records = []
+        config_id = 0
+        for _ in range(record_count):
+            delta, offset = _read_varint(data, offset)
+            config_id += delta
+            file_index, offset = _read_varint(data, offset)
+            status = data[offset]
+            offset += 1
+            price = None
+            if status == LISTED:
+                price, offset = _read_varint(data, offset)
+            records.append((config_id, files[file_index], status, price))
+        snapshots.append((at, records))
+    return snapshots
+
+
+def encode_block(snapshots):
+    payload = zlib.compress(encode_snapshots(snapshots), 9)
+    header = BLOCK_HEADER.pack(BLOCK_TAG, snapshots[0][0], snapshots[-1][0], len(snapshots),
+                               sum(len(records) for _, records in snapshots), len(payload), zlib.crc32(payload))
+    return header + payload
+
+
+def read_segment(path):
+    """
+    读取段文件中的全部快照，返回 (快照列表, 完整数据块的结束位置, 数据块数)
+    末尾不完整或校验失败的数据块（写入中断或正在写入）不读取
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'不是价格历史段文件: {path}')
+    snapshots = []
+    offset = len(MAGIC)
+    blocks = 0
+    while offset + BLOCK_HEADER.size <= len(data):
+        tag, _, _, _, _, length, crc = BLOCK_HEADER.unpack_from(data, offset)
+        start = offset + BLOCK_HEADER.size
+        payload = data[start:start + length]
+        if tag != BLOCK_TAG or len(payload) != length or zlib.crc32(payload) != crc:
+            break
+        snapshots.extend(decode_snapshots(zlib.decompress(payload)))
+        offset = start + length
+        blocks += 1
+    return snapshots, offset, blocks
+
+
+def read_snapshot(data_dir):
+    """
+    读取brands.json中列出的品牌文件，返回 ({文件名: {configId: 价格或None}}, 读取失败的文件)
+    configId不是整数的配置不记录；同一configId出现在多个品牌文件时取文件名排序在前的
+    """
+    brands, _ = read_brands(data_dir)
+    snapshot = {}
+    failed = []
+    seen = set()
+    for file_name in sorted({brand.get('file') for brand in brands if brand.get('file')}):
+        try:
+            brand_data, _ = read_brand_file(data_dir, file_name)
+        except Exception as e:
+            logger.warning(f"读取品牌文件 {file_name} 失败，保留该品牌上次的状态: {e}")
+            failed.append(file_name)
+            continue
+        prices = snapshot[file_name] = {}
+        for car in brand_data.get('cars') or []:
+            for config in car.get('configs') or []:
+                config_id = str(config.get('configId') or '')
+                if not config_id.isdigit() or int(config_id) in seen:
+                    continue
+                seen.add(int(config_id))
+                yuan = price_to_yuan(config.get('price'))
+                prices[int(config_id)] = round(yuan) if yuan == yuan else None
+    return snapshot, failed
+
+
+class HistoryData:
+    """
+    不可变的历史快照：
+    state      configId -> (文件名, 状态, 价格) 最新状态
+    events     按时间排列的 (时间, configId, 文件名, 状态, 价格, 之前的状态, 之前的价格)
+    by_config  configId -> 该配置的事件编号列表
+    """
+
+    def __init__(self, snapshots):
+        self.state = {}
+        self.events = []
+        self.by_config = {}
+        self.snapshots = 0
+        self.last_at = None
+        for at, records in snapshots:
+            self.add(at, records)
+
+    def add(self, at, records):
+        for config_id, file_name, status, price in records:
+            previous = self.state.get(config_id)
+            self.by_config.setdefault(config_id, []).append(len(self.events))
+            self.events.append((at, config_id, file_name, status, price,
+                                previous[1] if previous else None, previous[2] if previous else None))
+            self.state[config_id] = (file_name, status, price)
+        self.snapshots += 1
+        self.last_at = at
+
+    def diff(self, snapshot):
+        """与最新状态对比，返回需要追加的记录；未读取到的品牌文件中的配置保持原状态"""
+        records = []
+        present = set()
+        for file_name, prices in snapshot.items():
+            for config_id, price in prices.items():
+                present.add(config_id)
+                status = LISTED if price is not None else UNPRICED
+                if self.state.get(config_id) != (file_name, status, price):
+                    records.append((config_id, file_name, status, price))
+        for config_id, (file_name, status, _) in self.state.items():
+            if status != REMOVED and file_name in snapshot and config_id not in present:
+                records.append((config_id, file_name, REMOVED, None))
+        records.sort()
+        return records
+
+
+def _event_dict(event):
+    at, config_id, file_name, status, price, _, _ = event
+    return {
+        'at': datetime.fromtimestamp(at).isoformat(timespec='seconds'),
+        'file': file_name,
+        'status': STATUS_NAMES[status],
+        'price': price
+    }
+
+
+class PriceHistory:
+    """
+    价格历史目录：读取方在段文件变化时重新加载；写入（导入、合并）通过临时目录中的锁文件互斥，
+    段列表记录在MANIFEST中并整体替换，读取方不会同时看到合并前后的段
+    """
+
+    def __init__(self, path, segment_blocks=30, compact_segments=4, compact_block_snapshots=64):
+        self.path = path
+        self.segment_blocks = segment_blocks
+        self.compact_segments = compact_segments
+        self.compact_block_snapshots = compact_block_snapshots
+        self._data = None
+        self._source = None
+        self._lock = threading.Lock()
+        self.load_ms = 0.0
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_manifest(self):
+        try:
+            with open(self._file(MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_manifest(self, manifest):
+        temp_path = self._file(MANIFEST_NAME + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._file(MANIFEST_NAME))
+
+    def _source_stat(self, manifest):
+        """MANIFEST和各段文件的大小，用于判断是否需要重新加载"""
+        if manifest is None:
+            return None
+        sizes = []
+        for name in manifest['segments']:
+            try:
+                sizes.append((name, os.path.getsize(self._file(name))))
+            except FileNotFoundError:
+                sizes.append((name, None))
+        return json.dumps(manifest, sort_keys=True), tuple(sizes)
+
+    def available(self):
+        return os.path.exists(self._file(MANIFEST_NAME))
+
+    def refresh(self):
+        """段文件有变化时重新加载，返回当前的HistoryData（目录不存在时为None）"""
+        with self._lock:
+            # 合并可能在读取MANIFEST之后删除旧段，重新读取一次MANIFEST即可
+            for attempt in range(2):
+                manifest = self._read_manifest()
+                source = self._source_stat(manifest)
+                if source == self._source and (self._data is not None or manifest is None):
+                    return self._data
+                try:
+                    self._data = self._load(manifest)
+                    self._source = source
+                    return self._data
+                except FileNotFoundError:
+                    if attempt:
+                        raise
+        return self._data
+
+    def _load(self, manifest):
+        if manifest is None:
+            return None
+        started = time.perf_counter()
+        snapshots = []
+        for name in manifest['segments']:
+            segment_snapshots, _, _ = read_segment(self._file(name))
+            snapshots.extend(segment_snapshots)
+        data = HistoryData(snapshots)
+        self.load_ms = (time.perf_counter() - started) * 1000
+        return data
+
+    def history(self, config_id):
+        """配置的全部变化记录，没有记录时返回None"""
+        data = self.refresh()
+        if data is None or config_id not in data.by_config:
+            return None
+        return [_event_dict(data.events[i]) for i in data.by_config[config_id]]
+
+    def repriced_since(self, since):
+        """
+        since（时间戳）之后价格发生变化的配置，每个配置一项：
+        oldPrice为该时间之后第一次调价前的价格，price为最新价格
+        """
+        data = self.refresh()
+        if data is None:
+            return []
+        start = bisect.bisect_left(data.events, (since,))
+        repriced = {}
+        for at, config_id, file_name, status, price, previous_status, previous_price in data.events[start:]:
+            if status != LISTED or previous_status != LISTED or price == previous_price:
+                continue
+            item = repriced.get(config_id)
+            if item is None:
+                item = repriced[config_id] = {'configId': str(config_id), 'oldPrice': previous_price, 'changes': 0}
+            item.update(file=file_name, price=price, changes=item['changes'] + 1,
+                        changedAt=datetime.fromtimestamp(at).isoformat(timespec='seconds'))
+        return sorted(repriced.values(), key=lambda item: (item['changedAt'], int(item['configId'])), reverse=True)
+
+    def lock_path(self):
+        """写入锁文件：按历史目录的绝对路径命名，放在系统临时目录中"""
+        digest = hashlib.sha1(os.path.realpath(self.path).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(tempfile.gettempdir(), f'price-history-{digest}.lock')
+
+    def _locked(self):
+        """写入锁，关闭返回的文件时释放；POSIX使用flock，Windows（开发环境）使用msvcrt"""
+        os.makedirs(self.path, exist_ok=True)
+        lock_file = open(self.lock_path(), 'a')
+        try:
+            import fcntl
+        except ImportError:  # Windows没有fcntl
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _open_segment(self, manifest):
+        """返回可追加的段文件名，当前段已满时新建一段"""
+        segments = manifest['segments']
+        if segments:
+            name = segments[-1]
+            path = self._file(name)
+            _, end, blocks = read_segment(path)
+            # 去掉上次写入中断留下的不完整数据块
+            if end != os.path.getsize(path):
+                logger.warning(f"价格历史段 {name} 末尾有不完整的数据块，已截断")
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+            if blocks < self.segment_blocks:
+                return name
+        name = f"seg-{manifest['next_segment']:06d}.log"
+        manifest['next_segment'] += 1
+        with open(self._file(name), 'wb') as f:
+            f.write(MAGIC)
+        segments.append(name)
+        self._write_manifest(manifest)
+        return name
+
+    def ingest(self, snapshot, at=None):
+        """导入一个快照，只追加有变化的配置，返回本次导入的统计"""
+        at = time.time() if at is None else at
+        with self._locked():
+            manifest = self._read_manifest() or {'format': 1, 'segments': [], 'next_segment': 1}
+            data = self._load(manifest) or HistoryData([])
+            if data.last_at is not None and at < data.last_at:
+                raise ValueError('快照时间早于最近一次导入的时间')
+            records = data.diff(snapshot)
+            summary = {'at': datetime.fromtimestamp(at).isoformat(timespec='seconds'),
+                       'configs': sum(len(prices) for prices in snapshot.values()),
+                       'records': len(records), 'added': 0, 'repriced': 0, 'status_changed': 0, 'removed': 0,
+                       'bytes': 0}
+            for config_id, _, status, price in records:
+                previous = data.state.get(config_id)
+                if previous is None:
+                    summary['added'] += 1
+                elif status == REMOVED:
+                    summary['removed'] += 1
+                elif previous[1] != status:
+                    summary['status_changed'] += 1
+                elif status == LISTED and previous[2] != price:
+                    summary['repriced'] += 1
+            if records:
+                block = encode_block([(at, records)])
+                name = self._open_segment(manifest)
+                with open(self._file(name), 'ab') as f:
+                    f.write(block)
+                    f.flush()
+                    os.fsync(f.fileno())
+                summary['bytes'] = len(block)
+                # 已写满的段达到compact_segments个时自动合并
+                if len(manifest['segments']) > self.compact_segments:
+                    summary['compacted'] = self._compact(manifest)
+        return summary
+
+    def compact(self):
+        """把已写满的段（当前追加的段除外）合并为一段，多个快照放入同一个数据块"""
+        with self._locked():
+            manifest = self._read_manifest()
+            return self._compact(manifest) if manifest is not None else {'merged': 0}
+
+    def _compact(self, manifest):
+        sealed = manifest['segments'][:-1]
+        snapshots = []
+        before = 0
+        blocks = 0
+        for name in sealed:
+            segment_snapshots, end, segment_blocks = read_segment(self._file(name))
+            snapshots.extend(segment_snapshots)
+            before += end
+            blocks += segment_blocks
+        # 只有一段且已按合并后的块大小存放时不需要重写
+        if not snapshots or (len(sealed) == 1 and
+                             blocks <= -(-len(snapshots) // self.compact_block_snapshots)):
+            return {'merged': 0}
+        name = f"seg-{manifest['next_segment']:06d}.log"
+        manifest['next_segment'] += 1
+        temp_path = self._file(name + '.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(MAGIC)
+            for start in range(0, len(snapshots), self.compact_block_snapshots):
+                f.write(encode_block(snapshots[start:start + self.compact_block_snapshots]))
+            f.flush()
+            os.fsync(f.fileno())
+            after = f.tell()
+        os.replace(temp_path, self._file(name))
+        manifest['segments'] = [name] + manifest['segments'][-1:]
+        self._write_manifest(manifest)
+        for old in sealed:
+            os.remove(self._file(old))
+        logger.info(f"价格历史合并 {len(sealed)} 段: {before} -> {after} 字节")
+        return {'merged': len(sealed), 'snapshots': len(snapshots), 'bytes_before': before, 'bytes_after': after}
+
+    def stats(self):
+        data = self.refresh()
+        manifest = self._read_manifest()
+        stats = {'path': self.path, 'available': data is not None}
+        if data is not None:
+            stats.update({
+                'segments': len(manifest['segments']),
+                'bytes': sum(os.path.getsize(self._file(name)) for name in manifest['segments']),
+                'snapshots': data.snapshots,
+                'records': len(data.events),
+                'configs': len(data.by_config),
+                'last_ingest': datetime.fromtimestamp(data.last_at).isoformat(timespec='seconds'),
+                'load_ms': round(self.load_ms, 2)
+            })
+        return stats
+
+
+def parse_time(text):
+    """ISO日期或时间（本地时间），返回时间戳"""
+    return datetime.fromisoformat(text).timestamp()
+
+
+def main():
+    default_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+    default_history = os.path.join(default_data, 'price-history')
+    parser = argparse.ArgumentParser(description='配置价格历史')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest', help='导入当前品牌文件')
+    ingest.add_argument('data_dir', nargs='?', default=default_data)
+    ingest.add_argument('history_dir', nargs='?')
+    ingest.add_argument('--at', help='快照时间，默认为当前时间')
+    history = commands.add_parser('history', help='配置的价格历史')
+    history.add_argument('config_id', type=int)
+    history.add_argument('history_dir', nargs='?', default=default_history)
+    repriced = commands.add_parser('repriced', help='某个日期之后调价的配置')
+    repriced.add_argument('since')
+    repriced.add_argument('history_dir', nargs='?', default=default_history)
+    compact = commands.add_parser('compact', help='合并已写满的段')
+    compact.add_argument('history_dir', nargs='?', default=default_history)
+    stats = commands.add_parser('stats')
+    stats.add_argument('history_dir', nargs='?', default=default_history)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'ingest':
+        store = PriceHistory(args.history_dir or os.path.join(args.data_dir, 'price-history'))
+        snapshot, failed = read_snapshot(args.data_dir)
+        result = store.ingest(snapshot, parse_time(args.at) if args.at else None)
+        result['failed_files'] = failed
+    elif args.command == 'history':
+        result = PriceHistory(args.history_dir).history(args.config_id)
+        if result is None:
+            print(f'没有配置 {args.config_id} 的价格记录')
+            return 1
+    elif args.command == 'repriced':
+        result = PriceHistory(args.history_dir).repriced_since(parse_time(args.since))
+    elif args.command == 'compact':
+        result = PriceHistory(args.history_dir).compact()
+    else:
+        result = PriceHistory(args.history_dir).stats()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+批量报价引擎 - 与前端 js/calculationEngine.js 的公式和 js/config.js 的常量保持一致
+
+前端每一步的结果都会写回输入框再被下一步读取，所以中间值带有页面上的取整：
+开票价、手续费、退税手续费、购车成本、人民币报价按 Math.round 取整，退税和购置税按 toFixed(2) 保留两位。
+这里按同样的顺序和取整方式计算，安装了numpy时整批配置一次向量化计算，否则逐行计算。
+
+与前端公式的一致性由 tests/test_quote_engine.py 验证。
+
+用法：
+    python quote_engine.py bench    测试每秒可计算的报价行数
+"""
+import re
+import sys
+import math
+import time
+import random
+from decimal import Decimal, ROUND_HALF_UP
+
+try:
+    import numpy as np
+except ImportError:  # 未安装numpy时逐行计算
+    np = None
+
+# 与 js/config.js 中 CONFIG.CALCULATION 一致
+CALCULATION = {
+    'TAX_RATE': 0.13,
+    'TAX_DIVISOR': 1.13,
+    'PURCHASE_TAX_RATE': 11.3,
+    'TAX_REFUND_FEE_RATE': 0.025,
+    'SERVICE_FEE_RATE': 0.022,
+    'EXCHANGE_RATE_OFFSET': 0.05,
+    'NEW_ENERGY_TAX_THRESHOLD': 339000
+}
+
+# 与 js/config.js 中 CONFIG.DEFAULTS 一致
+DEFAULT_SERVICE_FEE_RATE = 0.08
+DEFAULT_CURRENCY = 'USD'
+
+FORM_TYPES = ('new', 'used', 'newEnergy')
+
+# 报价参数及默认值，对应前端各表单的输入框（二手车/新能源表单的输入框带前缀）
+QUOTE_PARAMS = {
+    'exchangeRate': 0,
+    'usdBaseRate': None,
+    'seaFreight': 0,
+    'discount': 0,
+    'optionalEquipment': 0,
+    'domesticShipping': 0,
+    'portCharges': 0,
+    'portChargesFob': 0,
+    'compulsoryInsurance': 0,
+    'otherExpenses': 0,
+    'qualificationFee': 0,
+    'agencyFee': 0,
+    'markup': 0,
+    'serviceFeeRate': DEFAULT_SERVICE_FEE_RATE
+}
+
+# 输出列：页面上显示的各项结果
+QUOTE_COLUMNS = ('guidePrice', 'invoicePrice', 'serviceFee', 'purchaseTax', 'taxRefund', 'taxRefundFee',
+                 'purchaseCost', 'rmbQuote', 'costPrice', 'finalQuote', 'profit', 'foreignProfit')
+# 两位小数的列，其余列为整数
+DECIMAL_COLUMNS = ('purchaseTax', 'taxRefund')
+
+_CENT = Decimal('0.01')
+
+
+def _to_fixed2(value):
+    """等同于 parseFloat(value.toFixed(2))：按二进制精确值四舍五入（远离零）"""
+    return float(Decimal(value).quantize(_CENT, rounding=ROUND_HALF_UP))
+
+
+class _ScalarOps:
+    """逐行计算使用的运算"""
+    maximum = staticmethod(max)
+
+    @staticmethod
+    def floor(value):
+        return float(math.floor(value)) if math.isfinite(value) else value
+
+    @staticmethod
+    def where(condition, a, b):
+        return a if condition else b
+
+    @staticmethod
+    def to_fixed2(value):
+        return _to_fixed2(value) if math.isfinite(value) else value
+
+
+class _NumpyOps:
+    """整批向量化计算使用的运算"""
+
+    @staticmethod
+    def floor(value):
+        return np.floor(value)
+
+    @staticmethod
+    def maximum(a, b):
+        return np.maximum(a, b)
+
+    @staticmethod
+    def where(condition, a, b):
+        return np.where(condition, a, b)
+
+    @staticmethod
+    def to_fixed2(value):
+        scaled = value * 100
+        floor = np.floor(scaled)
+        result = (floor + (scaled - floor >= 0.5)) / 100
+        # 乘以100有舍入误差，只有接近.5的值需要按精确值重新判断
+        near_tie = np.abs(scaled - floor - 0.5) < 1e-6
+        for i in np.flatnonzero(near_tie & np.isfinite(value)):
+            result[i] = _to_fixed2(float(value[i]))
+        return result
+
+
+def js_round(ops, value):
+    """等同于 Math.round：.5向正无穷方向取整"""
+    floor = ops.floor(value)
+    return floor + ops.where(value - floor >= 0.5, 1.0, 0.0)
+
+
+def parse_guide_price(price):
+    """等同于前端 parsePriceToNumber："9.98万" -> 99800，无法解析时返回NaN"""
+    if isinstance(price, (int, float)) and not isinstance(price, bool):
+        return float(price)
+    if not isinstance(price, str):
+        return math.nan
+    price = price.strip()
+    if price.endswith('万'):
+        number = _parse_float(price.replace('万', ''))
+        return math.floor(number * 10000 + 0.5) if math.isfinite(number) else math.nan
+    number = _parse_float(re.sub(r'[^\d.]', '', price))
+    return math.floor(number + 0.5) if math.isfinite(number) else math.nan
+
+
+def _parse_float(text):
+    """JS parseFloat：解析开头的数字部分"""
+    match = re.match(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?', text)
+    return float(match.group(0)) if match else math.nan
+
+
+def normalize_params(params):
+    """合并默认值并校验参数，返回 (参数字典, 错误信息)"""
+    params = params or {}
+    if not isinstance(params, dict):
+        return None, '报价参数格式错误'
+    unknown = [key for key in params if key not in QUOTE_PARAMS and key != 'currency']
+    if unknown:
+        return None, f'未知的报价参数: {", ".join(unknown)}'
+    normalized = {}
+    for key, default in QUOTE_PARAMS.items():
+        value = params.get(key)
+        if value is None or value == '':
+            normalized[key] = default
+            continue
+        try:
+            normalized[key] = float(value)
+        except (TypeError, ValueError):
+            return None, f'参数格式错误: {key}'
+        if not math.isfinite(normalized[key]):
+            return None, f'参数格式错误: {key}'
+    normalized['currency'] = params.get('currency') or DEFAULT_CURRENCY
+    return normalized, None
+
+
+def _sea_freight(params):
+    """海运费以美元为基准，所选外币不是USD时按USD基准汇率换算"""
+    sea_freight = params['seaFreight']
+    rate = params['exchangeRate']
+    usd_base_rate = params['usdBaseRate']
+    if sea_freight > 0 and params['currency'] != 'USD' and usd_base_rate is not None and rate > 0:
+        sea_freight = sea_freight * (usd_base_rate / rate)
+    return sea_freight
+
+
+def _compute(ops, form_type, guide, params):
+    """
+    按前端的计算顺序计算一批（或一行）报价，guide为指导价数组（或单个值）
+    无法计算的结果（未填汇率、没有人民币报价）为NaN
+    """
+    c = CALCULATION
+    nan = math.nan
+    rate = params['exchangeRate']
+    sea_freight = _sea_freight(params)
+    domestic = params['domesticShipping']
+    compulsory = params['compulsoryInsurance']
+    other = params['otherExpenses']
+    port_cif = params['portCharges']
+    port_fob = params['portChargesFob']
+    # 避免重复计算：如果CIF有值，则只使用CIF；否则使用FOB
+    port_charges = port_cif if port_cif > 0 else port_fob
+
+    invoice = js_round(ops, ops.maximum(0, guide + params['optionalEquipment'] - params['discount']))
+    tax_refund = ops.to_fixed2(invoice / c['TAX_DIVISOR'] * c['TAX_RATE'])
+    result = {'guidePrice': guide, 'invoicePrice': invoice, 'taxRefund': tax_refund}
+
+    if form_type == 'new':
+        service_fee = js_round(ops, params['serviceFeeRate'] * invoice)
+        # 新车采购费用中港杂费为CIF+FOB之和（与前端一致）
+        purchase_cost = js_round(ops, invoice + service_fee + domestic + (port_cif + port_fob)
+                                 + compulsory + other - tax_refund)
+        rmb_quote = js_round(ops, purchase_cost)
+        result.update(serviceFee=service_fee, purchaseTax=guide * nan, taxRefundFee=guide * nan)
+        if rate > 0:
+            # 新车成本价格 = (开票价 + 开票价×0.022 + 国内运输 + 港杂费 + 交强险 + 其他费用 - 退税) ÷ 汇率 + 海运费
+            cost_price = (invoice + invoice * c['SERVICE_FEE_RATE'] + domestic + port_charges
+                          + compulsory + other - tax_refund) / rate + sea_freight
+    else:
+        if form_type == 'newEnergy':
+            threshold = c['NEW_ENERGY_TAX_THRESHOLD']
+            purchase_tax = ops.where(invoice <= threshold, 0.0,
+                                     (invoice - threshold) / c['PURCHASE_TAX_RATE'])
+        else:
+            purchase_tax = invoice / c['PURCHASE_TAX_RATE']
+        tax_refund_fee = js_round(ops, tax_refund * c['TAX_REFUND_FEE_RATE'])
+        # 购车成本使用未取整的购置税（前端直接使用计算函数的返回值）
+        purchase_cost = js_round(ops, invoice + purchase_tax + domestic + port_charges + compulsory
+                                 + other + params['qualificationFee'] + params['agencyFee']
+                                 + tax_refund_fee - tax_refund)
+        rmb_quote = js_round(ops, purchase_cost + params['markup'])
+        result.update(serviceFee=guide * nan, purchaseTax=ops.to_fixed2(purchase_tax), taxRefundFee=tax_refund_fee)
+        if rate > 0:
+            # 成本价格 = 购车成本 / 汇率 + 海运费
+            cost_price = purchase_cost / rate + sea_freight
+
+    result.update(purchaseCost=purchase_cost, rmbQuote=rmb_quote)
+    if rate > 0:
+        cost_price = js_round(ops, cost_price)
+        final_quote = rmb_quote / rate
+        if sea_freight > 0:
+            final_quote = final_quote + sea_freight
+        final_quote = ops.where(rmb_quote > 0, js_round(ops, final_quote), nan)
+        foreign_profit = final_quote - cost_price
+        rmb_profit = foreign_profit * rate
+        result.update(costPrice=cost_price, finalQuote=final_quote,
+                      profit=js_round(ops, rmb_profit), foreignProfit=js_round(ops, foreign_profit))
+    else:
+        result.update(costPrice=guide * nan, finalQuote=guide * nan, profit=guide * nan, foreignProfit=guide * nan)
+    return result
+
+
+def _clean(value, decimals):
+    if value != value or value is None:
+        return None
+    return value if decimals else int(value)
+
+
+def quote_rows_scalar(form_type, guide_prices, params):
+    """逐行计算，返回每行的结果字典"""
+    rows = []
+    for guide in guide_prices:
+        if not math.isfinite(guide):
+            rows.append({column: None for column in QUOTE_COLUMNS})
+            continue
+        result = _compute(_ScalarOps, form_type, float(guide), params)
+        rows.append({column: _clean(result[column], column in DECIMAL_COLUMNS) for column in QUOTE_COLUMNS})
+    return rows
+
+
+def quote_columns_numpy(form_type, guide_prices, params):
+    """整批向量化计算，返回 {列名: numpy数组}，无法计算的值为NaN"""
+    guide = np.asarray(guide_prices, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        result = _compute(_NumpyOps, form_type, guide, params)
+        valid = np.isfinite(guide)
+        return {column: np.where(valid, np.broadcast_to(result[column], guide.shape), np.nan)
+                for column in QUOTE_COLUMNS}
+
+
+def quote_rows_numpy(form_type, guide_prices, params):
+    columns = quote_columns_numpy(form_type, guide_prices, params)
+    lists = [(column, columns[column].tolist(), column in DECIMAL_COLUMNS) for column in QUOTE_COLUMNS]
+    return [{column: _clean(values[i], decimals) for column, values, decimals in lists}
+            for i in range(len(guide_prices))]
+
+
+def quote_rows(form_type, guide_prices, params):
+    """按可用的实现计算报价"""
+    if np is not None:
+        return quote_rows_numpy(form_type, guide_prices, params)
+    return quote_rows_scalar(form_type, guide_prices, params)
+
+
+def backend_name():
+    return 'numpy' if np is not None else 'python'
+
+
+# ---------------------------------------------------------------------------
+# 性能测试
+
+def benchmark(rows=200000):
+    """每秒计算的报价行数（只计算，不含JSON序列化）"""
+    rng = random.Random(2)
+    guide_prices = [float(rng.randint(50000, 2000000)) for _ in range(rows)]
+    params = normalize_params({'exchangeRate': 7.1, 'seaFreight': 1200, 'domesticShipping': 1500,
+                               'portCharges': 800, 'markup': 3000})[0]
+    results = {}
+    for form_type in FORM_TYPES:
+        if np is not None:
+            started = time.perf_counter()
+            quote_columns_numpy(form_type, guide_prices, params)
+            elapsed = time.perf_counter() - started
+            results[f'{form_type}/numpy'] = rows / elapsed
+        sample = guide_prices[:rows // 10]
+        started = time.perf_counter()
+        quote_rows_scalar(form_type, sample, params)
+        elapsed = time.perf_counter() - started
+        results[f'{form_type}/python'] = len(sample) / elapsed
+    for name, rate in results.items():
+        print(f'{name:20s} {rate:>14,.0f} 行/秒')
+    return results
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        benchmark()
+        return 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+合同渲染结果缓存 - 以规范化填充计划的哈希为键，LRU + 字节预算 + TTL
+"""
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def plan_cache_key(plan, template_fingerprint, engine):
+    """
+    计算填充计划的内容哈希，填充计划已经完成日期格式化和运输路线去重，
+    相同表单数据得到相同的键；模板或引擎变化时键随之变化
+    """
+    canonical = json.dumps(
+        {
+            'cells': plan['cells'],
+            'hidden_rows': plan['hidden_rows'],
+            'filename': plan['filename'],
+            'template_id': plan.get('template'),
+            'template': template_fingerprint,
+            'engine': engine
+        },
+        ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """
+    LRU缓存：条目数和总字节数都有上限，超过时淘汰最久未使用的条目
+    max_bytes<=0时禁用缓存
+    """
+
+    def __init__(self, max_bytes, max_entries=1000, ttl=600):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _remove(self, key):
+        content, _ = self._entries.pop(key)
+        self.total_bytes -= len(content)
+
+    def get(self, key):
+        """返回缓存的xlsx字节，未命中或已过期返回None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry[1] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, content):
+        if not self.enabled or len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (content, time.monotonic())
+            self.total_bytes += len(content)
+            while self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+合同渲染进程池 - 每个工作进程持有预热的模板，CPU密集的渲染可以利用多核
+"""
+import os
+import json
+import math
+import time
+import zipfile
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from contract_plan import build_output_filename
+from contract_renderer import ContractRenderer, validate_contract_data
+from metrics import collect_stages, record_stages
+from template_registry import UnknownTemplateError
+
+logger = logging.getLogger(__name__)
+
+# 工作进程内的渲染器，由进程池initializer创建
+_worker_renderer = None
+
+
+def _init_worker(registry, engine):
+    """工作进程启动时预热模板"""
+    global _worker_renderer
+    logging.basicConfig(level=logging.INFO)
+    _worker_renderer = ContractRenderer(registry, engine)
+    try:
+        _worker_renderer.warm()
+    except Exception as e:
+        logger.error(f"工作进程预加载模板失败: {e}")
+
+
+def render_with(renderer, payload):
+    """校验并渲染一份合同，返回 (文件名, xlsx字节, 错误信息)"""
+    error = validate_contract_data(payload)
+    if error:
+        return None, None, error
+    try:
+        if not renderer.template_exists(payload.get('templateId')):
+            return None, None, '模板文件不存在'
+    except UnknownTemplateError as e:
+        return None, None, str(e)
+    try:
+        plan = renderer.plan(payload)
+        return plan['filename'], renderer.render(plan), None
+    except Exception as e:
+        return None, None, f'生成合同失败: {str(e)}'
+
+
+def render_payload(payload):
+    """在工作进程中执行：渲染一份原始请求数据"""
+    return render_with(_worker_renderer, payload)
+
+
+def render_plan(plan):
+    """在工作进程中执行：渲染已生成的填充计划，返回 (xlsx字节, 各阶段耗时)"""
+    with collect_stages() as timings:
+        content = _worker_renderer.render(plan)
+    return content, timings.stages
+
+
+def _ping():
+    """预热用的空任务，促使进程池提前启动工作进程"""
+    return os.getpid()
+
+
+class PoolSaturatedError(Exception):
+    """渲染队列已满，调用方应返回429"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'渲染队列已满，请 {retry_after} 秒后重试')
+        self.retry_after = retry_after
+
+
+class RenderTimeoutError(Exception):
+    """等待渲染结果超时，调用方应返回504"""
+
+    def __init__(self, timeout):
+        super().__init__(f'合同渲染超时（{timeout} 秒）')
+        self.timeout = timeout
+
+
+class RenderPool:
+    """
+    渲染进程池：排队+执行中的任务数不超过max_pending，队列满时单个请求直接拒绝
+    workers<=0时不启动进程池，在当前进程内使用inline_renderer渲染
+    进程池按需创建，进程异常退出后自动重建
+    """
+
+    def __init__(self, registry, engine, workers, max_pending=None, inline_renderer=None):
+        self.registry = registry
+        self.engine = engine
+        self.workers = workers
+        self.max_pending = max_pending or max(workers, 1) * 4
+        self.inline_renderer = inline_renderer
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        # 最近任务耗时（含排队）的指数移动平均，用于估算Retry-After
+        self.avg_task_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 使用spawn启动，避免fork带有线程的服务进程
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.registry, self.engine)
+                )
+            return self._executor
+
+    def prestart(self):
+        """提前启动并预热所有工作进程，不等待完成，返回预热任务的future列表"""
+        if not self.enabled:
+            return []
+        executor = self.executor()
+        return [executor.submit(_ping) for _ in range(self.workers)]
+
+    def _reset_broken(self):
+        """工作进程异常退出后丢弃已损坏的进程池，下次使用时重建"""
+        with self._lock:
+            executor = self._executor
+            if executor is None or not executor._broken:
+                return
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def retry_after(self):
+        """按当前排队情况估算客户端应等待的秒数"""
+        with self._stats_lock:
+            estimate = self.avg_task_seconds * self.pending / max(self.workers, 1)
+        return max(1, math.ceil(estimate))
+
+    def _submit(self, fn, arg, blocking):
+        if not self._slots.acquire(blocking=blocking):
+            with self._stats_lock:
+                self.rejected += 1
+            raise PoolSaturatedError(self.retry_after())
+        try:
+            try:
+                future = self.executor().submit(fn, arg)
+            except BrokenProcessPool:
+                # 进程池已损坏（如预热时工作进程启动失败），重建后重试一次
+                self._reset_broken()
+                future = self.executor().submit(fn, arg)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._stats_lock:
+            self.pending += 1
+        started = time.perf_counter()
+        future.add_done_callback(lambda f: self._on_done(started))
+        return future
+
+    def _on_done(self, started):
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.pending -= 1
+            self.completed += 1
+            if self.avg_task_seconds:
+                self.avg_task_seconds = self.avg_task_seconds * 0.8 + elapsed * 0.2
+            else:
+                self.avg_task_seconds = elapsed
+        self._slots.release()
+
+    def render(self, plan, timeout=None):
+        """渲染单份合同，队列满时抛出PoolSaturatedError，超时抛出RenderTimeoutError"""
+        if not self.enabled:
+            return self.inline_renderer.render(plan)
+        started = time.perf_counter()
+        future = self._submit(render_plan, plan, blocking=False)
+        try:
+            content, stages = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # 还在排队的任务直接取消；已经开始执行的任务完成后释放队列位置
+            future.cancel()
+            logger.error(f"合同渲染超时（{timeout} 秒）")
+            raise RenderTimeoutError(timeout)
+        except BrokenProcessPool as e:
+            logger.error(f"渲染进程异常退出: {e}")
+            self._reset_broken()
+            raise
+        # 排队、进程间传输等不在工作进程内的耗时记为pool_wait
+        stages['pool_wait'] = max(time.perf_counter() - started - sum(stages.values()), 0.0)
+        record_stages(stages)
+        return content
+
+    def render_many(self, payloads):
+        """
+        渲染多份合同，按完成顺序产出 (序号, (文件名, xlsx字节, 错误信息))
+        每个批次最多同时占用workers个队列位置，队列满时等待而不是拒绝
+        """
+        if not self.enabled:
+            for index, payload in enumerate(payloads):
+                yield index, render_with(self.inline_renderer, payload)
+            return
+
+        remaining = iter(enumerate(payloads))
+        futures = {}
+        # 提交失败的合同直接记为失败，不中断已经开始发送的ZIP流
+        failed = []
+
+        def submit_next():
+            for index, payload in remaining:
+                try:
+                    futures[self._submit(render_payload, payload, blocking=True)] = index
+                except Exception as e:
+                    logger.error(f"提交第 {index} 份合同失败: {e}")
+                    failed.append((index, (None, None, f'生成合同失败: {str(e)}')))
+                    continue
+                return
+
+        for _ in range(self.workers):
+            submit_next()
+
+        while futures or failed:
+            while failed:
+                yield failed.pop(0)
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    logger.error(f"渲染进程异常退出: {e}")
+                    self._reset_broken()
+                    result = (None, None, '渲染进程异常退出')
+                except Exception as e:
+                    result = (None, None, f'生成合同失败: {str(e)}')
+                yield index, result
+                submit_next()
+
+    def stats(self):
+        """进程池状态"""
+        with self._stats_lock:
+            return {
+                'enabled': self.enabled,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_task_ms': round(self.avg_task_seconds * 1000, 2)
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _ZipStream:
+    """只支持写入的缓冲区，zipfile会按不可seek的流写入，每写完一个文件就可以取出数据发送"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _unique_name(filename, used_names):
+    """同名合同追加序号，避免ZIP中文件名重复"""
+    name = filename
+    stem, ext = os.path.splitext(filename)
+    counter = 2
+    while name in used_names:
+        name = f'{stem}_{counter}{ext}'
+        counter += 1
+    used_names.add(name)
+    return name
+
+
+def batch_filenames(payloads):
+    """
+    渲染前按输入顺序为每份合同分配ZIP中的文件名，同名合同按序号追加后缀，与渲染完成顺序无关
+    校验不通过的合同不分配文件名
+    """
+    used_names = set()
+    names = []
+    for payload in payloads:
+        if validate_contract_data(payload):
+            names.append(None)
+            continue
+        names.append(_unique_name(build_output_filename(str(payload['contractNumber'])), used_names))
+    return names
+
+
+def iter_batch_zip(results, names):
+    """
+    把渲染结果按完成顺序写入ZIP流，最后附加batch_report.json记录每一项的结果
+    names为batch_filenames预先分配的文件名，单项失败不影响其他合同
+    """
+    stream = _ZipStream()
+    total = len(names)
+    report = [None] * total
+    used_names = {name for name in names if name}
+    # xlsx本身已经压缩，ZIP中直接存储
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for index, (filename, content, error) in results:
+            if error:
+                report[index] = {'index': index, 'status': 'error', 'error': error}
+                continue
+            name = names[index] or _unique_name(filename, used_names)
+            archive.writestr(name, content)
+            report[index] = {'index': index, 'status': 'ok', 'file': name}
+            yield stream.drain()
+
+        summary = {
+            'total': total,
+            'succeeded': sum(1 for item in report if item and item['status'] == 'ok'),
+            'failed': sum(1 for item in report if item and item['status'] == 'error'),
+            'generated_at': datetime.now().isoformat(),
+            'items': report
+        }
+        archive.writestr('batch_report.json', json.dumps(summary, ensure_ascii=False, indent=2))
+    yield stream.drain()
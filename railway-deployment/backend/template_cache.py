@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+合同模板缓存 - 启动时解析一次模板，每个请求拿到独立的工作副本
+"""
+import os
+import io
+import copyreg
+import pickle
+import threading
+import logging
+
+from openpyxl import load_workbook
+from openpyxl.utils.indexed_list import IndexedList
+from openpyxl.worksheet.dimensions import DimensionHolder
+
+logger = logging.getLogger(__name__)
+
+
+def _restore_indexed_list(items, index, clean):
+    """还原IndexedList，保留原始的列表内容和索引字典"""
+    restored = IndexedList()
+    list.extend(restored, items)
+    restored._dict = index
+    restored.clean = clean
+    return restored
+
+
+def _reduce_indexed_list(indexed_list):
+    # IndexedList默认的pickle方式会先调用去重的append再恢复__dict__，
+    # 导致重复样式被丢弃、样式索引错位，这里按原样保存列表和索引
+    return _restore_indexed_list, (list(indexed_list), indexed_list._dict, indexed_list.clean)
+
+
+def _reduce_dimension_holder(holder):
+    # DimensionHolder继承defaultdict，默认的pickle方式只把default_factory传给构造函数，
+    # 还原后worksheet变成了default_factory，访问模板中没有的行或列时抛出KeyError
+    return (DimensionHolder, (holder.worksheet, holder.reference, holder.default_factory),
+            {'max_outline': holder.max_outline}, None, iter(dict.items(holder)))
+
+
+def snapshot_workbook(workbook):
+    """把工作簿序列化为快照字节，pickle.loads比load_workbook快一个数量级"""
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = copyreg.dispatch_table.copy()
+    pickler.dispatch_table[IndexedList] = _reduce_indexed_list
+    pickler.dispatch_table[DimensionHolder] = _reduce_dimension_holder
+    pickler.dump(workbook)
+    return buffer.getvalue()
+
+
+class TemplateCache:
+    """模板缓存：按文件mtime自动重新加载，并统计命中/未命中次数"""
+
+    def __init__(self, template_path):
+        self.template_path = template_path
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._mtime = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        # 每次重新解析模板时递增，供编译产物判断是否过期
+        self.version = 0
+
+    def _current_mtime(self):
+        return os.stat(self.template_path).st_mtime_ns
+
+    def _load(self, mtime):
+        """解析模板并生成快照（调用方需持有锁）"""
+        workbook = load_workbook(self.template_path)
+        if self._snapshot is not None:
+            self.reloads += 1
+            logger.info(f"模板文件已变化，重新加载: {self.template_path}")
+        self._snapshot = snapshot_workbook(workbook)
+        self._mtime = mtime
+        self.version += 1
+
+    def fingerprint(self):
+        """模板文件指纹（mtime），用于区分不同版本模板生成的结果"""
+        return self._current_mtime()
+
+    def warm(self):
+        """预先解析模板，启动时调用"""
+        with self._lock:
+            mtime = self._current_mtime()
+            if self._snapshot is None or mtime != self._mtime:
+                self._load(mtime)
+
+    def get_workbook(self, record=True):
+        """
+        返回模板的独立工作副本，模板文件不存在时抛出FileNotFoundError
+        record=False时不计入命中统计，用于构建映射表、编译模板等内部用途
+        """
+        mtime = self._current_mtime()
+        with self._lock:
+            if self._snapshot is None or mtime != self._mtime:
+                self.misses += record
+                self._load(mtime)
+            else:
+                self.hits += record
+            snapshot = self._snapshot
+        return pickle.loads(snapshot)
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'loaded': self._snapshot is not None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+                'snapshot_bytes': len(self._snapshot) if self._snapshot else 0
+            }
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+合同模板注册表 - 每个卖方主体一个XLSX模板，各自声明字段到单元格的映射和商品行容量
+
+注册表文件（默认 api/templates.json）格式：
+{
+  "default": "smai",
+  "templates": {
+    "smai": {
+      "path": "template.xlsx",                  相对注册表文件所在目录
+      "description": "...",
+      "layout": {                                省略的项使用默认布局
+        "fillSheet": "SC",                       填充的sheet
+        "hideRowSheets": ["SC", "PI"],           隐藏未使用商品行的sheet
+        "fields": {"buyerName": "C3", ...},      始终写入的字段（没有值时写入空字符串）
+        "optionalFields": {"f22Value": "F22"},   有值时才写入的字段
+        "goods": {"firstRow": 11, "capacity": 10,
+                  "columns": [["B", "model", ""], ["E", "quantity", 0], ...]}
+      }
+    }
+  }
+}
+注册表文件不存在时只有一个default模板，使用默认布局
+本模块不导入openpyxl，服务启动时即可读取注册表
+"""
+import os
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATE_ID = 'default'
+
+_CELL_RE = re.compile(r'^[A-Z]{1,3}[1-9][0-9]*$')
+_COLUMN_RE = re.compile(r'^[A-Z]{1,3}$')
+
+
+class UnknownTemplateError(ValueError):
+    """请求的模板不在注册表中"""
+
+
+class ContractLayout:
+    """模板布局：字段到单元格的映射、商品行位置和容量"""
+
+    def __init__(self, fill_sheet, hide_row_sheets, base_fields, goods_first_row, goods_capacity,
+                 goods_columns, extra_fields):
+        self.fill_sheet = fill_sheet
+        self.hide_row_sheets = tuple(hide_row_sheets)
+        # (字段, 单元格)
+        self.base_fields = tuple((field, address) for field, address in base_fields)
+        self.goods_first_row = goods_first_row
+        self.goods_capacity = goods_capacity
+        # (列, 字段, 默认值)
+        self.goods_columns = tuple((column, field, default) for column, field, default in goods_columns)
+        self.extra_fields = tuple((field, address) for field, address in extra_fields)
+        self._validate()
+
+    def _validate(self):
+        if not self.fill_sheet:
+            raise ValueError('fillSheet不能为空')
+        if self.goods_first_row < 1 or self.goods_capacity < 0:
+            raise ValueError('商品行起始行号或容量错误')
+        for field, address in self.base_fields + self.extra_fields:
+            if not _CELL_RE.match(address):
+                raise ValueError(f'字段 {field} 的单元格地址错误: {address}')
+        for column, field, _ in self.goods_columns:
+            if not _COLUMN_RE.match(column):
+                raise ValueError(f'商品字段 {field} 的列错误: {column}')
+        cells = self.all_target_cells()
+        duplicates = sorted({address for address in cells if cells.count(address) > 1})
+        if duplicates:
+            raise ValueError(f'多个字段映射到同一单元格: {", ".join(duplicates)}')
+
+    @property
+    def goods_rows(self):
+        return range(self.goods_first_row, self.goods_first_row + self.goods_capacity)
+
+    def all_target_cells(self):
+        """所有可能被写入的单元格地址"""
+        cells = [address for _, address in self.base_fields]
+        for row in self.goods_rows:
+            cells.extend(f'{column}{row}' for column, _, _ in self.goods_columns)
+        cells.extend(address for _, address in self.extra_fields)
+        return cells
+
+    @classmethod
+    def from_dict(cls, data, base=None):
+        """按注册表中的声明创建布局，省略的项取base（默认布局）"""
+        base = base or DEFAULT_LAYOUT
+        goods = data.get('goods') or {}
+        return cls(
+            fill_sheet=data.get('fillSheet', base.fill_sheet),
+            hide_row_sheets=data.get('hideRowSheets', base.hide_row_sheets),
+            base_fields=data['fields'].items() if 'fields' in data else base.base_fields,
+            goods_first_row=int(goods.get('firstRow', base.goods_first_row)),
+            goods_capacity=int(goods.get('capacity', base.goods_capacity)),
+            goods_columns=[tuple(column) for column in goods['columns']] if 'columns' in goods else base.goods_columns,
+            extra_fields=data['optionalFields'].items() if 'optionalFields' in data else base.extra_fields
+        )
+
+    def to_dict(self):
+        return {
+            'fillSheet': self.fill_sheet,
+            'hideRowSheets': list(self.hide_row_sheets),
+            'fields': dict(self.base_fields),
+            'optionalFields': dict(self.extra_fields),
+            'goods': {
+                'firstRow': self.goods_first_row,
+                'capacity': self.goods_capacity,
+                'columns': [list(column) for column in self.goods_columns]
+            }
+        }
+
+
+# 原有单一模板（api/template.xlsx）的布局：C3-C8、G3-G5、E7，商品第11-20行，D21-D26、F22、G21等
+DEFAULT_LAYOUT = ContractLayout(
+    fill_sheet='SC',
+    # 不填充PI sheet，隐藏商品行时两个sheet同时处理
+    hide_row_sheets=('SC', 'PI'),
+    base_fields=(
+        ('buyerName', 'C3'),
+        ('buyerAddress', 'C4'),
+        ('buyerPhone', 'C5'),
+        ('sellerName', 'C6'),
+        ('sellerAddress', 'C7'),
+        ('sellerPhone', 'C8'),
+        ('contractNumber', 'G3'),
+        ('contractDate', 'G4'),
+        ('contractLocation', 'G5'),
+        ('bankInfo', 'E7'),
+    ),
+    goods_first_row=11,
+    goods_capacity=10,
+    goods_columns=(
+        ('B', 'model', ''),
+        ('C', 'description', ''),
+        ('D', 'color', ''),
+        ('E', 'quantity', 0),
+        ('F', 'unitPrice', 0),
+        ('G', 'totalAmount', 0),
+    ),
+    extra_fields=(
+        ('f22Value', 'F22'),
+        ('paymentTerms', 'D24'),
+        ('totalAmount', 'G21'),
+        ('amountInWords', 'B23'),
+        ('portOfLoading', 'D21'),
+        ('finalDestination', 'D22'),
+        ('transportRoute', 'D25'),
+        ('modeOfShipment', 'D26'),
+    )
+)
+
+
+class TemplateSpec:
+    def __init__(self, template_id, path, layout=DEFAULT_LAYOUT, description=''):
+        self.id = template_id
+        self.path = path
+        self.layout = layout
+        self.description = description
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def describe(self):
+        return {
+            'id': self.id,
+            'description': self.description,
+            'exists': self.exists(),
+            'goodsCapacity': self.layout.goods_capacity,
+            'fields': [field for field, _ in self.layout.base_fields + self.layout.extra_fields]
+        }
+
+
+class TemplateRegistry:
+    """模板ID -> TemplateSpec，请求未指定模板时使用默认模板"""
+
+    def __init__(self, specs, default_id):
+        self.specs = {spec.id: spec for spec in specs}
+        if default_id not in self.specs:
+            raise ValueError(f'默认模板不在注册表中: {default_id}')
+        self.default_id = default_id
+
+    @classmethod
+    def load(cls, registry_path, fallback_template_path):
+        """读取注册表文件，文件不存在时只注册fallback_template_path一个默认模板"""
+        if not os.path.exists(registry_path):
+            return cls([TemplateSpec(DEFAULT_TEMPLATE_ID, fallback_template_path)], DEFAULT_TEMPLATE_ID)
+        with open(registry_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        base_dir = os.path.dirname(registry_path)
+        specs = []
+        for template_id, item in data['templates'].items():
+            try:
+                layout = ContractLayout.from_dict(item.get('layout') or {})
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f'模板 {template_id} 的布局错误: {e}')
+            specs.append(TemplateSpec(template_id, os.path.join(base_dir, item['path']), layout,
+                                      item.get('description', '')))
+        registry = cls(specs, data.get('default', specs[0].id if specs else DEFAULT_TEMPLATE_ID))
+        logger.info(f"已加载 {len(specs)} 个合同模板，默认模板: {registry.default_id}")
+        return registry
+
+    def __iter__(self):
+        return iter(self.specs.values())
+
+    def __len__(self):
+        return len(self.specs)
+
+    @property
+    def default(self):
+        return self.specs[self.default_id]
+
+    def resolve(self, template_id=None):
+        """按ID取模板，未指定时返回默认模板；ID不是字符串或不在注册表中时抛出UnknownTemplateError"""
+        if template_id is None or template_id == '':
+            return self.default
+        if not isinstance(template_id, str):
+            raise UnknownTemplateError(f'合同模板ID必须是字符串: {template_id!r}')
+        spec = self.specs.get(template_id)
+        if spec is None:
+            raise UnknownTemplateError(f'未知的合同模板: {template_id}，可选: {", ".join(self.specs)}')
+        return spec
+
+    def any_exists(self):
+        return any(spec.exists() for spec in self)
+
+    def describe(self):
+        return {
+            'default': self.default_id,
+            'templates': [spec.describe() for spec in self]
+        }
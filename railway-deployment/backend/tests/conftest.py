@@ -0,0 +1,35 @@
+"""
+后端测试的公共fixture：真实数据目录、目录索引
+"""
+import os
+
+import pytest
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'data'))
+
+
+@pytest.fixture(scope='session')
+def data_dir():
+    if not os.path.exists(os.path.join(DATA_DIR, 'brands.json')):
+        pytest.skip(f'缺少车型数据目录: {DATA_DIR}')
+    return DATA_DIR
+
+
+@pytest.fixture(scope='session')
+def catalog_index(data_dir):
+    from catalog import CarCatalog
+    return CarCatalog(data_dir).index()
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """导入后端应用：不预热，合同在请求线程内渲染"""
+    os.environ.setdefault('WARMUP_MODE', 'lazy')
+    os.environ.setdefault('RENDER_WORKERS', '0')
+    import app
+    return app
+
+
+@pytest.fixture()
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,26 @@
+"""
+接口测试：参数校验和错误状态码
+"""
+
+
+def test_bulk_quotes_rejects_out_of_range_guide_price(client):
+    response = client.post('/api/quotes/bulk', json={'formType': 'new', 'guidePrices': [10 ** 400]})
+    assert response.status_code == 400
+
+
+def test_bulk_quotes_checks_row_limit_before_parsing(client, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'QUOTE_MAX_ROWS', 2)
+    # 超过上限时不解析，即使其中有无法解析的值也直接返回上限错误
+    response = client.post('/api/quotes/bulk', json={'formType': 'new', 'guidePrices': [1, 2, 10 ** 400]})
+    assert response.status_code == 400
+    assert '2' in response.get_json()['error']
+
+
+def test_bulk_quotes_guide_prices(client):
+    response = client.post('/api/quotes/bulk', json={
+        'formType': 'new', 'guidePrices': ['19.98万', 'abc'],
+        'params': {'exchangeRate': 7.1, 'currency': 'USD', 'portCharges': 800}})
+    assert response.status_code == 200
+    rows = response.get_json()['rows']
+    assert rows[0]['invoicePrice'] == 199800 and rows[0]['finalQuote'] is not None
+    assert rows[1]['index'] == 1 and rows[1]['invoicePrice'] is None
@@ -0,0 +1,36 @@
+"""
+启动预热测试：只有必需阶段失败时才未就绪
+"""
+import time
+
+from boot import BootSequence
+
+
+def _fail():
+    raise RuntimeError('boom')
+
+
+def test_optional_phase_failure_stays_ready():
+    boot = BootSequence(time.perf_counter())
+    boot.start([('template', lambda: None, True), ('catalog', _fail, False)], mode='blocking')
+    status = boot.status()
+    assert boot.ready and status['ready']
+    assert status['degraded'] == ['catalog']
+    assert status['errors'] == {'catalog': 'boom'}
+
+
+def test_required_phase_failure_is_not_ready():
+    boot = BootSequence(time.perf_counter())
+    boot.start([('template', _fail, True), ('catalog', lambda: None, False)], mode='blocking')
+    status = boot.status()
+    assert status['finished'] and not status['ready']
+    assert status['degraded'] == []
+    assert status['required'] == ['template']
+
+
+def test_not_ready_until_all_phases_finish():
+    boot = BootSequence(time.perf_counter())
+    started = []
+    boot.start([('template', lambda: None, True), ('catalog', lambda: started.append(time.sleep(0.2)), False)])
+    assert not boot.ready
+    assert boot.wait(5) and boot.ready
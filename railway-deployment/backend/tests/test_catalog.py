@@ -0,0 +1,194 @@
+"""
+车型目录测试：服务端搜索索引的打分必须与前端carSearch.js的逐个车型扫描相同；
+数据更新和服务重启后变更查询的版本号
+"""
+import json
+import os
+import random
+import shutil
+
+import pytest
+
+from catalog import CarCatalog, _brand_text, fuzzy_match
+
+
+def full_scan_scores(index, query):
+    """按js/carSearch.js的searchWithIndex逐个车型打分，索引词部分与服务端共用同一份索引词"""
+    query_lower = query.lower()
+    query_words = query_lower.split()
+    scores = {}
+
+    def add(car_index, points):
+        scores[car_index] = scores.get(car_index, 0) + points
+
+    for car_index, car in index.cars.items():
+        car_brand = _brand_text(car)
+        car_name = (car.get('carName') or car.get('name') or '').lower()
+        full_name = f'{car_brand}{car_name}'
+        if len(query_words) >= 2:
+            brand_candidate, model_candidate = query_words[0], query_words[1]
+            combined = f'{brand_candidate}{model_candidate}'
+            if combined in full_name or full_name in combined:
+                add(car_index, 50)
+            if brand_candidate in car_brand and model_candidate in car_name:
+                add(car_index, 30)
+            if fuzzy_match(car_brand, brand_candidate) and fuzzy_match(car_name, model_candidate):
+                add(car_index, 20)
+        if len(query_words) == 1:
+            word = query_words[0]
+            if word in car_name:
+                add(car_index, 25)
+            if word in car_brand:
+                add(car_index, 15)
+            if fuzzy_match(car_name, word):
+                add(car_index, 10)
+        if len(query_lower) >= 4:
+            brand_only = (car.get('brand') or '').lower()
+            if query_lower in f'{brand_only}{car_name}':
+                add(car_index, 40)
+            if query_lower in car_name:
+                add(car_index, 35)
+
+    for word in query_words:
+        for car_index in index.terms.get(word, ()):
+            add(car_index, 10)
+        for term, car_indices in index.terms.items():
+            if term.startswith(word):
+                for car_index in car_indices:
+                    add(car_index, 5)
+
+    for car_index, car in index.cars.items():
+        car_brand = _brand_text(car)
+        car_name = (car.get('carName') or car.get('name') or '').lower()
+        if query_lower in f'{car_brand}{car_name}' or query_lower in car_name or query_lower in car_brand:
+            add(car_index, 15)
+        for config in car.get('configs') or []:
+            if query_lower in (config.get('configName') or '').lower():
+                add(car_index, 8)
+    return scores
+
+
+def _sample_queries(index, count, seed=7):
+    """从真实车型名和配置名中拼出单词、两词、多词和带多余字符的查询"""
+    rng = random.Random(seed)
+    cars = [index.cars[car_index] for car_index in index.ordered_car_ids]
+    queries = []
+    for _ in range(count):
+        car = rng.choice(cars)
+        brand = _brand_text(car)
+        car_name = (car.get('carName') or '').lower()
+        configs = car.get('configs') or [{}]
+        config_words = (rng.choice(configs).get('configName') or '').lower().split()
+        shape = rng.randrange(6)
+        if shape == 0:
+            query = car_name
+        elif shape == 1:
+            query = f'{brand} {car_name}'
+        elif shape == 2:
+            query = ' '.join([brand, car_name] + config_words[:2])
+        elif shape == 3:
+            query = f'{brand[:1]} {car_name[1:3]}'
+        elif shape == 4:
+            query = f'{brand}{car_name}zz'
+        else:
+            query = ' '.join(config_words[:rng.randrange(1, 4)])
+        if query.strip():
+            queries.append(query.strip())
+    return queries
+
+
+@pytest.mark.parametrize('query', [
+    '大众 途岳 2024款',
+    'byd 海豚 pro',
+    '东风风神 SKY EV01 2024款zz',
+    '大众途岳',
+    '途岳',
+    'byd',
+    'haitun',
+    '宝马 x',
+    'a 宝马x5 长轴距',
+])
+def test_search_scores_match_full_scan(catalog_index, query):
+    expected = {car_index: score for car_index, score in full_scan_scores(catalog_index, query).items() if score}
+    actual = {car_index: score for car_index, score in catalog_index._score_cars(query).items() if score}
+    assert actual == expected
+
+
+def test_search_scores_match_full_scan_sampled(catalog_index):
+    for query in _sample_queries(catalog_index, 60):
+        expected = {car_index: score for car_index, score in full_scan_scores(catalog_index, query).items() if score}
+        actual = {car_index: score for car_index, score in catalog_index._score_cars(query).items() if score}
+        assert actual == expected, query
+
+
+def test_two_word_query_keeps_combination_bonus(catalog_index):
+    """多余的词不影响前两个词的品牌+车型组合加分"""
+    scores = catalog_index._score_cars('大众 途岳 2024款')
+    [car_index] = [car_index for car_index, car in catalog_index.cars.items()
+                   if car.get('carName') == '途岳' and _brand_text(car) == '大众']
+    assert scores[car_index] == 170
+
+
+@pytest.fixture()
+def work_dir(data_dir, tmp_path):
+    """复制前两个品牌文件到临时目录，返回 (目录, 第一个品牌的文件名)"""
+    with open(os.path.join(data_dir, 'brands.json'), 'r', encoding='utf-8') as f:
+        brands = [brand for brand in json.load(f)
+                  if os.path.exists(os.path.join(data_dir, brand.get('file', '')))][:2]
+    with open(tmp_path / 'brands.json', 'w', encoding='utf-8') as f:
+        json.dump(brands, f, ensure_ascii=False)
+    for brand in brands:
+        shutil.copy(os.path.join(data_dir, brand['file']), tmp_path)
+    return str(tmp_path), brands[0]['file']
+
+
+def _reprice(path, price):
+    with open(path, 'r', encoding='utf-8') as f:
+        brand_data = json.load(f)
+    brand_data['cars'][0]['configs'][0]['price'] = price
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(brand_data, f, ensure_ascii=False)
+    # 确保mtime变化
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_changes_after_reprice(work_dir):
+    directory, file_name = work_dir
+    catalog = CarCatalog(directory)
+    catalog.index()
+    first = catalog.version_token()
+    _reprice(os.path.join(directory, file_name), '1.11万')
+    assert catalog.refresh() == [file_name]
+    token, complete, changes = catalog.changes(first)
+    assert complete and token == catalog.version_token()
+    assert len(changes) == 1 and changes[0]['version'] == token
+
+
+def test_restart_versions_require_full_sync(work_dir):
+    """重启：新进程的版本序列同样从1开始，数字相同但加载标识不同，重启前的版本号返回不完整"""
+    directory, file_name = work_dir
+    path = os.path.join(directory, file_name)
+    before = CarCatalog(directory)
+    before.index()
+    first = before.version_token()
+    _reprice(path, '1.11万')
+    before.refresh()
+    token = before.version_token()
+
+    after = CarCatalog(directory)
+    after.index()
+    restarted = after.version_token()
+    _reprice(path, '2.22万')
+    assert after.refresh() == [file_name]
+    assert after.version == before.version == 2 and after.epoch != before.epoch
+    for stale in (first, token, '1', f'{before.epoch}:1'):
+        assert after.changes(stale) == (after.version_token(), False, []), stale
+    _, complete, changes = after.changes(restarted)
+    assert complete and changes[0]['brands'][0]['configs']['repriced'][0]['price'] == '2.22万'
+
+
+@pytest.mark.parametrize('invalid', ['', 'abc', ':1', 'x:y'])
+def test_changes_rejects_malformed_version(data_dir, invalid):
+    with pytest.raises(ValueError):
+        CarCatalog(data_dir).changes(invalid)
@@ -0,0 +1,88 @@
+"""
+打包目录测试：每个品牌还原后必须与JSON源文件逐字段相同（包括字段顺序和类型），
+索引按列读取的字段也必须与JSON中的对应字段相同
+"""
+import json
+import os
+
+from catalog import CarCatalog
+from catalog_pack import PackedCatalog, build_packed_catalog, verify_packed_catalog
+
+
+def _write_data_dir(directory, brand_files):
+    brands = [{'name': name, 'file': file_name} for file_name, name in
+              ((file_name, brand_data.get('brand', file_name)) for file_name, brand_data in brand_files.items())]
+    with open(os.path.join(directory, 'brands.json'), 'w', encoding='utf-8') as f:
+        json.dump(brands, f, ensure_ascii=False)
+    for file_name, brand_data in brand_files.items():
+        with open(os.path.join(directory, file_name), 'w', encoding='utf-8') as f:
+            json.dump(brand_data, f, ensure_ascii=False)
+
+
+def test_round_trip_matches_json(data_dir, tmp_path):
+    path = build_packed_catalog(data_dir, str(tmp_path / 'catalog.bin'))
+    assert verify_packed_catalog(data_dir, path) == []
+
+
+def test_irregular_fields_are_kept_as_json(tmp_path):
+    """新增字段和不符合列编码的值不影响打包，还原结果与源文件相同"""
+    brand_data = {
+        'brand': 'Test',
+        'brandImage': None,
+        'cars': [
+            {
+                'carId': 1, 'carName': '测试车', 'mainImage': None, 'seriesTag': {'new': True},
+                'configs': [
+                    {'configName': '2025款 标准版', 'configId': 10, 'index': True, 'price': 12.5,
+                     'power': '150kW', 'rating': 4.5, 'configImage': 42,
+                     'exteriorImages': [{'name': '白', 'colors': ['#fff', None], 'mainImage': 'https://a.example/x/1.jpg'}],
+                     'interiorImages': {'unexpected': 'dict'}},
+                    {'configName': '2025款 长续航版', 'configId': 2 ** 70, 'index': -2 ** 64,
+                     'price': '99999999999999999999.5万', 'class': None, 'fuelType': '纯电动'},
+                    {'configName': '2025款 旗舰版', 'configId': '²', 'index': 3, 'price': '1.' + '1' * 300 + '万'},
+                ]
+            },
+            {'carId': 'abc', 'carName': '另一款', 'configs': [], 'lastUpdated': 20250101},
+        ]
+    }
+    _write_data_dir(str(tmp_path), {'Test.json': brand_data})
+    path = build_packed_catalog(str(tmp_path))
+    assert verify_packed_catalog(str(tmp_path), path) == []
+
+    packed = PackedCatalog(path)
+    try:
+        assert packed.brand_json('Test.json') == brand_data
+    finally:
+        packed.close()
+
+    catalog = CarCatalog(str(tmp_path))
+    index = catalog.index()
+    assert catalog.packed
+    assert index.config_count == 3
+    _, results = index.search('长续航')
+    assert results[0]['config']['configId'] == 2 ** 70
+
+
+def test_changed_source_is_not_fresh(tmp_path):
+    _write_data_dir(str(tmp_path), {'Test.json': {'brand': 'Test', 'cars': []}})
+    path = build_packed_catalog(str(tmp_path))
+    packed = PackedCatalog(path)
+    try:
+        assert packed.fresh_sources(str(tmp_path)) is not None
+        _write_data_dir(str(tmp_path), {'Test.json': {'brand': 'Test', 'cars': [{'carId': 1, 'configs': []}]}})
+        assert packed.fresh_sources(str(tmp_path)) is None
+    finally:
+        packed.close()
+
+
+def test_catalog_builds_pack_for_next_load(tmp_path):
+    _write_data_dir(str(tmp_path), {'Test.json': {'brand': 'Test', 'cars': [
+        {'carId': 1, 'carName': '测试车', 'configs': [{'configName': '标准版', 'configId': 1, 'price': '9.98万'}]}]}})
+    first = CarCatalog(str(tmp_path))
+    first.index()
+    assert not first.packed
+    assert first.build_pack() is not None
+    second = CarCatalog(str(tmp_path))
+    second.index()
+    assert second.packed
+    assert second.search('测试车', 1, 20)[1] == first.search('测试车', 1, 20)[1]
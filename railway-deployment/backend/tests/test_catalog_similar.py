@@ -0,0 +1,40 @@
+"""
+相似配置测试：随机抽取配置，KD树结果应与逐个计算距离的结果相同
+"""
+import random
+
+import pytest
+
+from catalog_similar import SimilarityIndex
+
+
+@pytest.fixture(scope='module')
+def similar(catalog_index):
+    return SimilarityIndex(catalog_index.facets)
+
+
+def _brute_force(similar, position, k, allowed):
+    point = similar.vectors[position]
+    distances = sorted(
+        (sum((a - b) * (a - b) for a, b in zip(point, similar.vectors[other])), other)
+        for other in allowed if other != position)
+    return [other for _, other in distances[:k]]
+
+
+@pytest.mark.parametrize('filtered', [False, True], ids=['all', 'fuelType'])
+def test_nearest_matches_brute_force(similar, filtered):
+    rng = random.Random(7)
+    fuel_types = sorted(similar.facets.values['fuelType'])
+    config_ids = sorted(similar.position_of)
+    for _ in range(200):
+        config_id = rng.choice(config_ids)
+        k = rng.choice((1, 5, 10, 30))
+        categories = {'fuelType': [rng.choice(fuel_types)]} if filtered else None
+        position, neighbors = similar.nearest(config_id, k, categories)
+        if neighbors is None:
+            continue
+        tree = similar._tree_for(categories)
+        allowed = similar.indexed if categories is None else [
+            p for leaf in tree.leaves if leaf is not None for p in leaf]
+        assert [neighbor for _, neighbor in neighbors] == \
+            _brute_force(similar, position, k, allowed), (config_id, k, categories)
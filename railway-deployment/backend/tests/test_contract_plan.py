@@ -0,0 +1,36 @@
+"""
+openpyxl引擎测试：构建映射表时使用的模板副本不计入模板缓存统计，生成时间按UTC记录
+"""
+import io
+import os
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+from contract_plan import OpenpyxlContractWriter, build_fill_plan
+from fast_writer import CORE_PART, MODIFIED_RE
+from template_cache import TemplateCache
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api', 'template.xlsx')
+
+
+def test_cell_map_build_is_not_counted_in_cache_stats():
+    template_cache = TemplateCache(TEMPLATE_PATH)
+    writer = OpenpyxlContractWriter(template_cache)
+    plan = build_fill_plan({'buyerName': 'Buyer', 'contractNumber': 'SC-1'})
+    writer.render(plan)
+    writer.render(plan)
+    stats = template_cache.stats()
+    # 第一次渲染加载模板记为未命中，构建映射表的三个副本不计入
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert writer.stats()['peak_buffer_bytes_estimate'] > 0
+
+
+def test_modified_time_is_utc():
+    writer = OpenpyxlContractWriter(TemplateCache(TEMPLATE_PATH))
+    before = datetime.now(timezone.utc).replace(microsecond=0)
+    content = writer.render(build_fill_plan({'buyerName': 'Buyer', 'contractNumber': 'SC-1'}))
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        match = MODIFIED_RE.search(archive.read(CORE_PART).decode('utf-8'))
+    modified = match.group(0)[len(match.group(1)):-len(match.group(2))]
+    stamped = datetime.strptime(modified, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+    assert before <= stamped <= datetime.now(timezone.utc) + timedelta(seconds=1)
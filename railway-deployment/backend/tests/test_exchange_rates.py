@@ -0,0 +1,105 @@
+"""
+汇率服务测试：本地模拟上游，检查请求合并、过期刷新和熔断
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from exchange_rates import CircuitBreaker, ExchangeRateService, OpenExchangeRatesFetcher
+
+
+@pytest.fixture()
+def upstream():
+    """模拟Open Exchange Rates：记录请求次数，可设置延迟、故障和USD汇率"""
+    state = {'requests': 0, 'fail': False, 'delay': 0.2, 'usd': 0.14}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state['requests'] += 1
+            time.sleep(state['delay'])
+            if state['fail']:
+                self.send_response(503)
+                self.end_headers()
+                return
+            body = json.dumps({'base': 'USD', 'rates': {'USD': 1.0, 'CNY': 1 / state['usd'], 'EUR': 0.92}})
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body.encode('utf-8'))
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state['url'] = f'http://127.0.0.1:{server.server_port}/latest.json'
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def clock():
+    return [1000.0]
+
+
+@pytest.fixture()
+def service(upstream, clock):
+    return ExchangeRateService(
+        OpenExchangeRatesFetcher(upstream['url'], ('main',), timeout=2),
+        ttl=300, stale_ttl=600, breaker=CircuitBreaker(2, 30, clock=lambda: clock[0]), clock=lambda: clock[0])
+
+
+def _wait_live(service, currency):
+    deadline = time.time() + 5
+    while service.get(currency)['source'] != 'live' and time.time() < deadline:
+        time.sleep(0.02)
+
+
+def test_concurrent_requests_share_one_fetch(upstream, service):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.get('USD'))) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert upstream['requests'] == 1
+    assert len(results) == 20
+    assert all(result['source'] == 'live' and result['rate'] == pytest.approx(1 / 0.14) for result in results)
+
+
+def test_expired_rate_is_served_stale_and_refreshed_once(upstream, service, clock):
+    service.get('USD')
+    clock[0] += 400
+    upstream['usd'] = 0.1
+    assert all(service.get('USD')['source'] == 'stale' for _ in range(5))
+    _wait_live(service, 'USD')
+    assert upstream['requests'] == 2
+    assert service.get('USD')['rate'] == pytest.approx(10)
+
+
+def test_breaker_opens_on_failures_and_recovers(upstream, service, clock):
+    upstream['delay'] = 0
+    upstream['usd'] = 0.1
+    service.get('USD')
+
+    # 上游故障：返回旧值，连续失败2次后熔断，不再请求上游
+    upstream['fail'] = True
+    clock[0] += 2000
+    for _ in range(5):
+        result = service.get('USD')
+        assert result['source'] == 'stale' and result['rate'] == pytest.approx(10)
+    assert upstream['requests'] == 3
+    assert service.breaker.state == 'open'
+    assert service.get('EUR')['source'] == 'fallback'
+    assert upstream['requests'] == 3
+
+    # 冷却后试探请求成功，熔断恢复
+    upstream['fail'] = False
+    clock[0] += 31
+    assert service.get('USD')['source'] == 'live'
+    assert service.breaker.state == 'closed'
+    assert service.get('CNY')['rate'] == 1.0
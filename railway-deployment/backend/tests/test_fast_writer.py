@@ -0,0 +1,124 @@
+"""
+快速引擎测试：输出必须与openpyxl引擎一致
+除样式编号（快速引擎提前登记原始样式）和生成时间外，xlsx中每个部件的XML逐字节相同；样式按单元格解析后比较
+"""
+import io
+import os
+import re
+import zipfile
+from datetime import datetime
+
+import pytest
+
+import fast_writer
+from contract_plan import apply_fill_plan, build_fill_plan, save_workbook_to_bytes
+from fast_writer import CORE_PART, FastContractWriter, MODIFIED_RE
+from template_cache import TemplateCache
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api', 'template.xlsx')
+STYLE_ID_RE = re.compile(rb' s="\d+"')
+
+
+def _payloads():
+    """覆盖0/1/10/超过10行商品、空值、数字、布尔、公式、错误值和特殊字符"""
+    goods = [{'model': f'M{i}', 'description': f'车型 {i}', 'color': '白色', 'quantity': i + 1,
+              'unitPrice': 19999.5, 'totalAmount': (i + 1) * 19999.5} for i in range(12)]
+    base = {
+        'buyerName': 'Buyer & Co <Ltd>', 'buyerPhone': '+7 900 000', 'buyerAddress': ' 莫斯科 ',
+        'sellerName': 'SMAI', 'sellerPhone': '', 'sellerAddress': None,
+        'contractNumber': 'SC/2024-001', 'contractDate': '2024-03-05', 'contractLocation': 'Shanghai',
+        'bankInfo': 'Bank\nSWIFT: XXX', 'f22Value': 'FOB', 'paymentTerms': '30% T/T',
+        'totalAmount': 39999, 'amountInWords': 'SAY US DOLLARS', 'portOfLoading': 'Shanghai',
+        'finalDestination': 'Moscow', 'transportRoute': 'Shanghai Moscow 交车 交车 Delivery Delivery',
+        'modeOfShipment': 'Land'
+    }
+    return [
+        {**base, 'goodsData': []},
+        {**base, 'goodsData': goods[:1]},
+        {**base, 'goodsData': goods[:10]},
+        {**base, 'goodsData': goods, 'modeOfShipment': 'Rail', 'totalAmount': True},
+        {'buyerName': '=1+2', 'contractNumber': '1', 'bankInfo': '#N/A',
+         'goodsData': [{'quantity': 0.1 + 0.2, 'model': 12345678901234567890}, 'bad-row']},
+    ]
+
+
+def _cell_differences(expected_bytes, actual_bytes):
+    """逐个单元格比较值和解析后的样式，以及隐藏行、尺寸和合并单元格"""
+    from openpyxl import load_workbook
+
+    expected = load_workbook(io.BytesIO(expected_bytes))
+    actual = load_workbook(io.BytesIO(actual_bytes))
+    if expected.sheetnames != actual.sheetnames:
+        return [('sheetnames', expected.sheetnames, actual.sheetnames)]
+    differences = []
+    for name in expected.sheetnames:
+        expected_sheet = expected[name]
+        actual_sheet = actual[name]
+        for row in expected_sheet.iter_rows():
+            for cell in row:
+                other = actual_sheet[cell.coordinate]
+                for attr in ('value', 'font', 'fill', 'border', 'alignment', 'number_format', 'protection'):
+                    if repr(getattr(cell, attr)) != repr(getattr(other, attr)):
+                        differences.append((name, cell.coordinate, attr))
+        if (expected_sheet.max_row, expected_sheet.max_column) != (actual_sheet.max_row, actual_sheet.max_column):
+            differences.append((name, 'dimensions'))
+        for row, dimension in expected_sheet.row_dimensions.items():
+            other = actual_sheet.row_dimensions[row]
+            if (dimension.hidden, dimension.height) != (other.hidden, other.height):
+                differences.append((name, 'row', row))
+        if sorted(map(str, expected_sheet.merged_cells.ranges)) != sorted(map(str, actual_sheet.merged_cells.ranges)):
+            differences.append((name, 'merged_cells'))
+    return differences
+
+
+def _normalized_part(name, content):
+    if name.startswith('xl/worksheets/'):
+        return STYLE_ID_RE.sub(b'', content)
+    if name == CORE_PART:
+        return MODIFIED_RE.sub(r'\1\2', content.decode('utf-8')).encode('utf-8')
+    return content
+
+
+@pytest.fixture(scope='module')
+def template_cache():
+    return TemplateCache(TEMPLATE_PATH)
+
+
+@pytest.fixture(scope='module')
+def writer(template_cache):
+    return FastContractWriter(template_cache)
+
+
+@pytest.mark.parametrize('payload', _payloads(), ids=range(len(_payloads())))
+def test_fast_writer_matches_openpyxl(template_cache, writer, payload):
+    plan = build_fill_plan(payload)
+    workbook = template_cache.get_workbook()
+    apply_fill_plan(workbook, plan)
+    expected, _ = save_workbook_to_bytes(workbook)
+    actual = writer.render(plan)
+
+    with zipfile.ZipFile(io.BytesIO(expected)) as expected_zip, zipfile.ZipFile(io.BytesIO(actual)) as actual_zip:
+        assert expected_zip.namelist() == actual_zip.namelist()
+        for name in expected_zip.namelist():
+            # 样式表中多出提前登记的原始样式，由下面的单元格样式比较覆盖
+            if name == 'xl/styles.xml':
+                continue
+            assert _normalized_part(name, actual_zip.read(name)) == \
+                _normalized_part(name, expected_zip.read(name)), name
+    assert _cell_differences(expected, actual) == []
+
+
+def test_fast_writer_stamps_modified_time_per_render(writer, monkeypatch):
+    plan = build_fill_plan(_payloads()[0])
+    writer.render(plan)
+
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2030, 1, 2, 3, 4, 5, tzinfo=tz)
+
+    monkeypatch.setattr(fast_writer, 'datetime', FixedDatetime)
+    with zipfile.ZipFile(io.BytesIO(writer.render(plan))) as archive:
+        core = archive.read(CORE_PART).decode('utf-8')
+    assert MODIFIED_RE.search(core).group(0) == \
+        '<dcterms:modified xsi:type="dcterms:W3CDTF">2030-01-02T03:04:05Z</dcterms:modified>'
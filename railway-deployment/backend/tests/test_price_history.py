@@ -0,0 +1,23 @@
+"""
+价格历史测试：导入和合并只在历史目录中留下MANIFEST和段文件，写入锁不随数据提交
+"""
+import os
+
+from price_history import PriceHistory
+
+
+def test_lock_file_stays_out_of_history_dir(tmp_path):
+    history = PriceHistory(str(tmp_path / 'price-history'), segment_blocks=1, compact_segments=1)
+    history.ingest({'A.json': {1: 100000, 2: None}}, at=1000)
+    history.ingest({'A.json': {1: 98000}}, at=2000)
+    history.ingest({'A.json': {1: 98000, 3: 150000}}, at=3000)
+    history.compact()
+
+    names = os.listdir(history.path)
+    assert 'MANIFEST' in names
+    assert all(name == 'MANIFEST' or name.startswith('seg-') for name in names), names
+    assert os.path.dirname(history.lock_path()) != os.path.realpath(history.path)
+    assert not os.path.realpath(history.lock_path()).startswith(os.path.realpath(history.path) + os.sep)
+
+    assert [event['price'] for event in history.history(1)] == [100000, 98000]
+    assert history.repriced_since(1500)[0]['oldPrice'] == 100000
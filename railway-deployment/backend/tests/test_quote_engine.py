@@ -0,0 +1,249 @@
+"""
+批量报价引擎测试：
+- 各表单类型、各分支的结果固定为前端 js/calculationEngine.js 在页面上显示的值
+- numpy整批计算与逐行计算的结果相同
+- 安装了node时，随机参数逐项对比前端计算引擎
+"""
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+
+import pytest
+
+import quote_engine
+from quote_engine import (FORM_TYPES, normalize_params, parse_guide_price, quote_rows_numpy,
+                          quote_rows_scalar)
+
+JS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'js')
+
+# 页面上的常用费用，新车表单的币种和手续费率与页面默认值相同
+BASE = {'currency': 'USD', 'serviceFeeRate': 0.08, 'domesticShipping': 1500, 'compulsoryInsurance': 950,
+        'otherExpenses': 300}
+NO_RATE = {'costPrice': None, 'finalQuote': None, 'profit': None, 'foreignProfit': None}
+
+# (表单类型, 指导价, 参数, 期望结果)：期望值取自前端计算引擎在页面上显示的结果
+PINNED_CASES = {
+    'new/cif-and-fob': (
+        'new', 199800, dict(BASE, exchangeRate=7.1, seaFreight=1200, portCharges=800, portChargesFob=650,
+                            discount=5000, optionalEquipment=2000),
+        {'invoicePrice': 196800, 'serviceFee': 15744, 'taxRefund': 22640.71, 'purchaseCost': 194103,
+         'rmbQuote': 194103, 'costPrice': 26839, 'finalQuote': 28538, 'profit': 12063, 'foreignProfit': 1699}),
+    'new/no-exchange-rate': (
+        'new', 199800, dict(BASE, portCharges=800),
+        dict(NO_RATE, invoicePrice=199800, serviceFee=15984, taxRefund=22985.84, purchaseCost=196348,
+             rmbQuote=196348)),
+    'new/non-usd-sea-freight': (
+        'new', 199800, dict(BASE, exchangeRate=7.8, currency='EUR', usdBaseRate=7.18, seaFreight=1200,
+                            portChargesFob=650),
+        {'invoicePrice': 199800, 'serviceFee': 15984, 'taxRefund': 22985.84, 'purchaseCost': 196198,
+         'rmbQuote': 196198, 'costPrice': 24773, 'finalQuote': 26258, 'profit': 11583, 'foreignProfit': 1485}),
+    'used/usd': (
+        'used', 158800, dict(BASE, exchangeRate=7.2, seaFreight=1200, portCharges=800, qualificationFee=500,
+                             agencyFee=1000, markup=3000),
+        {'invoicePrice': 158800, 'purchaseTax': 14053.1, 'taxRefund': 18269.03, 'taxRefundFee': 457,
+         'purchaseCost': 160091, 'rmbQuote': 163091, 'costPrice': 23435, 'finalQuote': 23852, 'profit': 3002,
+         'foreignProfit': 417}),
+    'used/no-exchange-rate': (
+        'used', 158800, dict(BASE, markup=3000),
+        dict(NO_RATE, invoicePrice=158800, purchaseTax=14053.1, taxRefund=18269.03, taxRefundFee=457,
+             purchaseCost=157791, rmbQuote=160791)),
+    'used/non-usd-sea-freight': (
+        'used', 158800, dict(BASE, exchangeRate=92.5, currency='RUB', usdBaseRate=7.18, seaFreight=1500,
+                             markup=3000),
+        {'invoicePrice': 158800, 'purchaseTax': 14053.1, 'taxRefund': 18269.03, 'taxRefundFee': 457,
+         'purchaseCost': 157791, 'rmbQuote': 160791, 'costPrice': 1822, 'finalQuote': 1855, 'profit': 3053,
+         'foreignProfit': 33}),
+    'newEnergy/below-threshold': (
+        'newEnergy', 299800, dict(BASE, exchangeRate=7.1, seaFreight=1200, portChargesFob=650, markup=2000),
+        {'invoicePrice': 299800, 'purchaseTax': 0.0, 'taxRefund': 34490.27, 'taxRefundFee': 862,
+         'purchaseCost': 269572, 'rmbQuote': 271572, 'costPrice': 39168, 'finalQuote': 39450, 'profit': 2002,
+         'foreignProfit': 282}),
+    'newEnergy/at-threshold': (
+        'newEnergy', 349000, dict(BASE, exchangeRate=7.1, seaFreight=1200, discount=10000, markup=2000),
+        {'invoicePrice': 339000, 'purchaseTax': 0.0, 'taxRefund': 39000.0, 'taxRefundFee': 975,
+         'purchaseCost': 303725, 'rmbQuote': 305725, 'costPrice': 43978, 'finalQuote': 44260, 'profit': 2002,
+         'foreignProfit': 282}),
+    'newEnergy/above-threshold': (
+        'newEnergy', 459800, dict(BASE, exchangeRate=7.1, seaFreight=1200, portCharges=800, markup=2000),
+        {'invoicePrice': 459800, 'purchaseTax': 10690.27, 'taxRefund': 52897.35, 'taxRefundFee': 1322,
+         'purchaseCost': 422465, 'rmbQuote': 424465, 'costPrice': 60702, 'finalQuote': 60984, 'profit': 2002,
+         'foreignProfit': 282}),
+    'newEnergy/no-rmb-quote': (
+        'newEnergy', 459800, dict(BASE, exchangeRate=7.1, markup=-600000),
+        {'invoicePrice': 459800, 'purchaseTax': 10690.27, 'taxRefund': 52897.35, 'taxRefundFee': 1322,
+         'purchaseCost': 421665, 'rmbQuote': -178335, 'costPrice': 59389, 'finalQuote': None, 'profit': None,
+         'foreignProfit': None}),
+}
+
+
+@pytest.mark.parametrize('name', sorted(PINNED_CASES))
+@pytest.mark.parametrize('implementation', [quote_rows_scalar, quote_rows_numpy])
+def test_pinned_results(implementation, name):
+    if implementation is quote_rows_numpy and quote_engine.np is None:
+        pytest.skip('未安装numpy')
+    form_type, guide, params, expected = PINNED_CASES[name]
+    row = implementation(form_type, [guide], normalize_params(params)[0])[0]
+    assert {key: row[key] for key in expected} == expected
+
+
+@pytest.mark.parametrize('price, expected', [
+    ('9.98万', 99800),
+    (' 12.345万 ', 123450),
+    ('199,800元', 199800),
+    (158800, 158800.0),
+    ('暂无报价', math.nan),
+    (None, math.nan),
+    (True, math.nan),
+])
+def test_parse_guide_price(price, expected):
+    result = parse_guide_price(price)
+    assert result == expected or (math.isnan(expected) and math.isnan(result))
+
+
+def test_unparseable_guide_price_gives_empty_row():
+    row = quote_rows_scalar('new', [math.nan], normalize_params(BASE)[0])[0]
+    assert set(row.values()) == {None}
+
+
+# 前端表单的输入框ID：二手车和新能源表单使用各自的前缀和后缀
+_FORM_FIELDS = {
+    'new': {
+        'inputs': {'guidePrice': 'guidePrice', 'discount': 'discount', 'optionalEquipment': 'optionalEquipment',
+                   'serviceFeeRate': 'serviceFeeRate', 'domesticShipping': 'domesticShipping',
+                   'portCharges': 'portCharges', 'portChargesFob': 'portChargesFob',
+                   'compulsoryInsurance': 'compulsoryInsurance', 'otherExpenses': 'otherExpenses',
+                   'exchangeRate': 'exchangeRate', 'currency': 'currency', 'seaFreight': 'internationalShipping',
+                   'usdBaseRate': 'exchangeRateUSDBase'},
+        'outputs': {'invoicePrice': 'invoicePrice', 'taxRefund': 'taxRefund', 'purchaseCost': 'purchaseCost',
+                    'rmbQuote': 'rmbPrice', 'costPrice': 'costPrice', 'finalQuote': 'finalQuote',
+                    'profit': 'profit', 'foreignProfit': 'profitRate'},
+        'steps': ['calculateNewCarInvoicePrice', 'calculateNewCarTaxRefund', 'calculateNewCarPurchaseCost',
+                  'calculateNewCarRmbQuote']
+    }
+}
+for _form, _prefix, _suffix in (('used', 'used', 'Used'), ('newEnergy', 'newEnergy', 'NewEnergy')):
+    def _field(name, prefix=_prefix):
+        return prefix + name[0].upper() + name[1:]
+    _FORM_FIELDS[_form] = {
+        'inputs': {name: _field(name) for name in (
+            'guidePrice', 'discount', 'optionalEquipment', 'domesticShipping', 'portCharges', 'portChargesFob',
+            'compulsoryInsurance', 'otherExpenses', 'qualificationFee', 'agencyFee', 'markup')},
+        'outputs': {'invoicePrice': _field('invoicePrice'), 'purchaseTax': _field('purchaseTax'),
+                    'taxRefund': _field('taxRefund'), 'taxRefundFee': _field('taxRefundFee'),
+                    'purchaseCost': _field('purchaseCost'), 'rmbQuote': _field('rmbPrice'),
+                    'costPrice': 'costPrice' + _suffix, 'finalQuote': 'finalQuote' + _suffix,
+                    'profit': _field('profit'), 'foreignProfit': _field('profitRate')},
+        'steps': [f'calculate{"UsedCar" if _form == "used" else "NewEnergy"}{step}' for step in (
+            'InvoicePrice', 'TaxRefund', 'TaxRefundFee', 'PurchaseCost', 'RmbQuote')]
+    }
+    _FORM_FIELDS[_form]['inputs'].update({
+        'exchangeRate': 'exchangeRate' + _suffix, 'currency': 'currency' + _suffix,
+        'seaFreight': _field('internationalShipping'), 'usdBaseRate': 'exchangeRateUSDBase' + _suffix})
+
+# 在node中用假的DOM运行前端计算引擎，按页面的事件链依次调用各步骤
+_JS_HARNESS = r'''
+(async () => {
+  const elements = new Map();
+  const element = (id) => {
+    if (!elements.has(id)) {
+      elements.set(id, { id, value: '', textContent: '', parentElement: null,
+        classList: { add() {}, remove() {}, toggle() {} }, style: {} });
+    }
+    return elements.get(id);
+  };
+  globalThis.document = { getElementById: element, documentElement: { style: { setProperty() {} } } };
+  globalThis.window = { location: { hostname: 'localhost' } };
+  console.log = () => {};
+  const { CalculationEngine } = await import(require('url').pathToFileURL(process.argv[1]).href);
+  const input = JSON.parse(require('fs').readFileSync(0, 'utf-8'));
+  const results = input.cases.map((testCase) => {
+    const engine = new CalculationEngine();
+    for (const item of elements.values()) { item.value = ''; item.textContent = ''; }
+    for (const [id, value] of Object.entries(testCase.inputs)) element(id).value = value;
+    for (const step of testCase.steps) engine[step]();
+    const output = {};
+    for (const [name, id] of Object.entries(testCase.outputs)) output[name] = element(id).value;
+    return output;
+  });
+  process.stdout.write(JSON.stringify(results));
+})().catch((e) => { process.stderr.write(String(e.stack)); process.exit(1); });
+'''
+
+
+def random_cases(count, seed=1):
+    """生成覆盖各分支的随机报价参数"""
+    rng = random.Random(seed)
+    cases = []
+    for i in range(count):
+        form_type = FORM_TYPES[i % len(FORM_TYPES)]
+        params = {
+            'exchangeRate': rng.choice([0, 7.1, 7.2345, rng.uniform(0.5, 10)]),
+            'currency': rng.choice(['USD', 'USD', 'EUR']),
+            'usdBaseRate': rng.choice([None, 7.18]),
+            'seaFreight': rng.choice([0, 1200, rng.uniform(0, 3000)]),
+            'discount': rng.choice([0, 5000, rng.randint(0, 50000)]),
+            'optionalEquipment': rng.choice([0, rng.randint(0, 20000)]),
+            'domesticShipping': rng.choice([0, 1500, rng.uniform(0, 5000)]),
+            'portCharges': rng.choice([0, 800]),
+            'portChargesFob': rng.choice([0, 650]),
+            'compulsoryInsurance': rng.choice([0, 950]),
+            'otherExpenses': rng.choice([0, rng.randint(0, 3000)]),
+            'qualificationFee': rng.choice([0, 500]),
+            'agencyFee': rng.choice([0, 1000]),
+            'markup': rng.choice([0, 3000, -500000]),
+            'serviceFeeRate': rng.choice([0.04, 0.08, 0.13, 0.2])
+        }
+        guide = rng.choice([0, 99800, 339000, 345678, rng.randint(30000, 3000000),
+                            parse_guide_price(f'{rng.randint(3, 300)}.{rng.randint(0, 99):02d}万')])
+        cases.append((form_type, guide, params))
+    return cases
+
+
+def run_js_engine(cases, js_dir):
+    """在node中运行前端计算引擎，返回每个用例页面上显示的结果"""
+    payload = []
+    for form_type, guide, params in cases:
+        fields = _FORM_FIELDS[form_type]
+        inputs = {}
+        for name, element_id in fields['inputs'].items():
+            value = guide if name == 'guidePrice' else params.get(name)
+            if value is not None:
+                inputs[element_id] = str(value)
+        payload.append({'inputs': inputs, 'outputs': fields['outputs'], 'steps': fields['steps']})
+    engine_path = os.path.abspath(os.path.join(js_dir, 'calculationEngine.js'))
+    completed = subprocess.run(
+        ['node', '--input-type=commonjs', '-e', _JS_HARNESS, engine_path],
+        input=json.dumps({'cases': payload}), capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout)
+
+
+def _js_value(value):
+    """页面上的值：空字符串表示未计算"""
+    if value == '' or value is None:
+        return None
+    return float(value)
+
+
+@pytest.mark.skipif(quote_engine.np is None, reason='未安装numpy')
+def test_numpy_matches_scalar():
+    cases = [(form_type, guide, normalize_params(params)[0]) for form_type, guide, params in random_cases(1000)]
+    for form_type, guide, params in cases:
+        assert quote_rows_numpy(form_type, [guide], params) == quote_rows_scalar(form_type, [guide], params)
+    # 同一批参数下整批计算与逐行计算的结果也应一致
+    guides = [case[1] for case in cases]
+    for form_type, _, params in cases[:len(FORM_TYPES)]:
+        assert quote_rows_numpy(form_type, guides, params) == quote_rows_scalar(form_type, guides, params)
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='未安装node')
+def test_matches_js_engine():
+    cases = [(form_type, guide, normalize_params(params)[0]) for form_type, guide, params in random_cases(3000)]
+    js_results = run_js_engine(cases, JS_DIR)
+    for case, js_row in zip(cases, js_results):
+        python_row = quote_rows_scalar(case[0], [case[1]], case[2])[0]
+        assert {name: python_row[name] for name in js_row} == \
+            {name: _js_value(value) for name, value in js_row.items()}, case
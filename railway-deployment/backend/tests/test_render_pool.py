@@ -0,0 +1,50 @@
+"""
+渲染进程池测试：超时和提交失败转换为调用方可以处理的结果
+"""
+from concurrent.futures import Future
+
+import pytest
+
+from render_pool import RenderPool, RenderTimeoutError
+
+
+def _done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def test_render_timeout_raises_render_timeout_error(monkeypatch):
+    pool = RenderPool(None, 'openpyxl', 1)
+    pending = Future()
+    monkeypatch.setattr(pool, '_submit', lambda fn, arg, blocking: pending)
+    with pytest.raises(RenderTimeoutError):
+        pool.render({}, timeout=0.01)
+    assert pending.cancelled()
+
+
+def test_render_many_keeps_going_when_submit_fails(monkeypatch):
+    pool = RenderPool(None, 'openpyxl', 2)
+
+    def submit(fn, payload, blocking):
+        if payload['n'] == 1:
+            raise RuntimeError('进程池不可用')
+        return _done((f"{payload['n']}.xlsx", b'x', None))
+
+    monkeypatch.setattr(pool, '_submit', submit)
+    results = dict(pool.render_many([{'n': n} for n in range(4)]))
+    assert sorted(results) == [0, 1, 2, 3]
+    assert results[1][2] == '生成合同失败: 进程池不可用'
+    assert [results[n][0] for n in (0, 2, 3)] == ['0.xlsx', '2.xlsx', '3.xlsx']
+
+
+def test_generate_contract_timeout_returns_504(client, app_module, monkeypatch):
+    app_module.contract_services()
+
+    def render(plan, timeout=None):
+        raise RenderTimeoutError(timeout)
+
+    monkeypatch.setattr(app_module.render_pool, 'render', render)
+    response = client.post('/api/generate-contract', json={'buyerName': 'Timeout Buyer', 'contractNumber': 'TO-504'})
+    assert response.status_code == 504
+    assert '超时' in response.get_json()['error']
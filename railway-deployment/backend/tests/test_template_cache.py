@@ -0,0 +1,21 @@
+"""
+模板缓存测试：快照还原的工作副本与解析的模板行为相同
+"""
+import pickle
+
+from openpyxl import Workbook
+
+from template_cache import snapshot_workbook
+
+
+def test_snapshot_keeps_dimension_defaults():
+    """模板中没有的行、列尺寸在副本中可以直接创建"""
+    workbook = Workbook()
+    workbook.active.row_dimensions[2].height = 30
+    copy = pickle.loads(snapshot_workbook(workbook))
+    sheet = copy.active
+    assert sheet.row_dimensions.worksheet is sheet
+    assert sheet.row_dimensions[2].height == 30
+    sheet.row_dimensions[8].hidden = True
+    sheet.column_dimensions['C'].width = 12
+    assert sheet.row_dimensions[8].index == 8 and sheet.column_dimensions['C'].index == 'C'
@@ -0,0 +1,99 @@
+"""
+多模板测试：第二个模板使用与默认模板不同的布局，按templateId选择后写入自己的单元格，按自己的商品行容量隐藏行
+"""
+import io
+import json
+import os
+
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from contract_plan import format_shipment_mode
+from contract_renderer import ContractRenderer
+from template_registry import DEFAULT_LAYOUT, TemplateRegistry, UnknownTemplateError
+
+DEFAULT_TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api', 'template.xlsx')
+
+COMPACT_LAYOUT = {
+    'fillSheet': 'Contract',
+    'hideRowSheets': ['Contract', 'Copy'],
+    'fields': {'buyerName': 'A2', 'sellerName': 'A3', 'contractNumber': 'D2'},
+    'optionalFields': {'totalAmount': 'E12', 'modeOfShipment': 'B13'},
+    'goods': {'firstRow': 6, 'capacity': 4,
+              'columns': [['A', 'model', ''], ['B', 'quantity', 0], ['C', 'unitPrice', 0]]}
+}
+
+
+@pytest.fixture(scope='module')
+def registry(tmp_path_factory):
+    """默认模板 + 一个两页、4行商品、单元格位置完全不同的compact模板"""
+    directory = tmp_path_factory.mktemp('templates')
+    workbook = Workbook()
+    contract = workbook.active
+    contract.title = 'Contract'
+    copy = workbook.create_sheet('Copy')
+    for sheet in (contract, copy):
+        sheet['A1'] = 'SALES CONTRACT'
+        # 目标单元格预先写入占位值，与真实模板一样已经存在
+        for row in range(2, 14):
+            for column in 'ABCDE':
+                sheet[f'{column}{row}'] = '-'
+    workbook.save(directory / 'compact.xlsx')
+    with open(directory / 'templates.json', 'w', encoding='utf-8') as f:
+        json.dump({'default': 'default', 'templates': {
+            'default': {'path': DEFAULT_TEMPLATE_PATH},
+            'compact': {'path': 'compact.xlsx', 'description': '两页精简合同', 'layout': COMPACT_LAYOUT},
+        }}, f, ensure_ascii=False)
+    return TemplateRegistry.load(str(directory / 'templates.json'), DEFAULT_TEMPLATE_PATH)
+
+
+def _payload(**fields):
+    return {'buyerName': 'Compact Buyer', 'sellerName': 'SMAI', 'contractNumber': 'CP-1',
+            'totalAmount': 42000, 'modeOfShipment': 'Rail',
+            'goodsData': [{'model': 'M1', 'quantity': 2, 'unitPrice': 10000},
+                          {'model': 'M2', 'quantity': 1, 'unitPrice': 22000}], **fields}
+
+
+def test_registry_layouts(registry):
+    assert registry.default.layout.to_dict() == DEFAULT_LAYOUT.to_dict()
+    compact = registry.resolve('compact')
+    assert compact.layout.goods_capacity == 4
+    assert compact.describe()['fields'] == ['buyerName', 'sellerName', 'contractNumber', 'totalAmount', 'modeOfShipment']
+    with pytest.raises(UnknownTemplateError):
+        registry.resolve('missing')
+
+
+@pytest.mark.parametrize('engine', ['openpyxl', 'fast'])
+def test_second_template_renders_to_its_own_cells(registry, engine, monkeypatch):
+    renderer = ContractRenderer(registry, engine)
+    if engine == 'fast':
+        # 快速引擎不能回退到openpyxl
+        monkeypatch.setattr(renderer.template('compact').openpyxl_writer, 'render',
+                            lambda plan: pytest.fail('快速引擎回退到了openpyxl'))
+    plan = renderer.plan(_payload(templateId='compact'))
+    assert plan['template'] == 'compact'
+    workbook = load_workbook(io.BytesIO(renderer.render(plan)))
+
+    sheet = workbook['Contract']
+    assert (sheet['A2'].value, sheet['A3'].value, sheet['D2'].value) == ('Compact Buyer', 'SMAI', 'CP-1')
+    assert [[sheet[f'{column}{row}'].value for column in 'ABC'] for row in (6, 7)] == \
+        [['M1', 2, 10000], ['M2', 1, 22000]]
+    assert sheet['E12'].value == 42000
+    assert sheet['B13'].value == format_shipment_mode('Rail')
+    # 只隐藏该模板的第8、9行商品行，两页同时处理
+    for name in ('Contract', 'Copy'):
+        hidden = {row for row, dimension in workbook[name].row_dimensions.items() if dimension.hidden}
+        assert hidden == {8, 9}, name
+    # 默认布局的单元格没有被写入
+    assert sheet['C3'].value == '-' and sheet['G3'].value is None
+
+
+def test_default_template_is_used_without_template_id(registry):
+    renderer = ContractRenderer(registry)
+    plan = renderer.plan(_payload())
+    assert plan['template'] == 'default'
+    sheet = load_workbook(io.BytesIO(renderer.render(plan)))['SC']
+    assert (sheet['C3'].value, sheet['G3'].value) == ('Compact Buyer', 'CP-1')
+    hidden = {row for row, dimension in sheet.row_dimensions.items() if dimension.hidden}
+    assert hidden == set(range(13, 21))
+